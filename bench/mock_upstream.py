@@ -0,0 +1,220 @@
+"""
+豆包上游接口的本地模拟服务 (用于压测 server/api.py)
+
+模拟以下接口，不访问真实的 doubao.happieapi.top:
+- POST /api/upload               上传图片，返回图片URL
+- POST /api/video/create         创建视频任务，经过 --task-seconds 秒后完成
+- GET  /api/videos               按账号 (connect.sid) 返回视频列表
+- GET  /api/stats/video-count    视频统计
+- GET|HEAD /tos/{name}           类似 TOS 对象存储的视频下载 (支持 Range)
+- GET  /login                    Session 失效时的重定向目标
+
+可配置延迟、错误率、登录重定向比例与视频大小:
+
+    python bench/mock_upstream.py --port 9001 --latency 0.05 --error-rate 0.01 --video-size 5242880
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, UploadFile, File, Header
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+
+# 视频内容由固定的数据块重复生成，不占用磁盘
+VIDEO_BLOCK = hashlib.sha256(b"seedance-bench").digest() * 2048  # 64 KiB
+
+
+class MockConfig:
+    """模拟服务的运行参数 (由命令行设置)"""
+    latency = 0.05        # 接口基础延迟(秒)
+    jitter = 0.02         # 延迟随机抖动(秒)
+    error_rate = 0.0      # 返回 500 的比例
+    login_rate = 0.0      # 重定向到登录页 (模拟 Session 失效) 的比例
+    video_size = 5 * 1024 * 1024  # 视频文件大小(字节)
+    task_seconds = 10.0   # 任务从创建到完成的时间(秒)
+    videos = 200          # 启动时预置的已完成视频数
+    public_url = "http://127.0.0.1:9001"
+
+
+config = MockConfig()
+app = FastAPI(title="Seedance Mock Upstream")
+
+task_ids = itertools.count(100000)
+videos = []  # 最新的在前
+counters = {"upload": 0, "create": 0, "videos": 0, "video_count": 0, "tos": 0, "errors": 0, "login_redirects": 0}
+
+
+def session_of(cookie: str) -> str:
+    return (cookie or "").replace("connect.sid=", "")
+
+
+def video_url(task_id: int) -> str:
+    """带签名参数的视频地址，与真实 TOS 预签名URL的形式一致"""
+    signature = hashlib.md5(f"{task_id}{time.time()}".encode()).hexdigest()
+    return f"{config.public_url}/tos/video-{task_id}.mp4?X-Tos-Expires=3600&X-Tos-Signature={signature}"
+
+
+def seed_videos():
+    for _ in range(config.videos):
+        task_id = next(task_ids)
+        videos.append({"id": task_id, "taskId": str(task_id), "owner": None, "created_at": 0, "model": "seedance-1-5-pro-251215"})
+    videos.reverse()
+
+
+def render(video: dict) -> dict:
+    """任务状态按创建时间推算，无需后台定时器"""
+    completed = time.time() - video["created_at"] >= config.task_seconds
+    return {
+        "id": video["id"],
+        "taskId": video["taskId"],
+        "model": video["model"],
+        "prompt": video.get("prompt"),
+        "status": "completed" if completed else "processing",
+        "videoUrl": video_url(video["id"]) if completed else None,
+    }
+
+
+@app.middleware("http")
+async def upstream_behaviour(request: Request, call_next):
+    """为 /api 接口注入延迟、错误与登录重定向"""
+    if request.url.path.startswith("/api/"):
+        await asyncio.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+        roll = random.random()
+        if roll < config.login_rate:
+            counters["login_redirects"] += 1
+            return RedirectResponse("/login", status_code=302)
+        if roll < config.login_rate + config.error_rate:
+            counters["errors"] += 1
+            return JSONResponse({"ok": False, "error": "mock upstream error"}, status_code=500)
+    return await call_next(request)
+
+
+@app.get("/login")
+async def login():
+    return HTMLResponse("<html><body>login</body></html>")
+
+
+@app.post("/api/upload")
+async def upload(file: UploadFile = File(...)):
+    counters["upload"] += 1
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await file.read(65536):
+        digest.update(chunk)
+        size += len(chunk)
+    return {"ok": True, "url": f"{config.public_url}/tos/img-{digest.hexdigest()[:16]}.png", "size": size}
+
+
+@app.post("/api/video/create")
+async def create(request: Request, cookie: str = Header(default="")):
+    counters["create"] += 1
+    body = await request.json()
+    task_id = next(task_ids)
+    videos.insert(0, {
+        "id": task_id,
+        "taskId": str(task_id),
+        "owner": session_of(cookie),
+        "created_at": time.time(),
+        "model": body.get("model"),
+        "prompt": body.get("prompt"),
+    })
+    return {"ok": True, "taskId": f"{task_id}::{body.get('model')}", "id": task_id}
+
+
+@app.get("/api/videos")
+async def list_videos(cookie: str = Header(default="")):
+    counters["videos"] += 1
+    owner = session_of(cookie)
+    return {"ok": True, "items": [render(video) for video in videos if video["owner"] in (None, owner)]}
+
+
+@app.get("/api/stats/video-count")
+async def video_count(cookie: str = Header(default="")):
+    counters["video_count"] += 1
+    owner = session_of(cookie)
+    items = [render(video) for video in videos if video["owner"] in (None, owner)]
+    completed = sum(1 for item in items if item["status"] == "completed")
+    return {"total": len(items), "completed": completed, "processing": len(items) - completed}
+
+
+@app.api_route("/tos/{name}", methods=["GET", "HEAD"])
+async def tos_object(name: str, request: Request):
+    """模拟对象存储下载: 支持 Range / 206 / 416，按块流式返回"""
+    counters["tos"] += 1
+    size = config.video_size
+    start, end = 0, size - 1
+    status = 200
+
+    range_header = request.headers.get("range")
+    if range_header and range_header.startswith("bytes="):
+        first, _, last = range_header[6:].partition("-")
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(0, size - int(last))
+        if start >= size or start > end:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        status = 206
+
+    headers = {
+        "Content-Length": str(end - start + 1),
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{hashlib.md5(name.encode()).hexdigest()}"',
+    }
+    if status == 206:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    media_type = "image/png" if name.endswith(".png") else "video/mp4"
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+
+    async def body():
+        position = start
+        while position <= end:
+            offset = position % len(VIDEO_BLOCK)
+            length = min(len(VIDEO_BLOCK) - offset, end - position + 1)
+            yield VIDEO_BLOCK[offset:offset + length]
+            position += length
+
+    return StreamingResponse(body(), status_code=status, headers=headers, media_type=media_type)
+
+
+@app.get("/_stats")
+async def stats():
+    """模拟服务自身的调用计数"""
+    return {"videos": len(videos), **counters}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="豆包上游接口的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=MockConfig.latency, help="接口基础延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=MockConfig.jitter, help="延迟随机抖动(秒)")
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate, help="返回 500 的比例 (0-1)")
+    parser.add_argument("--login-rate", type=float, default=MockConfig.login_rate, help="重定向到登录页的比例 (0-1)")
+    parser.add_argument("--video-size", type=int, default=MockConfig.video_size, help="视频文件大小(字节)")
+    parser.add_argument("--task-seconds", type=float, default=MockConfig.task_seconds, help="任务完成所需时间(秒)")
+    parser.add_argument("--videos", type=int, default=MockConfig.videos, help="预置的已完成视频数")
+    args = parser.parse_args()
+
+    config.latency = args.latency
+    config.jitter = min(args.jitter, args.latency)
+    config.error_rate = args.error_rate
+    config.login_rate = args.login_rate
+    config.video_size = args.video_size
+    config.task_seconds = args.task_seconds
+    config.videos = args.videos
+    config.public_url = f"http://{args.host}:{args.port}"
+    seed_videos()
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+server/api.py 压测脚本
+
+默认在本地启动模拟上游 (mock_upstream.py) 和 API 服务，按固定并发依次压测
+视频代理、创建、列表、状态查询等路径，输出吞吐 (req/s)、p50/p99 延迟与 API 进程内存 (RSS)。
+
+    # 全部场景，并发 50，每个场景 2000 个请求
+    python bench/run_bench.py -c 50 -n 2000
+
+    # 只压测代理与列表，保存结果，并与上次结果比较 (吞吐下降或 p99 上升超过 20% 时退出码为 1)
+    python bench/run_bench.py -s proxy,list --save bench.json --compare baseline.json --threshold 0.2
+
+    # 压测已经在运行的服务 (不启动模拟上游，RSS 需要指定 --pid)
+    python bench/run_bench.py --api http://127.0.0.1:8000 --token sk-xxx --no-spawn --pid 12345
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(os.path.dirname(BENCH_DIR), "server")
+SCENARIOS = ("proxy", "create", "list", "status", "count")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_rss(pid: int) -> int:
+    """读取进程常驻内存(字节)，优先 /proc，其次 psutil，都不可用时返回 0"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return 0
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+
+class Environment:
+    """启动模拟上游与 API 服务，结束时全部停止"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = []
+        self.workdir = tempfile.mkdtemp(prefix="seedance-bench-")
+
+    def wait_ready(self, url: str, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(url, timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"服务未能在 {timeout} 秒内启动: {url}")
+
+    def start(self) -> tuple:
+        """返回 (API地址, API进程ID)"""
+        args = self.args
+        upstream_port, api_port = free_port(), free_port()
+
+        upstream = subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, "mock_upstream.py"),
+            "--port", str(upstream_port),
+            "--latency", str(args.latency),
+            "--error-rate", str(args.error_rate),
+            "--login-rate", str(args.login_rate),
+            "--video-size", str(args.video_size),
+            "--task-seconds", str(args.task_seconds),
+        ])
+        self.processes.append(upstream)
+        self.wait_ready(f"http://127.0.0.1:{upstream_port}/_stats")
+
+        env = {
+            **os.environ,
+            "DOUBAO_BASE_URL": f"http://127.0.0.1:{upstream_port}",
+            "DOUBAO_SESSION_COOKIE": ",".join(f"bench-session-{i}" for i in range(args.cookies)),
+            "AUTH_TOKEN": "",
+            "LOG_LEVEL": "WARNING",
+            "PROXY_CACHE_DIR": os.path.join(self.workdir, "proxy-cache"),
+            "PROXY_CACHE_MAX_BYTES": str(args.proxy_cache_bytes),
+            "UPLOAD_CACHE_PATH": os.path.join(self.workdir, "upload-cache.json"),
+            "JOB_DB_PATH": os.path.join(self.workdir, "jobs.db"),
+        }
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api:app", "--port", str(api_port), "--log-level", "warning"],
+            cwd=SERVER_DIR,
+            env=env
+        )
+        self.processes.append(api)
+        api_url = f"http://127.0.0.1:{api_port}"
+        self.wait_ready(f"{api_url}/")
+        return api_url, api.pid
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class Bench:
+    """按固定并发执行一个场景并统计结果"""
+
+    def __init__(self, client: httpx.AsyncClient, api_url: str, pid: int, concurrency: int, requests: int, duration: float):
+        self.client = client
+        self.api_url = api_url
+        self.pid = pid
+        self.concurrency = concurrency
+        self.requests = requests
+        self.duration = duration
+        self.task_ids = []
+        self.proxy_urls = []
+
+    async def prepare(self):
+        """准备状态查询与代理下载用到的任务ID和视频地址"""
+        response = await self.client.get(f"{self.api_url}/api/videos")
+        items = response.json().get("data") or []
+        self.task_ids = [str(item["taskId"]) for item in items if item.get("taskId")][:100]
+        self.proxy_urls = [item["videoUrl"] for item in items if item.get("videoUrl")][:20]
+        if not self.task_ids or not self.proxy_urls:
+            raise RuntimeError("上游视频列表为空，无法准备压测数据")
+
+    def build(self, scenario: str):
+        """返回生成第 n 个请求的函数: n -> (method, url, kwargs)"""
+        if scenario == "proxy":
+            return lambda n: ("GET", f"{self.api_url}/proxy/{self.proxy_urls[n % len(self.proxy_urls)]}", {})
+        if scenario == "create":
+            return lambda n: ("POST", f"{self.api_url}/api/video/create", {
+                "json": {"prompt": f"bench {time.time_ns()} {n}", "duration": 5}
+            })
+        if scenario == "list":
+            return lambda n: ("GET", f"{self.api_url}/api/videos", {})
+        if scenario == "status":
+            return lambda n: ("GET", f"{self.api_url}/api/video/{self.task_ids[n % len(self.task_ids)]}/status", {})
+        if scenario == "count":
+            return lambda n: ("GET", f"{self.api_url}/api/stats/video-count", {})
+        raise ValueError(f"未知场景: {scenario}")
+
+    async def run(self, scenario: str) -> dict:
+        make_request = self.build(scenario)
+        counter = itertools.count()
+        latencies = []
+        errors = {}
+        transferred = 0
+        deadline = time.monotonic() + self.duration if self.duration else None
+        rss_peak = read_rss(self.pid) if self.pid else 0
+        rss_start = rss_peak
+
+        async def worker():
+            nonlocal transferred
+            while True:
+                n = next(counter)
+                if n >= self.requests and not deadline:
+                    return
+                if deadline and time.monotonic() >= deadline:
+                    return
+                method, url, kwargs = make_request(n)
+                start = time.perf_counter()
+                try:
+                    async with self.client.stream(method, url, **kwargs) as response:
+                        body = b""
+                        async for chunk in response.aiter_raw():
+                            transferred += len(chunk)
+                            if scenario != "proxy":
+                                body += chunk
+                    outcome = response.status_code
+                    # 业务失败时接口仍返回 200，以 success=false 区分
+                    if outcome == 200 and body and json.loads(body).get("success") is False:
+                        outcome = "success=false"
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                if outcome != 200:
+                    errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+
+        async def sample_rss():
+            nonlocal rss_peak
+            while True:
+                await asyncio.sleep(0.2)
+                rss_peak = max(rss_peak, read_rss(self.pid))
+
+        sampler = asyncio.create_task(sample_rss()) if self.pid else None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+        if sampler:
+            sampler.cancel()
+
+        latencies.sort()
+        return {
+            "scenario": scenario,
+            "requests": len(latencies),
+            "errors": errors,
+            "elapsed": round(elapsed, 3),
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round((latencies[-1] if latencies else 0) * 1000, 2),
+            "mb_per_s": round(transferred / elapsed / 1024 / 1024, 1) if elapsed else 0.0,
+            "rss_start_mb": round(rss_start / 1024 / 1024, 1),
+            "rss_peak_mb": round(rss_peak / 1024 / 1024, 1),
+        }
+
+
+def print_report(results: list):
+    # 表头使用英文，避免中文字符宽度导致列不对齐
+    header = f"{'scenario':<10}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'MB/s':>8}{'RSS(MB)':>14}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        error_count = sum(r["errors"].values())
+        rss = f"{r['rss_start_mb']}→{r['rss_peak_mb']}"
+        print(f"{r['scenario']:<10}{r['requests']:>9}{error_count:>8}{r['rps']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}{r['mb_per_s']:>8}{rss:>14}")
+        if r["errors"]:
+            print(f"{'':<10}错误分布: {r['errors']}")
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> list:
+    """与基线结果比较，返回回退的描述列表"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if not base:
+            continue
+        if base["rps"] and r["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{r['scenario']}: 吞吐 {base['rps']} → {r['rps']} req/s")
+        if base["p99_ms"] and r["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(f"{r['scenario']}: p99 {base['p99_ms']} → {r['p99_ms']} ms")
+        if base["rss_peak_mb"] and r["rss_peak_mb"] > base["rss_peak_mb"] * (1 + threshold):
+            regressions.append(f"{r['scenario']}: RSS {base['rss_peak_mb']} → {r['rss_peak_mb']} MB")
+    return regressions
+
+
+async def run(args, api_url: str, pid: int) -> list:
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=args.timeout) as client:
+        bench = Bench(client, api_url, pid, args.concurrency, args.requests, args.duration)
+        await bench.prepare()
+        results = []
+        for scenario in args.scenarios:
+            print(f"[Bench] {scenario}: 并发 {args.concurrency} ...", flush=True)
+            results.append(await bench.run(scenario))
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="server/api.py 压测")
+    parser.add_argument("-s", "--scenarios", default=",".join(SCENARIOS), help=f"逗号分隔的场景: {','.join(SCENARIOS)}")
+    parser.add_argument("-c", "--concurrency", type=int, default=50, help="并发数")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="每个场景的请求数")
+    parser.add_argument("-d", "--duration", type=float, default=0, help="每个场景的持续时间(秒)，设置后忽略 -n")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求超时(秒)")
+    parser.add_argument("--api", default=None, help="压测已运行的 API 服务地址 (需配合 --no-spawn)")
+    parser.add_argument("--token", default=os.getenv("AUTH_TOKEN", "").split(",")[0], help="API 鉴权 Token")
+    parser.add_argument("--no-spawn", action="store_true", help="不启动模拟上游和 API 服务")
+    parser.add_argument("--pid", type=int, default=0, help="--no-spawn 时用于统计 RSS 的 API 进程ID")
+    parser.add_argument("--cookies", type=int, default=4, help="模拟的账号数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟上游接口延迟(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟上游返回 500 的比例")
+    parser.add_argument("--login-rate", type=float, default=0.0, help="模拟上游 Session 失效的比例")
+    parser.add_argument("--video-size", type=int, default=5 * 1024 * 1024, help="模拟视频大小(字节)")
+    parser.add_argument("--task-seconds", type=float, default=10, help="模拟任务完成时间(秒)")
+    parser.add_argument("--proxy-cache-bytes", type=int, default=0, help="API 的视频代理缓存容量，默认 0 (每次都从上游拉取)")
+    parser.add_argument("--env", action="append", default=[], help="传给 API 服务的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--save", help="结果保存为 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为回退的变化比例")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"未知场景: {scenario}")
+
+    environment = None
+    if args.no_spawn:
+        if not args.api:
+            parser.error("--no-spawn 需要同时指定 --api")
+        api_url, pid = args.api.rstrip("/"), args.pid
+    else:
+        environment = Environment(args)
+        api_url, pid = environment.start()
+
+    try:
+        results = asyncio.run(run(args, api_url, pid))
+    finally:
+        if environment:
+            environment.stop()
+
+    print()
+    print_report(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {args.save}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print("\n❌ 性能回退:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n✅ 未发现性能回退")
+
+
+if __name__ == "__main__":
+    main()
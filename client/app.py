@@ -6,7 +6,11 @@
 """
 
 import os
+import json
 import time
+import uuid
+import asyncio
+import hashlib
 import tempfile
 import httpx
 import gradio as gr
@@ -21,6 +25,19 @@ API_BASE_URL = os.getenv("API_BASE_URL", "https://seedanceapi.duckcloud.fun")
 # API鉴权Token
 AUTH_TOKEN = os.getenv("AUTH_TOKEN", "sk-doubao-video-2025")
 
+# Gradio 并发: 同时进行的生成任务数上限、排队等待的最大请求数
+GRADIO_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "20"))
+GRADIO_MAX_QUEUE = int(os.getenv("GRADIO_MAX_QUEUE", "100"))
+
+# 视频生成最长等待时间(秒)、事件推送不可用时的轮询间隔(秒)、界面进度刷新间隔(秒)
+MAX_WAIT_SECONDS = 600
+POLL_INTERVAL = 10
+PROGRESS_INTERVAL = 2
+
+# 视频状态
+COMPLETED_STATUSES = {"completed", "success", "done", "finished", "succeeded"}
+FAILED_STATUSES = {"failed", "error", "failure"}
+
 
 def get_auth_headers() -> dict:
     """获取包含鉴权信息的请求头"""
@@ -30,6 +47,20 @@ def get_auth_headers() -> dict:
     return headers
 
 
+# 所有生成任务共享的异步HTTP客户端 (在 Gradio 的事件循环中首次使用时创建)
+_http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=GRADIO_CONCURRENCY * 2 + 10)
+        )
+    return _http_client
+
+
 def _get_content_type(suffix: str) -> str:
     """获取文件MIME类型"""
     content_types = {
@@ -63,30 +94,42 @@ RATIO_OPTIONS = [
 ]
 
 
-def upload_image(file_path: str) -> dict:
+async def upload_image(file_path: str, ratio: str = None) -> dict:
     """
     上传图片到远程API服务
     参考 client.py 中的 upload_image 方法
+
+    ratio 为视频比例，服务端据此将图片缩放到所需尺寸
     """
     path = Path(file_path)
     if not path.exists():
         return {"success": False, "message": f"图片文件不存在: {file_path}"}
 
     try:
-        with httpx.Client(timeout=60.0) as client:
-            with open(path, "rb") as f:
-                files = {"file": (path.name, f, _get_content_type(path.suffix))}
-                response = client.post(
-                    f"{API_BASE_URL}/api/upload",
-                    files=files,
-                    headers=get_auth_headers()
-                )
-                return response.json()
+        client = get_http_client()
+        # 在线程中读取文件，不阻塞事件循环
+        content = await asyncio.to_thread(path.read_bytes)
+
+        # 先按内容哈希查询是否已上传过相同图片，命中时跳过上传
+        digest = hashlib.sha256(content).hexdigest()
+        params = {"radio": ratio} if ratio else None
+        lookup = await client.get(f"{API_BASE_URL}/api/upload/{digest}", params=params, headers=get_auth_headers())
+        if lookup.status_code == 200 and lookup.json().get("url"):
+            return lookup.json()
+
+        files = {"file": (path.name, content, _get_content_type(path.suffix))}
+        response = await client.post(
+            f"{API_BASE_URL}/api/upload",
+            files=files,
+            params=params,
+            headers=get_auth_headers()
+        )
+        return response.json()
     except Exception as e:
         return {"success": False, "message": f"上传失败: {str(e)}"}
 
 
-def create_video(prompt: str, model: str, duration: int, ratio: str, image_url: str = None) -> dict:
+async def create_video(prompt: str, model: str, duration: int, ratio: str, image_url: str = None) -> dict:
     """
     创建视频任务
     参考 client.py 中的 create_video_text2video 和 create_video_with_image_url 方法
@@ -100,72 +143,125 @@ def create_video(prompt: str, model: str, duration: int, ratio: str, image_url:
     if image_url:
         payload["image"] = image_url
 
+    # 超时后用同一个 Idempotency-Key 重试一次，服务端已收到的请求不会重复创建任务
+    headers = {**get_auth_headers(), "Idempotency-Key": uuid.uuid4().hex}
     try:
-        with httpx.Client(timeout=120.0) as client:
-            response = client.post(
-                f"{API_BASE_URL}/api/video/create",
-                json=payload,
-                headers=get_auth_headers()
-            )
-            return response.json()
+        for attempt in range(2):
+            try:
+                response = await get_http_client().post(
+                    f"{API_BASE_URL}/api/video/create",
+                    json=payload,
+                    headers=headers,
+                    timeout=120.0
+                )
+                return response.json()
+            except httpx.TransportError:
+                if attempt == 1:
+                    raise
     except Exception as e:
         return {"success": False, "message": f"创建视频失败: {str(e)}"}
 
 
-def get_videos() -> list:
+async def get_videos_status(task_ids: list) -> list:
     """
-    获取视频列表
-    参考 client.py 中的 list_videos 方法
+    批量查询视频状态 (服务端按任务所属账号查询)，返回找到的视频
+    参考 client.py 中的 get_videos_status 方法
     """
     try:
-        with httpx.Client(timeout=30.0) as client:
-            response = client.get(
-                f"{API_BASE_URL}/api/videos",
-                headers=get_auth_headers()
-            )
-            result = response.json()
-            if result.get("success"):
-                return result.get("data", [])
-            return []
+        response = await get_http_client().post(
+            f"{API_BASE_URL}/api/videos/status",
+            json={"task_ids": task_ids},
+            headers=get_auth_headers(),
+            timeout=30.0
+        )
+        result = response.json()
+        if result.get("success"):
+            return result.get("data", [])
+        return []
     except Exception as e:
-        print(f"[API] 获取视频列表失败: {e}")
+        print(f"[API] 查询视频状态失败: {e}")
         return []
 
 
-def find_video_by_task_id(task_id: str) -> dict:
+class VideoIndex:
     """
-    根据task_id从视频列表中查找视频
-    参考 client.py 中的 find_video_by_task_id 方法
+    视频列表索引
+
+    以 id、taskId、task_id 及核心任务ID(去掉 ::model 后缀)为键，
+    每次获取列表后增量更新，查找为常数时间；未命中时才退回到部分匹配
     """
-    videos = get_videos()
-    if not videos:
-        return None
 
-    # 提取核心task_id（去掉 ::model 后缀）
-    core_task_id = task_id.split("::")[0] if "::" in task_id else task_id
+    def __init__(self):
+        self.videos = []
+        self._by_key = {}
+
+    @staticmethod
+    def _core_id(task_id: str) -> str:
+        return task_id.split("::")[0] if "::" in task_id else task_id
+
+    def _keys(self, video: dict) -> set:
+        keys = set()
+        vid_id = video.get("id")
+        if vid_id is not None and vid_id != "":
+            keys.add(str(vid_id))
+        for field in ("taskId", "task_id"):
+            value = video.get(field)
+            if value:
+                keys.add(str(value))
+                keys.add(self._core_id(str(value)))
+        return keys
+
+    def update(self, videos: list):
+        """用新的视频列表更新索引"""
+        new_index = {}
+        for video in videos:
+            if isinstance(video, dict):
+                for key in self._keys(video):
+                    new_index.setdefault(key, video)
+        for key in self._by_key.keys() - new_index.keys():
+            del self._by_key[key]
+        self._by_key.update(new_index)
+        self.videos = videos
+
+    def find(self, task_id: str) -> dict:
+        """根据任务ID或视频ID查找视频，找不到返回None"""
+        task_id = str(task_id)
+        core_task_id = self._core_id(task_id)
+
+        # 精确匹配 / 核心ID匹配
+        video = self._by_key.get(task_id) or self._by_key.get(core_task_id)
+        if video is not None:
+            return video
 
-    for video in videos:
-        vid_task_id = video.get("taskId") or video.get("task_id") or ""
-        vid_id = str(video.get("id", ""))
+        # 部分匹配（task_id可能包含额外信息）
+        for video in self.videos:
+            if not isinstance(video, dict):
+                continue
+            vid_task_id = str(video.get("taskId") or video.get("task_id") or "")
+            if vid_task_id and core_task_id and (core_task_id in vid_task_id or vid_task_id in core_task_id):
+                return video
 
-        # 精确匹配
-        if task_id == vid_task_id or task_id == vid_id:
-            return video
+        return None
 
-        # 核心ID匹配
-        if core_task_id == vid_task_id or core_task_id == vid_id:
-            return video
 
-        # 部分匹配
-        if vid_task_id and core_task_id in vid_task_id:
-            return video
-        if core_task_id and vid_task_id and vid_task_id in core_task_id:
-            return video
+# 视频索引 (每次轮询查询状态后增量更新)
+_video_index = VideoIndex()
+
 
-    return None
+async def find_video_by_task_id(task_id: str) -> dict:
+    """
+    根据task_id查找视频
+    参考 client.py 中的 find_video_by_task_id 方法
+    """
+    videos = await get_videos_status([task_id])
+    if not videos:
+        return None
+
+    _video_index.update(videos)
+    return _video_index.find(task_id)
 
 
-def download_video_to_local(video_url: str) -> str:
+async def download_video_to_local(video_url: str) -> str:
     """
     下载视频到本地临时文件
     参考 client.py 中的 download_video 方法
@@ -193,31 +289,35 @@ def download_video_to_local(video_url: str) -> str:
         else:
             download_url = video_url
 
-        # 使用较长的超时时间，视频文件可能较大
-        with httpx.Client(timeout=300.0, follow_redirects=True) as client:
-            response = client.get(download_url)
-
-            if response.status_code == 200:
-                # 获取文件扩展名
-                content_type = response.headers.get("content-type", "")
-                if "mp4" in content_type or video_url.endswith(".mp4"):
-                    suffix = ".mp4"
-                elif "webm" in content_type or video_url.endswith(".webm"):
-                    suffix = ".webm"
-                else:
-                    suffix = ".mp4"  # 默认mp4
+        # 使用较长的超时时间，视频文件可能较大；流式写入临时文件，不在内存中缓存整个视频
+        client = get_http_client()
+        async with client.stream("GET", download_url, timeout=300.0, follow_redirects=True) as response:
+            if response.status_code != 200:
+                print(f"[Gradio] ❌ 视频下载失败: HTTP {response.status_code}")
+                return None
+
+            # 获取文件扩展名
+            content_type = response.headers.get("content-type", "")
+            if "mp4" in content_type or video_url.endswith(".mp4"):
+                suffix = ".mp4"
+            elif "webm" in content_type or video_url.endswith(".webm"):
+                suffix = ".webm"
+            else:
+                suffix = ".mp4"  # 默认mp4
 
-                # 创建临时文件
-                fd, temp_path = tempfile.mkstemp(suffix=suffix)
+            # 创建临时文件 (磁盘写入放到线程中，不阻塞事件循环)
+            fd, temp_path = tempfile.mkstemp(suffix=suffix)
+            try:
                 with os.fdopen(fd, 'wb') as f:
-                    f.write(response.content)
+                    async for chunk in response.aiter_bytes(1024 * 1024):
+                        await asyncio.to_thread(f.write, chunk)
+            except BaseException:
+                os.remove(temp_path)
+                raise
 
-                file_size = len(response.content) / (1024 * 1024)  # MB
-                print(f"[Gradio] ✅ 视频下载完成: {temp_path} ({file_size:.2f} MB)")
-                return temp_path
-            else:
-                print(f"[Gradio] ❌ 视频下载失败: HTTP {response.status_code}")
-                return None
+            file_size = os.path.getsize(temp_path) / (1024 * 1024)  # MB
+            print(f"[Gradio] ✅ 视频下载完成: {temp_path} ({file_size:.2f} MB)")
+            return temp_path
 
     except httpx.TimeoutException:
         print(f"[Gradio] ❌ 视频下载超时")
@@ -227,35 +327,96 @@ def download_video_to_local(video_url: str) -> str:
         return None
 
 
-def generate_video(prompt: str, model: str, duration: int, ratio: str, image=None):
-    """生成视频主函数 - 包含轮询等待逻辑"""
-    if not prompt or not prompt.strip():
-        return None, "❌ 请输入视频描述提示词"
+async def iter_task_events(task_id: str):
+    """
+    订阅远程API服务推送的任务状态事件 (SSE)，任务结束后迭代停止
+    参考 client.py 中的 AsyncDoubaoVideoClient.iter_task_events 方法
+    """
+    timeout = httpx.Timeout(10.0, read=60.0)
+    url = f"{API_BASE_URL}/api/video/{task_id}/events"
+    async with get_http_client().stream("GET", url, headers=get_auth_headers(), timeout=timeout) as response:
+        response.raise_for_status()
+        data_lines = []
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                data_lines.append(line[5:].strip())
+            elif not line and data_lines:
+                event = json.loads("\n".join(data_lines))
+                data_lines = []
+                yield event
+                if event.get("done"):
+                    return
+
+
+async def watch_task(task_id: str, updates: asyncio.Queue):
+    """
+    把任务状态变化放入队列，直到任务结束
 
-    max_wait_seconds = 600  # 最大等待10分钟
-    poll_interval = 10  # 每10秒轮询一次
+    优先使用API服务的事件推送 (所有任务共享服务端的一次轮询)，
+    推送不可用或中断时退回到定时查询视频列表
+    """
+    try:
+        async for event in iter_task_events(task_id):
+            await updates.put(event)
+            if event.get("done"):
+                return
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"[Gradio] ⚠️ 状态推送不可用，改为轮询: {e}")
+
+    while True:
+        video = await find_video_by_task_id(task_id)
+        if video:
+            status = (video.get("status") or "").lower()
+            done = status in COMPLETED_STATUSES or status in FAILED_STATUSES
+            await updates.put({
+                "status": status,
+                "done": done,
+                "video_url": video.get("url") or video.get("videoUrl") or video.get("video_url"),
+                "error": video.get("error") or video.get("message") if status in FAILED_STATUSES else None,
+                "video": video,
+            })
+            if done:
+                return
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def generate_video(prompt: str, model: str, duration: int, ratio: str, image=None):
+    """
+    生成视频主函数 (异步生成器)
+
+    提交任务后立即把进度推送到界面，等待期间不占用工作线程，
+    每 PROGRESS_INTERVAL 秒输出一次 (视频, 状态文本)，最后输出生成结果
+    """
+    if not prompt or not prompt.strip():
+        yield None, "❌ 请输入视频描述提示词"
+        return
 
     try:
         # 如果有图片，先上传
         image_url = None
         if image is not None:
             print("[Gradio] 📤 正在上传图片...")
-            upload_result = upload_image(image)
+            yield gr.update(), "📤 正在上传图片..."
+            upload_result = await upload_image(image, ratio)
             if not upload_result.get("success"):
-                return None, f"❌ 图片上传失败: {upload_result.get('message', '未知错误')}"
+                yield None, f"❌ 图片上传失败: {upload_result.get('message', '未知错误')}"
+                return
             image_url = upload_result.get("url")
             if not image_url:
-                return None, "❌ 上传成功但未获取到图片URL"
+                yield None, "❌ 上传成功但未获取到图片URL"
+                return
             print(f"[Gradio] ✅ 图片上传成功: {image_url}")
 
         # 创建视频任务
         mode = "图生视频" if image_url else "文生视频"
         print(f"[Gradio] 🎬 正在提交{mode}任务到远程服务器...")
+        yield gr.update(), f"🎬 正在提交{mode}任务到远程服务器..."
 
-        create_result = create_video(prompt, model, duration, ratio, image_url)
+        create_result = await create_video(prompt, model, duration, ratio, image_url)
 
         if not create_result.get("success"):
-            return None, f"❌ 创建任务失败: {create_result.get('message', '未知错误')}"
+            yield None, f"❌ 创建任务失败: {create_result.get('message', '未知错误')}"
+            return
 
         # 提取task_id
         task_data = create_result.get("data", {})
@@ -263,59 +424,73 @@ def generate_video(prompt: str, model: str, duration: int, ratio: str, image=Non
         task_id = task.get("task_id") or task_data.get("taskId") or task_data.get("task_id") or task_data.get("id")
 
         if not task_id:
-            return None, f"⚠️ 任务已提交({mode})，但无法获取任务ID，请稍后手动查询"
+            yield None, f"⚠️ 任务已提交({mode})，但无法获取任务ID，请稍后手动查询"
+            return
 
         print(f"[Gradio] ✅ 任务创建成功! 任务ID: {task_id}")
 
-        # 轮询等待视频生成完成
+        # 等待视频生成完成，期间定时把进度推送到界面
         start_time = time.time()
-        elapsed = 0
         progress_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
-
-        while elapsed < max_wait_seconds:
-            # 查找视频
-            video = find_video_by_task_id(task_id)
-
-            if video:
-                status = (video.get("status") or "").lower()
-                video_url = video.get("url") or video.get("videoUrl") or video.get("video_url")
-
-                # 检查完成状态
-                if status in ["completed", "success", "done", "finished", "succeeded"]:
-                    print(f"[Gradio] 🎉 视频生成完成!")
-                    if video_url:
-                        print(f"[Gradio] 📎 视频远程地址: {video_url}")
-                        # 下载视频到本地，避免Gradio直接访问外网URL导致DNS解析失败
-                        local_path = download_video_to_local(video_url)
-                        if local_path:
-                            return local_path, f"✅ 视频生成成功! ({mode})\n⏱️ 耗时: {int(elapsed)}秒\n🔗 远程服务: {API_BASE_URL}\n📎 视频URL: {video_url}\n💡 已通过代理下载到本地"
-                        else:
-                            # 下载失败时返回代理URL供用户手动下载
-                            proxy_url = f"{API_BASE_URL}/proxy/{video_url}"
-                            return None, f"⚠️ 视频生成完成但下载失败\n📎 原始URL: {video_url}\n🔗 代理URL: {proxy_url}\n请复制代理链接手动下载"
-                    else:
-                        return None, f"⚠️ 视频生成完成但未获取到URL"
-
-                # 检查失败状态
-                if status in ["failed", "error", "failure"]:
-                    error_msg = video.get("error") or video.get("message") or "未知错误"
-                    return None, f"❌ 视频生成失败: {error_msg}"
-
-            # 更新进度
-            elapsed = time.time() - start_time
-            idx = int(elapsed / poll_interval) % len(progress_chars)
-            print(f"[Gradio] {progress_chars[idx]} 视频生成中... 已等待 {int(elapsed)}秒")
-
-            # 等待下次轮询
-            time.sleep(poll_interval)
-
-        # 超时
-        return None, f"⏰ 等待超时({max_wait_seconds}秒)，任务ID: {task_id}\n请稍后使用任务ID查询结果"
+        updates = asyncio.Queue()
+        watcher = asyncio.create_task(watch_task(task_id, updates))
+        status = "pending"
+        event = None
+
+        try:
+            while True:
+                elapsed = time.time() - start_time
+                if elapsed >= MAX_WAIT_SECONDS:
+                    yield None, f"⏰ 等待超时({MAX_WAIT_SECONDS}秒)，任务ID: {task_id}\n请稍后使用任务ID查询结果"
+                    return
+
+                try:
+                    event = await asyncio.wait_for(updates.get(), PROGRESS_INTERVAL)
+                except asyncio.TimeoutError:
+                    if watcher.done() and updates.empty():
+                        # 状态查询出错退出
+                        raise watcher.exception() or RuntimeError("状态查询已停止")
+                else:
+                    status = (event.get("status") or status).lower()
+                    if event.get("done"):
+                        break
+
+                idx = int(elapsed / PROGRESS_INTERVAL) % len(progress_chars)
+                yield gr.update(), f"{progress_chars[idx]} 视频生成中({mode})... 已等待 {int(elapsed)}秒\n🆔 任务ID: {task_id}\n📊 状态: {status}"
+        finally:
+            watcher.cancel()
+
+        elapsed = time.time() - start_time
+        video_url = event.get("video_url")
+
+        # 检查失败状态
+        if status not in COMPLETED_STATUSES or event.get("error"):
+            # 上游报告的失败没有跟踪错误信息，取视频记录中的错误说明
+            video = event.get("video") or {}
+            error_msg = event.get("error") or video.get("error") or video.get("message") or "未知错误"
+            yield None, f"❌ 视频生成失败: {error_msg}"
+            return
+
+        print(f"[Gradio] 🎉 视频生成完成!")
+        if not video_url:
+            yield None, f"⚠️ 视频生成完成但未获取到URL"
+            return
+        print(f"[Gradio] 📎 视频远程地址: {video_url}")
+
+        # 下载视频到本地，避免Gradio直接访问外网URL导致DNS解析失败
+        yield gr.update(), f"📥 视频生成完成，正在下载... ({int(elapsed)}秒)"
+        local_path = await download_video_to_local(video_url)
+        if local_path:
+            yield local_path, f"✅ 视频生成成功! ({mode})\n⏱️ 耗时: {int(elapsed)}秒\n🔗 远程服务: {API_BASE_URL}\n📎 视频URL: {video_url}\n💡 已通过代理下载到本地"
+        else:
+            # 下载失败时返回代理URL供用户手动下载
+            proxy_url = f"{API_BASE_URL}/proxy/{video_url}"
+            yield None, f"⚠️ 视频生成完成但下载失败\n📎 原始URL: {video_url}\n🔗 代理URL: {proxy_url}\n请复制代理链接手动下载"
 
     except httpx.ConnectError:
-        return None, f"❌ 无法连接到远程API服务器: {API_BASE_URL}\n请检查网络连接和服务器状态"
+        yield None, f"❌ 无法连接到远程API服务器: {API_BASE_URL}\n请检查网络连接和服务器状态"
     except Exception as e:
-        return None, f"❌ 发生错误: {str(e)}"
+        yield None, f"❌ 发生错误: {str(e)}"
 
 
 # 构建Gradio界面
@@ -416,13 +591,14 @@ def create_ui():
         btn_8s.click(fn=lambda: 8, outputs=duration)
         btn_12s.click(fn=lambda: 12, outputs=duration)
 
-        # 生成视频
-        def process_generate(prompt_text, model_text, duration_val, ratio_text, image_file):
+        # 生成视频 (异步生成器: 进度实时推送到界面，等待期间不占用工作线程)
+        async def process_generate(prompt_text, model_text, duration_val, ratio_text, image_file):
             # 转换模型名称
             model_value = next((m[1] for m in MODEL_OPTIONS if m[0] == model_text), MODEL_OPTIONS[0][1])
             # 转换比例名称
             ratio_value = next((r[1] for r in RATIO_OPTIONS if r[0] == ratio_text), RATIO_OPTIONS[1][1])
-            return generate_video(prompt_text, model_value, int(duration_val), ratio_value, image_file)
+            async for update in generate_video(prompt_text, model_value, int(duration_val), ratio_value, image_file):
+                yield update
 
         generate_btn.click(
             fn=process_generate,
@@ -431,6 +607,8 @@ def create_ui():
             show_progress=True
         )
 
+    # 同时进行的生成任务数上限，超出的请求在队列中等待并显示排队位置
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_MAX_QUEUE)
     return demo
 
 
@@ -6,28 +6,169 @@
     python client.py image2video "猫咪跳跃起来" /path/to/cat.png
     python client.py list
     python client.py status <video_id>
+    python client.py batch jobs.jsonl --output results.jsonl --concurrency 10
 
 鉴权说明:
     如果服务端配置了 AUTH_TOKEN，需要通过 --token 参数或环境变量 AUTH_TOKEN 提供鉴权令牌
 """
 
 import argparse
+import asyncio
+import csv
+import hashlib
 import json
 import sys
 import time
 import os
+import uuid
 import httpx
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 
+# 下载时每次写入的块大小
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 分段下载时每段的最小大小，文件较小时不分段
+DOWNLOAD_MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """计算文件内容的 sha256，用于上传去重"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def part_meta_path(part_path: str) -> str:
+    """记录 .part 文件所属对象校验值 (ETag / Last-Modified) 的文件路径"""
+    return part_path + ".json"
+
+
+def save_part_validator(part_path: str, response: httpx.Response):
+    """从头下载时记录对象的校验值，续传时用作 If-Range"""
+    meta = {"etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified")}
+    with open(part_meta_path(part_path), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def remove_part_files(part_path: str):
+    """删除 .part 文件及其校验值记录"""
+    for path in (part_path, part_meta_path(part_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def resume_request(part_path: str) -> tuple:
+    """
+    返回续传的 (起始位置, 请求头)
+
+    请求头带上 If-Range，对象已变化时服务器返回 200 整个文件而不是拼接到旧内容后面；
+    .part 不存在或没有可用的校验值 (无法确认是同一个对象) 时从头下载
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if not offset:
+        return 0, {}
+    try:
+        with open(part_meta_path(part_path), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return 0, {}
+    # If-Range 只接受强 ETag，弱 ETag 时退回到 Last-Modified
+    etag = meta.get("etag")
+    validator = etag if etag and not etag.startswith("W/") else meta.get("last_modified")
+    if not validator:
+        return 0, {}
+    return offset, {"Range": f"bytes={offset}-", "If-Range": validator}
+
+
+def content_range_total(response: httpx.Response) -> int:
+    """解析 Content-Range 中的文件总大小，没有时返回None"""
+    content_range = response.headers.get("content-range", "")
+    total = content_range.rsplit("/", 1)[1] if "/" in content_range else ""
+    return int(total) if total.isdigit() else None
+
+
+class VideoIndex:
+    """
+    视频列表索引
+
+    以 id、taskId、task_id 及核心任务ID(去掉 ::model 后缀)为键，
+    每次获取列表后增量更新，查找为常数时间；未命中时才退回到部分匹配
+    """
+
+    def __init__(self):
+        self.videos = []
+        self._by_key = {}
+
+    @staticmethod
+    def _core_id(task_id: str) -> str:
+        return task_id.split("::")[0] if "::" in task_id else task_id
+
+    def _keys(self, video: dict) -> set:
+        keys = set()
+        vid_id = video.get("id")
+        if vid_id is not None and vid_id != "":
+            keys.add(str(vid_id))
+        for field in ("taskId", "task_id"):
+            value = video.get(field)
+            if value:
+                keys.add(str(value))
+                keys.add(self._core_id(str(value)))
+        return keys
+
+    def update(self, videos: list):
+        """用新的视频列表更新索引"""
+        new_index = {}
+        for video in videos:
+            if isinstance(video, dict):
+                for key in self._keys(video):
+                    new_index.setdefault(key, video)
+        for key in self._by_key.keys() - new_index.keys():
+            del self._by_key[key]
+        self._by_key.update(new_index)
+        self.videos = videos
+
+    def find(self, task_id: str) -> dict:
+        """根据任务ID或视频ID查找视频，找不到返回None"""
+        task_id = str(task_id)
+        core_task_id = self._core_id(task_id)
+
+        # 精确匹配 / 核心ID匹配
+        video = self._by_key.get(task_id) or self._by_key.get(core_task_id)
+        if video is not None:
+            return video
+
+        # 部分匹配（task_id可能包含额外信息）
+        for video in self.videos:
+            if not isinstance(video, dict):
+                continue
+            vid_task_id = str(video.get("taskId") or video.get("task_id") or "")
+            if vid_task_id and core_task_id and (core_task_id in vid_task_id or vid_task_id in core_task_id):
+                return video
+
+        return None
+
+
 class DoubaoVideoClient:
     """豆包视频生成客户端"""
 
+    COMPLETED_STATUSES = ["completed", "success", "done", "finished", "succeeded"]
+    FAILED_STATUSES = ["failed", "error", "failure"]
+    # 服务端排队已满 (429) 时的最大重试次数
+    CREATE_MAX_RETRIES = 5
+    # 可按 Retry-After 等待后重试的状态码: 排队已满 (429)、共享的创建请求被中断 (503)
+    CREATE_RETRY_STATUSES = (429, 503)
+
     def __init__(self, base_url: str = "http://localhost:8000", auth_token: str = None):
         self.base_url = base_url.rstrip("/")
         self.auth_token = auth_token or os.getenv("AUTH_TOKEN", "")
         self.client = httpx.Client(timeout=120.0)
+        self._video_index = VideoIndex()
 
     def __enter__(self):
         return self
@@ -42,12 +183,14 @@ class DoubaoVideoClient:
             headers["Authorization"] = f"Bearer {self.auth_token}"
         return headers
 
-    def upload_image(self, image_path: str) -> dict:
+    def upload_image(self, image_path: str, dedup: bool = True, radio: str = None) -> dict:
         """
         上传图片
 
         Args:
             image_path: 图片文件路径
+            dedup: 先按内容哈希查询服务端是否已上传过相同图片，命中时跳过上传
+            radio: 视频比例(可选)，服务端会将图片缩放到该比例所需的尺寸
 
         Returns:
             上传响应，包含图片URL
@@ -56,16 +199,77 @@ class DoubaoVideoClient:
         if not path.exists():
             raise FileNotFoundError(f"图片文件不存在: {image_path}")
 
+        if dedup:
+            cached = self.lookup_upload(file_sha256(path), radio)
+            if cached:
+                return cached
+
         with open(path, "rb") as f:
             files = {"file": (path.name, f, self._get_content_type(path.suffix))}
             response = self.client.post(
                 f"{self.base_url}/api/upload",
                 files=files,
+                params={"radio": radio} if radio else None,
                 headers=self._get_headers()
             )
 
         return response.json()
 
+    def _create_video(self, payload: dict) -> dict:
+        """
+        提交创建视频请求
+
+        服务端排队已满 (429) 或共享的创建请求被中断 (503) 时按 Retry-After 等待后重试；请求超时或连接中断时也会重试，
+        最多 CREATE_MAX_RETRIES 次。每次调用生成一个 Idempotency-Key 并在重试时复用，
+        服务端已收到的请求不会重复创建任务
+        """
+        headers = {**self._get_headers(), "Idempotency-Key": uuid.uuid4().hex}
+        for attempt in range(self.CREATE_MAX_RETRIES + 1):
+            try:
+                response = self.client.post(
+                    f"{self.base_url}/api/video/create",
+                    json=payload,
+                    headers=headers
+                )
+            except httpx.TransportError as e:
+                if attempt == self.CREATE_MAX_RETRIES:
+                    raise
+                print(f"请求失败 ({type(e).__name__})，重试...")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            if response.status_code not in self.CREATE_RETRY_STATUSES or attempt == self.CREATE_MAX_RETRIES:
+                break
+            retry_after = float(response.headers.get("retry-after", "5"))
+            print(f"服务端繁忙，{retry_after:.0f} 秒后重试...")
+            time.sleep(retry_after)
+
+        return self._create_result(response)
+
+    @staticmethod
+    def _create_result(response: httpx.Response) -> dict:
+        result = response.json()
+        if response.status_code == 429:
+            detail = result.get("detail") or {}
+            return {"success": False, "message": detail.get("message", "服务端繁忙"), **detail}
+        if response.status_code == 503:
+            return {"success": False, "message": result.get("detail") or "服务端繁忙"}
+        return result
+
+    def lookup_upload(self, digest: str, radio: str = None) -> dict:
+        """按内容哈希查询已上传的图片，未找到 (或服务端不支持) 时返回None"""
+        try:
+            response = self.client.get(
+                f"{self.base_url}/api/upload/{digest}",
+                params={"radio": radio} if radio else None,
+                headers=self._get_headers()
+            )
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        return result if result.get("success") and result.get("url") else None
+
     def create_video_text2video(
         self,
         prompt: str,
@@ -92,13 +296,7 @@ class DoubaoVideoClient:
             "radio": radio
         }
 
-        response = self.client.post(
-            f"{self.base_url}/api/video/create",
-            json=payload,
-            headers=self._get_headers()
-        )
-
-        return response.json()
+        return self._create_video(payload)
 
     def create_video_image2video(
         self,
@@ -123,7 +321,7 @@ class DoubaoVideoClient:
         """
         # 先上传图片
         print("正在上传图片...")
-        upload_result = self.upload_image(image_path)
+        upload_result = self.upload_image(image_path, radio=radio)
 
         if not upload_result.get("success"):
             return upload_result
@@ -143,13 +341,7 @@ class DoubaoVideoClient:
             "image": image_url
         }
 
-        response = self.client.post(
-            f"{self.base_url}/api/video/create",
-            json=payload,
-            headers=self._get_headers()
-        )
-
-        result = response.json()
+        result = self._create_video(payload)
         result["image_url"] = image_url
         return result
 
@@ -182,13 +374,7 @@ class DoubaoVideoClient:
             "image": image_url
         }
 
-        response = self.client.post(
-            f"{self.base_url}/api/video/create",
-            json=payload,
-            headers=self._get_headers()
-        )
-
-        return response.json()
+        return self._create_video(payload)
 
     def list_videos(self) -> dict:
         """
@@ -203,6 +389,25 @@ class DoubaoVideoClient:
         )
         return response.json()
 
+    def get_videos_status(self, task_ids: list) -> dict:
+        """
+        批量查询视频状态
+
+        每个任务都由服务端使用创建它的账号查询，多账号部署下也能找到
+
+        Args:
+            task_ids: 任务ID列表
+
+        Returns:
+            视频列表响应 (只包含找到的视频)
+        """
+        response = self.client.post(
+            f"{self.base_url}/api/videos/status",
+            json={"task_ids": list(task_ids)},
+            headers=self._get_headers()
+        )
+        return response.json()
+
     def get_video_status(self, video_id: str) -> dict:
         """
         查询视频状态
@@ -219,6 +424,69 @@ class DoubaoVideoClient:
         )
         return response.json()
 
+    def enqueue_job(
+        self,
+        prompt: str,
+        model: str = "seedance-1-5-pro-251215",
+        duration: int = 5,
+        radio: str = "16:9",
+        image_url: str = None,
+        priority: int = 0,
+        dedup: bool = True,
+        callback_url: str = None
+    ) -> dict:
+        """
+        提交到服务端持久化任务队列 (立即返回，由服务端负责提交和重试)
+
+        Args:
+            prompt: 视频描述提示词
+            model: 模型名称
+            duration: 视频时长(秒)
+            radio: 视频比例
+            image_url: 图片URL(图生视频时传入)
+            priority: 优先级，数值越大越先提交
+            dedup: 参数相同且尚未结束的任务是否直接返回已有任务
+            callback_url: 任务结束后回调通知的URL
+
+        Returns:
+            入队响应，data.job_id 为队列任务ID
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "duration": duration,
+            "radio": radio,
+            "priority": priority,
+            "dedup": dedup
+        }
+        if image_url:
+            payload["image"] = image_url
+        if callback_url:
+            payload["callback_url"] = callback_url
+
+        response = self.client.post(
+            f"{self.base_url}/api/jobs",
+            json=payload,
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    def get_job(self, job_id: str) -> dict:
+        """
+        查询队列任务状态
+
+        Args:
+            job_id: 队列任务ID
+
+        Returns:
+            任务状态响应
+        """
+        response = self.client.get(
+            f"{self.base_url}/api/jobs/{job_id}",
+            headers=self._get_headers()
+        )
+        return response.json()
+
     def get_video_count(self) -> dict:
         """
         获取视频统计
@@ -234,7 +502,7 @@ class DoubaoVideoClient:
 
     def find_video_by_task_id(self, task_id: str) -> dict:
         """
-        根据task_id从视频列表中查找视频
+        根据task_id查找视频
 
         Args:
             task_id: 任务ID
@@ -242,7 +510,7 @@ class DoubaoVideoClient:
         Returns:
             视频信息或None
         """
-        result = self.list_videos()
+        result = self.get_videos_status([task_id])
         if not result.get("success"):
             return None
 
@@ -250,45 +518,107 @@ class DoubaoVideoClient:
         if not isinstance(videos, list):
             return None
 
-        # 提取核心task_id（去掉 ::model 后缀）
-        core_task_id = task_id.split("::")[0] if "::" in task_id else task_id
+        self._video_index.update(videos)
+        return self._video_index.find(task_id)
 
-        for video in videos:
-            # 匹配 task_id 或 id
-            vid_task_id = video.get("taskId") or video.get("task_id") or ""
-            vid_id = str(video.get("id", ""))
+    def iter_task_events(self, task_id: str, read_timeout: float = 60.0, deadline: float = None):
+        """
+        订阅服务端推送的任务状态事件 (Server-Sent Events)
 
-            # 精确匹配
-            if task_id == vid_task_id or task_id == vid_id:
-                return video
+        Args:
+            task_id: 任务ID
+            read_timeout: 两次事件(含心跳)之间的最长等待时间(秒)
+            deadline: 截止时间 (time.time() 时间戳)，到达后停止订阅
 
-            # 核心ID匹配（去掉后缀）
-            if core_task_id == vid_task_id or core_task_id == vid_id:
-                return video
+        Yields:
+            状态事件字典，任务结束后迭代停止
+        """
+        url = f"{self.base_url}/api/video/{task_id}/events"
+        timeout = httpx.Timeout(10.0, read=read_timeout)
+        with self.client.stream("GET", url, headers=self._get_headers(), timeout=timeout) as response:
+            response.raise_for_status()
+            data_lines = []
+            for line in response.iter_lines():
+                if deadline and time.time() >= deadline:
+                    return
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].strip())
+                elif not line and data_lines:
+                    event = json.loads("\n".join(data_lines))
+                    data_lines = []
+                    yield event
+                    if event.get("done"):
+                        return
+
+    def _wait_via_events(self, task_id: str, max_wait_seconds: int, show_progress: bool):
+        """通过事件推送等待任务结束，服务端不支持或连接失败时返回None"""
+        start_time = time.time()
+        try:
+            for event in self.iter_task_events(task_id, deadline=start_time + max_wait_seconds):
+                elapsed = int(time.time() - start_time)
+                status = (event.get("status") or "").lower()
+                if show_progress:
+                    print(f"\r状态: {status or 'pending'} | 已等待: {elapsed}秒", end="", flush=True)
+
+                if event.get("done"):
+                    video = event.get("video") or {}
+                    if event.get("error") or status not in ["completed", "success", "done", "finished", "succeeded"]:
+                        if show_progress:
+                            print(f"\n视频生成失败!")
+                        return {
+                            "success": False,
+                            "status": status or "error",
+                            "message": event.get("error") or video.get("error") or video.get("message") or "视频生成失败",
+                            "task_id": task_id,
+                            "data": video
+                        }
+                    if show_progress:
+                        print(f"\n视频生成完成!")
+                    return {
+                        "success": True,
+                        "status": status,
+                        "video_url": event.get("video_url"),
+                        "task_id": task_id,
+                        "data": video
+                    }
+        except (httpx.HTTPError, ValueError) as e:
+            if show_progress:
+                print(f"事件推送不可用，改为轮询: {e}")
+            return None
 
-            # 部分匹配（task_id可能包含额外信息）
-            if vid_task_id and core_task_id in vid_task_id:
-                return video
-            if core_task_id and vid_task_id and vid_task_id in core_task_id:
-                return video
+        if time.time() - start_time < max_wait_seconds:
+            # 推送连接提前结束，剩余时间交给轮询
+            return None
 
-        return None
+        if show_progress:
+            print(f"\n等待超时!")
+        return {
+            "success": False,
+            "status": "timeout",
+            "message": f"等待超时({max_wait_seconds}秒)，请稍后使用 'status {task_id}' 命令查询",
+            "task_id": task_id
+        }
 
     def wait_for_video(
         self,
         task_id: str,
         max_wait_seconds: int = 600,
         poll_interval: int = 10,
-        show_progress: bool = True
+        show_progress: bool = True,
+        use_events: bool = True
     ) -> dict:
         """
         等待视频生成完成
 
+        优先订阅服务端的状态推送 (SSE)，视频完成后立即返回；
+        服务端不支持推送时退回到定时轮询
+
         Args:
             task_id: 任务ID
             max_wait_seconds: 最大等待时间(秒)
             poll_interval: 轮询间隔(秒)
             show_progress: 是否显示进度
+            use_events: 是否优先使用事件推送
 
         Returns:
             视频结果
@@ -298,6 +628,16 @@ class DoubaoVideoClient:
 
         if show_progress:
             print(f"任务ID: {task_id}")
+
+        if use_events:
+            if show_progress:
+                print(f"订阅视频生成状态推送 (最长等待 {max_wait_seconds} 秒)...")
+            result = self._wait_via_events(task_id, max_wait_seconds, show_progress)
+            if result is not None:
+                return result
+            elapsed = time.time() - start_time
+
+        if show_progress:
             print(f"开始轮询等待视频生成完成 (最长等待 {max_wait_seconds} 秒)...")
 
         while elapsed < max_wait_seconds:
@@ -351,6 +691,83 @@ class DoubaoVideoClient:
             "task_id": task_id
         }
 
+    def _final_result(self, task_id: str, status: str, video: dict, video_url: str = None, error: str = None) -> dict:
+        """构造 wait_for_video 格式的结果"""
+        if not error and status in self.COMPLETED_STATUSES:
+            return {
+                "success": True,
+                "status": status,
+                "video_url": video_url or video.get("url") or video.get("videoUrl") or video.get("video_url"),
+                "task_id": task_id,
+                "data": video
+            }
+        return {
+            "success": False,
+            "status": status or "error",
+            "message": error or video.get("error") or video.get("message") or "视频生成失败",
+            "task_id": task_id,
+            "data": video
+        }
+
+    def wait_for_videos(
+        self,
+        task_ids: list,
+        max_wait_seconds: int = 600,
+        poll_interval: int = 10,
+        show_progress: bool = True
+    ):
+        """
+        同时等待多个视频生成完成
+
+        每个轮询周期只发送一次批量状态查询，所有任务都从同一份结果中查找状态，
+        请求量与等待的任务数无关；服务端按任务所属账号查询，多账号部署下也能找到
+
+        Args:
+            task_ids: 任务ID列表
+            max_wait_seconds: 最大等待时间(秒)
+            poll_interval: 轮询间隔(秒)
+            show_progress: 是否显示进度
+
+        Yields:
+            每个任务结束时产出一个结果 (格式同 wait_for_video)，超时的任务最后产出
+        """
+        start_time = time.time()
+        pending = list(dict.fromkeys(task_ids))
+        total = len(pending)
+
+        while pending:
+            result = self.get_videos_status(pending)
+            videos = result.get("data", []) if result.get("success") else []
+            if isinstance(videos, list):
+                self._video_index.update(videos)
+
+            for task_id in list(pending):
+                video = self._video_index.find(task_id)
+                if not video:
+                    continue
+                status = (video.get("status") or "").lower()
+                if status in self.COMPLETED_STATUSES or status in self.FAILED_STATUSES:
+                    pending.remove(task_id)
+                    yield self._final_result(task_id, status, video)
+
+            elapsed = time.time() - start_time
+            if show_progress and pending:
+                print(f"\r已完成: {total - len(pending)}/{total} | 已等待: {int(elapsed)}秒", end="", flush=True)
+            if not pending or elapsed + poll_interval > max_wait_seconds:
+                break
+            time.sleep(poll_interval)
+
+        if show_progress:
+            print()
+
+        for task_id in pending:
+            yield {
+                "success": False,
+                "status": "timeout",
+                "message": f"等待超时({max_wait_seconds}秒)，请稍后使用 'status {task_id}' 命令查询",
+                "task_id": task_id
+            }
+
     def create_and_wait(
         self,
         prompt: str,
@@ -361,7 +778,8 @@ class DoubaoVideoClient:
         radio: str = "16:9",
         max_wait_seconds: int = 600,
         poll_interval: int = 10,
-        show_progress: bool = True
+        show_progress: bool = True,
+        use_events: bool = True
     ) -> dict:
         """
         创建视频并等待完成
@@ -376,6 +794,7 @@ class DoubaoVideoClient:
             max_wait_seconds: 最大等待时间(秒)
             poll_interval: 轮询间隔(秒)
             show_progress: 是否显示进度
+            use_events: 是否优先使用事件推送
 
         Returns:
             最终视频结果
@@ -385,7 +804,7 @@ class DoubaoVideoClient:
         if image_path and not image_url:
             if show_progress:
                 print("正在上传图片...")
-            upload_result = self.upload_image(image_path)
+            upload_result = self.upload_image(image_path, radio=radio)
             if not upload_result.get("success"):
                 return upload_result
             final_image_url = upload_result.get("url")
@@ -436,16 +855,23 @@ class DoubaoVideoClient:
             task_id=task_id,
             max_wait_seconds=max_wait_seconds,
             poll_interval=poll_interval,
-            show_progress=show_progress
+            show_progress=show_progress,
+            use_events=use_events
         )
 
-    def download_video(self, video_url: str, output_path: str = None) -> str:
+    def download_video(self, video_url: str, output_path: str = None, segments: int = 1, retries: int = 3) -> str:
         """
         下载视频到本地
 
+        边下载边写入 <输出路径>.part，完成后再重命名为目标文件；
+        连接中断时通过 Range 请求从已下载的位置继续，上次未完成的 .part 文件也会被续传
+        (<输出路径>.part.json 记录对象的 ETag / Last-Modified，对象已变化时从头下载)
+
         Args:
             video_url: 视频URL
             output_path: 输出路径，不指定则自动生成
+            segments: 分段并行下载的连接数，服务器不支持 Range 或文件较小时自动退回单连接
+            retries: 连接中断后的重试次数
 
         Returns:
             保存的文件路径
@@ -453,19 +879,109 @@ class DoubaoVideoClient:
         if not output_path:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             output_path = f"video_{timestamp}.mp4"
+        part_path = output_path + ".part"
 
         print(f"正在下载视频: {video_url}")
 
         with httpx.Client(timeout=300.0, follow_redirects=True) as download_client:
-            response = download_client.get(video_url)
-            response.raise_for_status()
-
-            with open(output_path, "wb") as f:
-                f.write(response.content)
-
+            size = self._probe_size(download_client, video_url) if segments > 1 else None
+            if size and size >= segments * DOWNLOAD_MIN_SEGMENT_SIZE:
+                print(f"分 {segments} 段并行下载 ({size / (1024 * 1024):.2f} MB)")
+                self._download_segmented(download_client, video_url, part_path, size, segments, retries)
+            else:
+                for attempt in range(retries + 1):
+                    try:
+                        self._download_stream(download_client, video_url, part_path)
+                        break
+                    except httpx.TransportError as e:
+                        if attempt == retries:
+                            raise
+                        print(f"下载中断 ({type(e).__name__})，从断点继续...")
+
+        os.replace(part_path, output_path)
+        remove_part_files(part_path)
         print(f"视频已保存到: {output_path}")
         return output_path
 
+    def _download_stream(self, download_client: httpx.Client, video_url: str, part_path: str):
+        """单连接流式下载，已存在的 .part 文件在对象未变化时从末尾续传"""
+        while True:
+            offset, headers = resume_request(part_path)
+            with download_client.stream("GET", video_url, headers=headers) as response:
+                if offset and response.status_code == 416:
+                    # 只有服务器报告的文件大小与 .part 一致时才说明已下载完整，否则不是同一个对象
+                    if content_range_total(response) == offset:
+                        return
+                    remove_part_files(part_path)
+                    continue
+                response.raise_for_status()
+
+                # 服务器忽略 Range 或对象已变化 (If-Range 不匹配) 时返回 200，需要从头写入
+                if response.status_code == 206:
+                    mode = "ab"
+                else:
+                    mode = "wb"
+                    save_part_validator(part_path, response)
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+            return
+
+    def _probe_size(self, download_client: httpx.Client, video_url: str) -> int:
+        """通过 Range 请求探测文件大小，服务器不支持 Range 时返回None"""
+        try:
+            with download_client.stream("GET", video_url, headers={"Range": "bytes=0-0"}) as response:
+                return content_range_total(response) if response.status_code == 206 else None
+        except httpx.HTTPError:
+            return None
+
+    def _download_segmented(
+        self,
+        download_client: httpx.Client,
+        video_url: str,
+        part_path: str,
+        size: int,
+        segments: int,
+        retries: int
+    ):
+        """多连接分段下载，各段写入 .part 文件的对应位置"""
+
+        def fetch(start: int, end: int):
+            position = start
+            for attempt in range(retries + 1):
+                try:
+                    headers = {"Range": f"bytes={position}-{end}"}
+                    with download_client.stream("GET", video_url, headers=headers) as response:
+                        if response.status_code != 206:
+                            raise RuntimeError(f"分段下载失败: HTTP {response.status_code}")
+                        with open(part_path, "r+b") as f:
+                            f.seek(position)
+                            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                f.write(chunk)
+                                position += len(chunk)
+                            f.flush()
+                            os.fsync(f.fileno())
+                    return
+                except httpx.TransportError:
+                    if attempt == retries:
+                        raise
+
+        # 分段下载的 .part 不记录校验值，中断后不会被单连接续传误用
+        remove_part_files(part_path)
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+
+        bounds = [(i * size // segments, (i + 1) * size // segments - 1) for i in range(segments)]
+        try:
+            with ThreadPoolExecutor(max_workers=segments) as executor:
+                list(executor.map(lambda bound: fetch(*bound), bounds))
+        except Exception:
+            # 分段文件中间可能有空洞，不能用于续传
+            os.remove(part_path)
+            raise
+
     def _get_content_type(self, suffix: str) -> str:
         """获取文件MIME类型"""
         content_types = {
@@ -479,6 +995,766 @@ class DoubaoVideoClient:
         return content_types.get(suffix.lower(), "application/octet-stream")
 
 
+class AsyncDoubaoVideoClient:
+    """
+    豆包视频生成异步客户端
+
+    接口与 DoubaoVideoClient 一致 (方法均为协程)，适合批量并发提交:
+
+        async with AsyncDoubaoVideoClient() as client:
+            results = await client.batch_create_and_wait(
+                [{"prompt": "日落海滩"}, {"prompt": "雪山", "duration": 8}],
+                concurrency=10
+            )
+    """
+
+    COMPLETED_STATUSES = DoubaoVideoClient.COMPLETED_STATUSES
+    FAILED_STATUSES = DoubaoVideoClient.FAILED_STATUSES
+    CREATE_MAX_RETRIES = DoubaoVideoClient.CREATE_MAX_RETRIES
+    CREATE_RETRY_STATUSES = DoubaoVideoClient.CREATE_RETRY_STATUSES
+
+    def __init__(self, base_url: str = "http://localhost:8000", auth_token: str = None, max_connections: int = 100):
+        self.base_url = base_url.rstrip("/")
+        self.auth_token = auth_token or os.getenv("AUTH_TOKEN", "")
+        self.client = httpx.AsyncClient(
+            timeout=120.0,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self._video_index = VideoIndex()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.client.aclose()
+
+    # 请求头与MIME类型的处理与同步客户端相同
+    _get_headers = DoubaoVideoClient._get_headers
+    _get_content_type = DoubaoVideoClient._get_content_type
+    _final_result = DoubaoVideoClient._final_result
+    _create_result = staticmethod(DoubaoVideoClient._create_result)
+
+    async def upload_image(self, image_path: str, dedup: bool = True, radio: str = None) -> dict:
+        """上传图片，参数与返回值同 DoubaoVideoClient.upload_image"""
+        path = Path(image_path)
+        if not path.exists():
+            raise FileNotFoundError(f"图片文件不存在: {image_path}")
+
+        if dedup:
+            cached = await self.lookup_upload(await asyncio.to_thread(file_sha256, path), radio)
+            if cached:
+                return cached
+
+        content = await asyncio.to_thread(path.read_bytes)
+        files = {"file": (path.name, content, self._get_content_type(path.suffix))}
+        response = await self.client.post(
+            f"{self.base_url}/api/upload",
+            files=files,
+            params={"radio": radio} if radio else None,
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def lookup_upload(self, digest: str, radio: str = None) -> dict:
+        """按内容哈希查询已上传的图片，未找到时返回None"""
+        try:
+            response = await self.client.get(
+                f"{self.base_url}/api/upload/{digest}",
+                params={"radio": radio} if radio else None,
+                headers=self._get_headers()
+            )
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        return result if result.get("success") and result.get("url") else None
+
+    async def _create_video(self, payload: dict, idempotency_key: str = None) -> dict:
+        headers = {**self._get_headers(), "Idempotency-Key": idempotency_key or uuid.uuid4().hex}
+        for attempt in range(self.CREATE_MAX_RETRIES + 1):
+            try:
+                response = await self.client.post(
+                    f"{self.base_url}/api/video/create",
+                    json=payload,
+                    headers=headers
+                )
+            except httpx.TransportError:
+                if attempt == self.CREATE_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            if response.status_code not in self.CREATE_RETRY_STATUSES or attempt == self.CREATE_MAX_RETRIES:
+                break
+            await asyncio.sleep(float(response.headers.get("retry-after", "5")))
+
+        return self._create_result(response)
+
+    async def create_video_text2video(
+        self,
+        prompt: str,
+        model: str = "seedance-1-5-pro-251215",
+        duration: int = 5,
+        radio: str = "16:9",
+        idempotency_key: str = None
+    ) -> dict:
+        """文生视频，参数与返回值同 DoubaoVideoClient.create_video_text2video (idempotency_key 不传时自动生成)"""
+        return await self._create_video({
+            "model": model,
+            "prompt": prompt,
+            "duration": duration,
+            "radio": radio
+        }, idempotency_key)
+
+    async def create_video_image2video(
+        self,
+        prompt: str,
+        image_path: str,
+        model: str = "seedance-1-5-pro-251215",
+        duration: int = 5,
+        radio: str = "16:9"
+    ) -> dict:
+        """图生视频 (先上传图片再创建视频)，参数与返回值同 DoubaoVideoClient.create_video_image2video"""
+        upload_result = await self.upload_image(image_path, radio=radio)
+        if not upload_result.get("success"):
+            return upload_result
+
+        image_url = upload_result.get("url")
+        if not image_url:
+            return {"success": False, "message": "上传成功但未获取到图片URL"}
+
+        result = await self.create_video_with_image_url(prompt, image_url, model, duration, radio)
+        result["image_url"] = image_url
+        return result
+
+    async def create_video_with_image_url(
+        self,
+        prompt: str,
+        image_url: str,
+        model: str = "seedance-1-5-pro-251215",
+        duration: int = 5,
+        radio: str = "16:9",
+        idempotency_key: str = None
+    ) -> dict:
+        """图生视频 (使用已有图片URL)，参数与返回值同 DoubaoVideoClient.create_video_with_image_url (idempotency_key 不传时自动生成)"""
+        return await self._create_video({
+            "model": model,
+            "prompt": prompt,
+            "duration": duration,
+            "radio": radio,
+            "image": image_url
+        }, idempotency_key)
+
+    async def list_videos(self) -> dict:
+        """获取视频列表"""
+        response = await self.client.get(
+            f"{self.base_url}/api/videos",
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def get_video_status(self, video_id: str) -> dict:
+        """查询视频状态"""
+        response = await self.client.get(
+            f"{self.base_url}/api/video/{video_id}/status",
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def enqueue_job(
+        self,
+        prompt: str,
+        model: str = "seedance-1-5-pro-251215",
+        duration: int = 5,
+        radio: str = "16:9",
+        image_url: str = None,
+        priority: int = 0,
+        dedup: bool = True,
+        callback_url: str = None
+    ) -> dict:
+        """提交到服务端持久化任务队列"""
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "duration": duration,
+            "radio": radio,
+            "priority": priority,
+            "dedup": dedup
+        }
+        if image_url:
+            payload["image"] = image_url
+        if callback_url:
+            payload["callback_url"] = callback_url
+
+        response = await self.client.post(
+            f"{self.base_url}/api/jobs",
+            json=payload,
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def get_job(self, job_id: str) -> dict:
+        """查询队列任务状态"""
+        response = await self.client.get(
+            f"{self.base_url}/api/jobs/{job_id}",
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def get_video_count(self) -> dict:
+        """获取视频统计"""
+        response = await self.client.get(
+            f"{self.base_url}/api/stats/video-count",
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def get_videos_status(self, task_ids: list) -> dict:
+        """批量查询视频状态，用法同 DoubaoVideoClient.get_videos_status"""
+        response = await self.client.post(
+            f"{self.base_url}/api/videos/status",
+            json={"task_ids": list(task_ids)},
+            headers=self._get_headers()
+        )
+        return response.json()
+
+    async def find_video_by_task_id(self, task_id: str) -> dict:
+        """根据task_id查找视频，找不到返回None"""
+        result = await self.get_videos_status([task_id])
+        if not result.get("success"):
+            return None
+
+        videos = result.get("data", [])
+        if not isinstance(videos, list):
+            return None
+
+        self._video_index.update(videos)
+        return self._video_index.find(task_id)
+
+    async def iter_task_events(self, task_id: str, read_timeout: float = 60.0):
+        """订阅服务端推送的任务状态事件 (SSE)，任务结束后迭代停止"""
+        url = f"{self.base_url}/api/video/{task_id}/events"
+        timeout = httpx.Timeout(10.0, read=read_timeout)
+        async with self.client.stream("GET", url, headers=self._get_headers(), timeout=timeout) as response:
+            response.raise_for_status()
+            data_lines = []
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].strip())
+                elif not line and data_lines:
+                    event = json.loads("\n".join(data_lines))
+                    data_lines = []
+                    yield event
+                    if event.get("done"):
+                        return
+
+    async def _wait_via_events(self, task_id: str) -> dict:
+        """通过事件推送等待任务结束，推送提前中断时返回None"""
+        async for event in self.iter_task_events(task_id):
+            if event.get("done"):
+                status = (event.get("status") or "").lower()
+                return self._final_result(task_id, status, event.get("video") or {}, event.get("video_url"), event.get("error"))
+        return None
+
+    async def _wait_via_polling(self, task_id: str, poll_interval: int) -> dict:
+        while True:
+            video = await self.find_video_by_task_id(task_id)
+            if video:
+                status = (video.get("status") or "").lower()
+                if status in self.COMPLETED_STATUSES or status in self.FAILED_STATUSES:
+                    return self._final_result(task_id, status, video)
+            await asyncio.sleep(poll_interval)
+
+    async def wait_for_video(
+        self,
+        task_id: str,
+        max_wait_seconds: int = 600,
+        poll_interval: int = 10,
+        use_events: bool = True
+    ) -> dict:
+        """
+        等待视频生成完成
+
+        优先使用服务端事件推送，不可用时退回到定时轮询；返回值同 DoubaoVideoClient.wait_for_video
+        """
+        start_time = time.time()
+        try:
+            if use_events:
+                try:
+                    result = await asyncio.wait_for(self._wait_via_events(task_id), max_wait_seconds)
+                    if result is not None:
+                        return result
+                except (httpx.HTTPError, ValueError):
+                    pass
+
+            remaining = max_wait_seconds - (time.time() - start_time)
+            if remaining > 0:
+                return await asyncio.wait_for(self._wait_via_polling(task_id, poll_interval), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+        return {
+            "success": False,
+            "status": "timeout",
+            "message": f"等待超时({max_wait_seconds}秒)，请稍后使用 'status {task_id}' 命令查询",
+            "task_id": task_id
+        }
+
+    async def wait_for_videos(self, task_ids: list, max_wait_seconds: int = 600, poll_interval: int = 10):
+        """同时等待多个视频生成完成 (每个轮询周期只发送一次批量状态查询)，用法同 DoubaoVideoClient.wait_for_videos"""
+        start_time = time.time()
+        pending = list(dict.fromkeys(task_ids))
+
+        while pending:
+            result = await self.get_videos_status(pending)
+            videos = result.get("data", []) if result.get("success") else []
+            if isinstance(videos, list):
+                self._video_index.update(videos)
+
+            for task_id in list(pending):
+                video = self._video_index.find(task_id)
+                if not video:
+                    continue
+                status = (video.get("status") or "").lower()
+                if status in self.COMPLETED_STATUSES or status in self.FAILED_STATUSES:
+                    pending.remove(task_id)
+                    yield self._final_result(task_id, status, video)
+
+            if not pending or time.time() - start_time + poll_interval > max_wait_seconds:
+                break
+            await asyncio.sleep(poll_interval)
+
+        for task_id in pending:
+            yield {
+                "success": False,
+                "status": "timeout",
+                "message": f"等待超时({max_wait_seconds}秒)，请稍后使用 'status {task_id}' 命令查询",
+                "task_id": task_id
+            }
+
+    async def create_and_wait(
+        self,
+        prompt: str,
+        image_path: str = None,
+        image_url: str = None,
+        model: str = "seedance-1-5-pro-251215",
+        duration: int = 5,
+        radio: str = "16:9",
+        max_wait_seconds: int = 600,
+        poll_interval: int = 10,
+        use_events: bool = True,
+        task_id: str = None,
+        idempotency_key: str = None,
+        on_submitted=None
+    ) -> dict:
+        """
+        创建视频并等待完成，参数与返回值同 DoubaoVideoClient.create_and_wait
+
+        以下参数用于批量任务的断点续跑:
+            task_id: 已提交过的任务ID，传入时不再创建，直接等待该任务完成
+            idempotency_key: 创建请求的幂等键，重复提交时服务端返回同一个任务
+            on_submitted: 任务创建成功后以任务ID为参数调用
+        """
+        if not task_id:
+            final_image_url = image_url
+            if image_path and not image_url:
+                upload_result = await self.upload_image(image_path, radio=radio)
+                if not upload_result.get("success"):
+                    return upload_result
+                final_image_url = upload_result.get("url")
+
+            if final_image_url:
+                create_result = await self.create_video_with_image_url(
+                    prompt, final_image_url, model, duration, radio, idempotency_key
+                )
+            else:
+                create_result = await self.create_video_text2video(prompt, model, duration, radio, idempotency_key)
+
+            if not create_result.get("success"):
+                return create_result
+
+            # 提取task_id
+            data = create_result.get("data", {})
+            task = data.get("task", {})
+            task_id = task.get("task_id") or data.get("taskId") or data.get("task_id") or data.get("id")
+
+            if not task_id:
+                return {
+                    "success": False,
+                    "message": "创建成功但无法获取任务ID",
+                    "data": create_result
+                }
+            if on_submitted:
+                on_submitted(task_id)
+
+        return await self.wait_for_video(
+            task_id=task_id,
+            max_wait_seconds=max_wait_seconds,
+            poll_interval=poll_interval,
+            use_events=use_events
+        )
+
+    async def iter_batch(self, jobs: list, concurrency: int = 5, **defaults):
+        """
+        并发执行一批 create_and_wait 任务，按完成顺序产出结果
+
+        Args:
+            jobs: 任务列表，每项为 create_and_wait 的关键字参数字典
+            concurrency: 同时进行中的任务数上限
+            **defaults: 所有任务共用的默认参数 (如 max_wait_seconds)
+
+        Yields:
+            (任务下标, 结果字典)
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index: int, job: dict):
+            async with semaphore:
+                try:
+                    return index, await self.create_and_wait(**{**defaults, **job})
+                except Exception as e:
+                    return index, {"success": False, "message": f"{type(e).__name__}: {e}"}
+
+        pending = [asyncio.create_task(run(index, job)) for index, job in enumerate(jobs)]
+        try:
+            for finished in asyncio.as_completed(pending):
+                yield await finished
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def batch_create_and_wait(self, jobs: list, concurrency: int = 5, **defaults) -> list:
+        """
+        并发执行一批 create_and_wait 任务
+
+        总耗时约等于最慢的一个任务，而不是所有任务之和
+
+        Returns:
+            与 jobs 顺序一致的结果列表
+        """
+        results = [None] * len(jobs)
+        async for index, result in self.iter_batch(jobs, concurrency, **defaults):
+            results[index] = result
+        return results
+
+    async def download_video(self, video_url: str, output_path: str = None, segments: int = 1, retries: int = 3) -> str:
+        """
+        下载视频到本地 (流式写入 .part 文件，中断后断点续传)，参数与返回值同 DoubaoVideoClient.download_video
+
+        文件读写在线程中进行，大文件下载不会阻塞事件循环中的其它协程
+        """
+        if not output_path:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = f"video_{timestamp}.mp4"
+        part_path = output_path + ".part"
+
+        size = await self._probe_size(video_url) if segments > 1 else None
+        if size and size >= segments * DOWNLOAD_MIN_SEGMENT_SIZE:
+            await self._download_segmented(video_url, part_path, size, segments, retries)
+        else:
+            for attempt in range(retries + 1):
+                try:
+                    await self._download_stream(video_url, part_path)
+                    break
+                except httpx.TransportError:
+                    if attempt == retries:
+                        raise
+
+        await asyncio.to_thread(os.replace, part_path, output_path)
+        await asyncio.to_thread(remove_part_files, part_path)
+        return output_path
+
+    @staticmethod
+    def _sync_to_disk(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    async def _download_stream(self, video_url: str, part_path: str):
+        while True:
+            offset, headers = await asyncio.to_thread(resume_request, part_path)
+            async with self.client.stream("GET", video_url, headers=headers, timeout=300.0, follow_redirects=True) as response:
+                if offset and response.status_code == 416:
+                    if content_range_total(response) == offset:
+                        return
+                    await asyncio.to_thread(remove_part_files, part_path)
+                    continue
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    mode = "ab"
+                else:
+                    mode = "wb"
+                    await asyncio.to_thread(save_part_validator, part_path, response)
+                f = await asyncio.to_thread(open, part_path, mode)
+                try:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+                    await asyncio.to_thread(self._sync_to_disk, f)
+                finally:
+                    await asyncio.to_thread(f.close)
+            return
+
+    async def _probe_size(self, video_url: str) -> int:
+        """通过 Range 请求探测文件大小，服务器不支持 Range 时返回None"""
+        try:
+            headers = {"Range": "bytes=0-0"}
+            async with self.client.stream("GET", video_url, headers=headers, timeout=300.0, follow_redirects=True) as response:
+                return content_range_total(response) if response.status_code == 206 else None
+        except httpx.HTTPError:
+            return None
+
+    async def _download_segmented(self, video_url: str, part_path: str, size: int, segments: int, retries: int):
+        """多连接分段下载，各段写入 .part 文件的对应位置"""
+
+        async def fetch(start: int, end: int):
+            position = start
+            for attempt in range(retries + 1):
+                try:
+                    headers = {"Range": f"bytes={position}-{end}"}
+                    async with self.client.stream("GET", video_url, headers=headers, timeout=300.0, follow_redirects=True) as response:
+                        if response.status_code != 206:
+                            raise RuntimeError(f"分段下载失败: HTTP {response.status_code}")
+                        f = await asyncio.to_thread(open, part_path, "r+b")
+                        try:
+                            await asyncio.to_thread(f.seek, position)
+                            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                                await asyncio.to_thread(f.write, chunk)
+                                position += len(chunk)
+                            await asyncio.to_thread(self._sync_to_disk, f)
+                        finally:
+                            await asyncio.to_thread(f.close)
+                    return
+                except httpx.TransportError:
+                    if attempt == retries:
+                        raise
+
+        def preallocate():
+            remove_part_files(part_path)
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        await asyncio.to_thread(preallocate)
+
+        bounds = [(i * size // segments, (i + 1) * size // segments - 1) for i in range(segments)]
+        fetches = [asyncio.ensure_future(fetch(*bound)) for bound in bounds]
+        try:
+            await asyncio.gather(*fetches)
+        except BaseException:
+            # 分段文件中间可能有空洞，不能用于续传
+            for task in fetches:
+                task.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+            os.remove(part_path)
+            raise
+
+    async def download_all(self, output_dir: str = ".", concurrency: int = 4) -> list:
+        """
+        并行下载视频列表中所有已完成的视频
+
+        文件名为核心任务ID，目标文件已存在时跳过；未完成的 .part 文件会被续传
+
+        Returns:
+            [{"id": ..., "path": ..., "success": ..., "message": ...}, ...]
+        """
+        result = await self.list_videos()
+        if not result.get("success"):
+            raise RuntimeError(result.get("message") or "获取视频列表失败")
+
+        output = Path(output_dir)
+        output.mkdir(parents=True, exist_ok=True)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(video: dict) -> dict:
+            video_id = str(video.get("taskId") or video.get("task_id") or video.get("id"))
+            video_url = video.get("url") or video.get("videoUrl") or video.get("video_url")
+            path = output / (video_id.split("::")[0].replace("/", "_") + ".mp4")
+            if path.exists():
+                return {"id": video_id, "path": str(path), "success": True, "message": "已存在，跳过"}
+            async with semaphore:
+                try:
+                    await self.download_video(video_url, str(path))
+                    print(f"已下载: {path}")
+                    return {"id": video_id, "path": str(path), "success": True}
+                except Exception as e:
+                    print(f"下载失败: {video_id} ({e})")
+                    return {"id": video_id, "path": str(path), "success": False, "message": str(e)}
+
+        videos = [
+            video for video in result.get("data", [])
+            if isinstance(video, dict)
+            and (video.get("status") or "").lower() in self.COMPLETED_STATUSES
+            and (video.get("url") or video.get("videoUrl") or video.get("video_url"))
+        ]
+        return await asyncio.gather(*(fetch(video) for video in videos))
+
+
+BATCH_JOB_FIELDS = ("prompt", "image", "model", "duration", "radio")
+
+
+def load_batch_manifest(manifest_path: str) -> list:
+    """
+    读取批量任务清单
+
+    支持 JSONL (每行一个JSON对象) 和 CSV (首行为表头) 两种格式，字段:
+        id (可选，默认为行号), prompt (必填), image (可选，本地路径或URL),
+        model, duration, radio (可选，未填写时使用命令行参数)
+
+    Returns:
+        [{"id": ..., "prompt": ..., ...}, ...]
+    """
+    path = Path(manifest_path)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    seen = set()
+    for line_no, row in enumerate(rows, start=1):
+        job = {key: row[key] for key in BATCH_JOB_FIELDS if row.get(key) not in (None, "")}
+        if not job.get("prompt"):
+            raise ValueError(f"清单第 {line_no} 项缺少 prompt")
+        job["id"] = str(row.get("id") or line_no)
+        if job["id"] in seen:
+            raise ValueError(f"清单中存在重复的 id: {job['id']}")
+        seen.add(job["id"])
+
+        if "duration" in job:
+            job["duration"] = int(job["duration"])
+        # 本地图片的相对路径以清单文件所在目录为基准
+        image = job.get("image")
+        if image and not image.startswith(("http://", "https://")) and not Path(image).is_absolute():
+            job["image"] = str(path.parent / image)
+        jobs.append(job)
+
+    return jobs
+
+
+def load_batch_results(output_path: str) -> dict:
+    """读取已有的结果文件，返回 {任务id: 最后一条记录}，用于断点续跑"""
+    results = {}
+    if not os.path.exists(output_path):
+        return results
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 进程中断时最后一行可能不完整
+                continue
+            if isinstance(record, dict) and record.get("id") is not None:
+                results[str(record["id"])] = record
+    return results
+
+
+async def run_batch(
+    client: "AsyncDoubaoVideoClient",
+    jobs: list,
+    output_path: str,
+    concurrency: int = 5,
+    retry_failed: bool = True,
+    **defaults
+) -> dict:
+    """
+    批量执行清单中的任务，每完成一个立即追加写入结果文件
+
+    结果文件中已成功的任务会被跳过 (retry_failed=False 时失败的任务也跳过)，
+    因此中断后使用相同参数重新执行即可从断点继续。
+
+    每个任务开始前先记录其幂等键 (state=pending)，创建成功后立即记录任务ID (state=submitted)；
+    续跑时已提交或等待超时的任务继续等待原任务，尚未确认提交的任务沿用原幂等键重新提交，
+    服务端会返回同一个任务，不会重复生成
+
+    Returns:
+        {"total": ..., "skipped": ..., "resumed": ..., "succeeded": ..., "failed": ...}
+    """
+    records = load_batch_results(output_path)
+
+    def in_flight(record: dict) -> bool:
+        """已开始但尚未得到最终结果的任务"""
+        return record.get("state") in ("pending", "submitted") or (
+            record.get("status") == "timeout" and bool(record.get("task_id"))
+        )
+
+    pending = [
+        job for job in jobs
+        if job["id"] not in records
+        or in_flight(records[job["id"]])
+        or (retry_failed and not records[job["id"]].get("success"))
+    ]
+    resumed = [job for job in pending if job["id"] in records and in_flight(records[job["id"]])]
+    summary = {
+        "total": len(jobs), "skipped": len(jobs) - len(pending), "resumed": len(resumed), "succeeded": 0, "failed": 0
+    }
+    if summary["skipped"] or resumed:
+        print(f"已完成 {summary['skipped']} 个任务，从断点继续执行剩余 {len(pending)} 个 (其中 {len(resumed)} 个已开始，沿用原任务)")
+
+    with open(output_path, "a", encoding="utf-8") as f:
+
+        def write_record(record: dict, sync: bool = True):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        calls = []
+        for job in pending:
+            kwargs = {key: job[key] for key in ("prompt", "model", "duration", "radio") if key in job}
+            image = job.get("image")
+            if image:
+                if image.startswith(("http://", "https://")):
+                    kwargs["image_url"] = image
+                else:
+                    kwargs["image_path"] = image
+
+            record = records.get(job["id"])
+            if record and in_flight(record) and record.get("idempotency_key"):
+                kwargs["idempotency_key"] = record["idempotency_key"]
+                if record.get("task_id"):
+                    kwargs["task_id"] = record["task_id"]
+            else:
+                kwargs["idempotency_key"] = uuid.uuid4().hex
+                write_record({"id": job["id"], "job": job, "state": "pending", "idempotency_key": kwargs["idempotency_key"]}, sync=False)
+
+            def on_submitted(task_id, job=job, idempotency_key=kwargs["idempotency_key"]):
+                write_record({
+                    "id": job["id"],
+                    "job": job,
+                    "state": "submitted",
+                    "task_id": task_id,
+                    "idempotency_key": idempotency_key,
+                    "submitted_at": datetime.now().isoformat(timespec="seconds"),
+                })
+
+            kwargs["on_submitted"] = on_submitted
+            calls.append(kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+
+        done = 0
+        async for index, result in client.iter_batch(calls, concurrency, **defaults):
+            job = pending[index]
+            write_record({
+                "id": job["id"],
+                "job": job,
+                **result,
+                "idempotency_key": calls[index]["idempotency_key"],
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+            })
+
+            done += 1
+            if result.get("success"):
+                summary["succeeded"] += 1
+                print(f"[{done}/{len(pending)}] {job['id']} 完成: {result.get('video_url')}")
+            else:
+                summary["failed"] += 1
+                print(f"[{done}/{len(pending)}] {job['id']} 失败: {result.get('message') or result.get('status')}")
+
+    return summary
+
+
 def main():
     parser = argparse.ArgumentParser(description="豆包 Seedance 视频生成客户端")
     parser.add_argument(
@@ -532,26 +1808,80 @@ def main():
 
     # 等待视频
     wait_parser = subparsers.add_parser("wait", help="等待视频生成完成")
-    wait_parser.add_argument("task_id", help="任务ID")
+    wait_parser.add_argument("task_id", nargs="+", help="任务ID (可传入多个，共用一次列表查询)")
     wait_parser.add_argument("--timeout", type=int, default=600, help="最大等待时间(秒)")
     wait_parser.add_argument("--interval", type=int, default=10, help="轮询间隔(秒)")
     wait_parser.add_argument("--download", "-d", action="store_true", help="下载视频到本地")
-    wait_parser.add_argument("--output", "-o", help="输出文件路径")
+    wait_parser.add_argument("--output", "-o", help="输出文件路径 (多个任务时为输出目录)")
 
     # 下载视频
     download_parser = subparsers.add_parser("download", help="下载视频")
     download_parser.add_argument("url", help="视频URL")
     download_parser.add_argument("--output", "-o", help="输出文件路径")
+    download_parser.add_argument("--segments", type=int, default=1, help="分段并行下载的连接数，默认1")
+
+    # 下载全部已完成视频
+    download_all_parser = subparsers.add_parser("download-all", help="并行下载所有已完成的视频")
+    download_all_parser.add_argument("--output", "-o", default=".", help="输出目录，默认当前目录")
+    download_all_parser.add_argument("--concurrency", "-c", type=int, default=4, help="同时下载的视频数，默认4")
 
     # 视频统计
     subparsers.add_parser("count", help="获取视频统计")
 
+    # 批量生成
+    batch_parser = subparsers.add_parser("batch", help="按清单批量生成视频 (支持断点续跑)")
+    batch_parser.add_argument("manifest", help="任务清单文件 (.jsonl 或 .csv)")
+    batch_parser.add_argument("--output", "-o", help="结果文件路径 (JSONL)，默认为 <清单名>.results.jsonl")
+    batch_parser.add_argument("--concurrency", "-c", type=int, default=5, help="同时进行中的任务数，默认5")
+    batch_parser.add_argument("--model", default="seedance-1-5-pro-251215", help="默认模型名称")
+    batch_parser.add_argument("--duration", type=int, default=5, help="默认视频时长(秒)")
+    batch_parser.add_argument("--radio", default="16:9", help="默认视频比例")
+    batch_parser.add_argument("--timeout", type=int, default=600, help="单个任务最大等待时间(秒)，默认600")
+    batch_parser.add_argument("--interval", type=int, default=10, help="轮询间隔(秒)，默认10")
+    batch_parser.add_argument("--skip-failed", action="store_true", help="续跑时不重试已失败的任务")
+
     args = parser.parse_args()
 
     if not args.command:
         parser.print_help()
         return
 
+    if args.command == "batch":
+        jobs = load_batch_manifest(args.manifest)
+        output_path = args.output or str(Path(args.manifest).with_suffix(".results.jsonl"))
+        print(f"共 {len(jobs)} 个任务，并发数 {args.concurrency}，结果写入: {output_path}")
+
+        async def run():
+            async with AsyncDoubaoVideoClient(args.server, auth_token=args.token) as client:
+                return await run_batch(
+                    client,
+                    jobs,
+                    output_path,
+                    concurrency=args.concurrency,
+                    retry_failed=not args.skip_failed,
+                    model=args.model,
+                    duration=args.duration,
+                    radio=args.radio,
+                    max_wait_seconds=args.timeout,
+                    poll_interval=args.interval
+                )
+
+        print_result({"success": True, **asyncio.run(run())})
+        return
+
+    if args.command == "download-all":
+        async def run_download_all():
+            async with AsyncDoubaoVideoClient(args.server, auth_token=args.token) as client:
+                return await client.download_all(args.output, args.concurrency)
+
+        results = asyncio.run(run_download_all())
+        print_result({
+            "success": all(r["success"] for r in results),
+            "total": len(results),
+            "failed": [r for r in results if not r["success"]]
+        })
+        return
+
     with DoubaoVideoClient(args.server, auth_token=args.token) as client:
         if args.command in ["text2video", "t2v"]:
             print(f"正在创建文生视频: {args.prompt}")
@@ -662,10 +1992,35 @@ def main():
                 result = client.get_video_status(args.video_id)
                 print_result(result)
 
+        elif args.command == "wait" and len(args.task_id) > 1:
+            print(f"等待 {len(args.task_id)} 个视频生成完成...")
+            results = []
+            for result in client.wait_for_videos(
+                task_ids=args.task_id,
+                max_wait_seconds=args.timeout,
+                poll_interval=args.interval
+            ):
+                results.append(result)
+                print(f"\n{result['task_id']}: {result.get('video_url') or result.get('message')}")
+
+                # 下载视频
+                if result.get("success") and (args.download or args.output) and result.get("video_url"):
+                    output_dir = Path(args.output or ".")
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    file_name = result["task_id"].split("::")[0].replace("/", "_") + ".mp4"
+                    client.download_video(result["video_url"], str(output_dir / file_name))
+
+            print_result({
+                "success": all(r.get("success") for r in results),
+                "total": len(results),
+                "succeeded": sum(1 for r in results if r.get("success")),
+                "results": results
+            })
+
         elif args.command == "wait":
-            print(f"等待视频生成完成: {args.task_id}")
+            print(f"等待视频生成完成: {args.task_id[0]}")
             result = client.wait_for_video(
-                task_id=args.task_id,
+                task_id=args.task_id[0],
                 max_wait_seconds=args.timeout,
                 poll_interval=args.interval
             )
@@ -678,7 +2033,7 @@ def main():
                     client.download_video(video_url, args.output)
 
         elif args.command == "download":
-            client.download_video(args.url, args.output)
+            client.download_video(args.url, args.output, segments=args.segments)
 
         elif args.command == "count":
             print("正在获取视频统计...")
@@ -3,25 +3,251 @@
 支持文生视频和图生视频两种模式
 """
 
+import io
 import os
+import sys
+import math
+import json
+import uuid
+import hmac
+import time
+import socket
+import hashlib
+import queue
+import ipaddress
+import bisect
+import random
 import asyncio
-import itertools
+import logging
+import logging.handlers
+import sqlite3
+import tempfile
+import atexit
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar, copy_context
 from typing import Optional, List
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
 from pydantic import BaseModel, Field
 import httpx
 from dotenv import load_dotenv
-from urllib.parse import unquote
+from urllib.parse import unquote, urlsplit, urlunsplit, parse_qsl, urlencode
 
 load_dotenv()
 
+# 日志配置: 级别、格式 (json 或 text)、高频日志 (每次请求的 Cookie 选择、视频代理) 的采样比例
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+
+# ==================== 日志 ====================
+
+# 当前请求的关联ID，由 RequestContextMiddleware 设置，同一请求内的日志共享
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# LogRecord 自带的属性，其余属性视为 extra 传入的结构化字段
+LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "sampled", "color_message"}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，extra 传入的字段原样合并"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in record.__dict__.items():
+            if key not in LOG_RECORD_ATTRS:
+                entry[key] = value
+        if getattr(record, "sampled", False):
+            entry["sample_rate"] = LOG_SAMPLE_RATE
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    在记录日志的线程中附加请求关联ID，并对标记为 sampled 的高频日志按 LOG_SAMPLE_RATE 采样
+
+    在入队前执行，被采样丢弃的日志不会进入队列
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False) and random.random() >= LOG_SAMPLE_RATE:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class RequestContextMiddleware:
+    """
+    为每个请求分配关联ID: 沿用请求头 X-Request-ID (调用方/网关传入时)，否则新生成；
+    同一请求内的所有日志都带上该ID，并通过响应头 X-Request-ID 返回给调用方
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id", "")
+        if not (0 < len(request_id) <= 64 and request_id.isprintable()):
+            request_id = uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    日志写入内存队列后立即返回，由单独的线程格式化并写到标准输出，
+    请求处理和事件循环不会因为输出阻塞；uvicorn 自身的日志也走同一个队列
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RequestContextFilter())
+
+    for name in ("seedance", "uvicorn", "uvicorn.error", "uvicorn.access"):
+        target = logging.getLogger(name)
+        target.handlers = [queue_handler]
+        target.propagate = False
+    logging.getLogger("seedance").setLevel(LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
+logger = logging.getLogger("seedance")
+http_log = logger.getChild("http")
+cookie_log = logger.getChild("cookie_pool")
+tracker_log = logger.getChild("tracker")
+webhook_log = logger.getChild("webhook")
+job_log = logger.getChild("job_queue")
+upload_log = logger.getChild("upload")
+proxy_log = logger.getChild("proxy")
+
+# 上游HTTP连接池配置 (所有路由共享同一个连接池，复用 TCP/TLS 连接)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+# HTTP/2 需要可选依赖 h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 全局共享的上游HTTP客户端
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的上游HTTP客户端 (正常情况下在应用启动时创建)"""
+    global http_client
+    if http_client is None:
+        if HTTP2_ENABLED and not HTTP2_AVAILABLE:
+            http_log.warning("未安装 h2，已回退到 HTTP/1.1 (pip install httpx[http2])")
+        http_client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+            follow_redirects=True,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+    return http_client
+
+
+def http_pool_stats() -> dict:
+    """统计共享连接池的使用情况"""
+    stats = {
+        "http2": HTTP2_ENABLED and HTTP2_AVAILABLE,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        "connections": 0,
+        "active": 0,
+        "idle": 0,
+        "queued_requests": 0,
+    }
+    # 连接池属于 httpcore 内部实现，取不到时只返回配置
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    if pool is None:
+        return stats
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for conn in connections if conn.is_idle())
+    stats["connections"] = len(connections)
+    stats["idle"] = idle
+    stats["active"] = len(connections) - idle
+    stats["queued_requests"] = sum(
+        1 for req in getattr(pool, "_requests", []) if getattr(req, "is_queued", lambda: False)()
+    )
+    return stats
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期: 启动时创建共享连接池，关闭时释放所有连接"""
+    global http_client
+    get_http_client()
+    if IMAGE_PREPROCESS and not PIL_AVAILABLE:
+        upload_log.warning("未安装 Pillow，图片预处理不会生效，将直接上传原图 (pip install Pillow)")
+    task_tracker.start()
+    webhook_dispatcher.start()
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        await task_tracker.stop()
+        await webhook_dispatcher.stop()
+        await upload_cache.close()
+        image_executor.shutdown(wait=False)
+        if http_client is not None:
+            await http_client.aclose()
+            http_client = None
+
+
 app = FastAPI(
     title="豆包 Seedance 视频生成 API",
     description="基于豆包 AI 的视频生成逆向接口，支持文生视频和图生视频",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS配置
@@ -31,7 +257,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+app.add_middleware(RequestContextMiddleware)
 
 # 配置
 BASE_URL = os.getenv("DOUBAO_BASE_URL", "https://doubao.happieapi.top")
@@ -44,6 +272,277 @@ AUTH_TOKENS: List[str] = [t.strip() for t in AUTH_TOKENS_RAW.split(",") if t.str
 # 解析多个cookie，支持逗号分隔
 SESSION_COOKIES: List[str] = [unquote(c.strip()) for c in SESSION_COOKIES_RAW.split(",") if c.strip()]
 
+# Cookie池: 被重定向到登录页或连续失败后的隔离时长(秒)，每次探测失败加倍直至上限；连续失败多少次后隔离
+COOKIE_QUARANTINE_BASE = float(os.getenv("COOKIE_QUARANTINE_BASE", "60"))
+COOKIE_QUARANTINE_MAX = float(os.getenv("COOKIE_QUARANTINE_MAX", "1800"))
+COOKIE_MAX_FAILURES = int(os.getenv("COOKIE_MAX_FAILURES", "3"))
+
+# 创建准入控制: 每个cookie同时进行中的创建请求上限、每分钟创建次数预算(0为不限)与突发容量，
+# 排队的最大请求数，以及单个请求最长排队时间(秒)，预计等待更久时直接返回429
+COOKIE_MAX_CONCURRENT_CREATES = int(os.getenv("COOKIE_MAX_CONCURRENT_CREATES", "2"))
+COOKIE_CREATE_RATE_PER_MINUTE = float(os.getenv("COOKIE_CREATE_RATE_PER_MINUTE", "0"))
+COOKIE_CREATE_BURST = int(os.getenv("COOKIE_CREATE_BURST", "3"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "200"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+
+# 创建幂等: Idempotency-Key 结果保留时长(秒)、最大条目数，是否合并参数完全相同且仍在进行中的创建请求
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+CREATE_COALESCE = os.getenv("CREATE_COALESCE", "false").lower() in ("1", "true", "yes")
+
+# 持久化任务队列: SQLite 数据库文件、并发提交的工作协程数、最大重试次数、退避基数/上限(秒)、已结束任务保留时长(秒)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "seedance-jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "5"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "300"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 86400)))
+
+# 视频代理配置: 每次转发的块大小(字节)，决定单个代理请求的缓冲上限
+PROXY_CHUNK_SIZE = int(os.getenv("PROXY_CHUNK_SIZE", str(64 * 1024)))
+
+# 视频代理请求头
+PROXY_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
+    "Accept": "*/*",
+    "Accept-Encoding": "identity",  # 不使用压缩，方便流式传输
+}
+
+# 需要转发给上游的客户端请求头 (断点续传/拖动播放)
+PROXY_FORWARD_HEADERS = ("range", "if-range")
+
+# 需要从上游响应中保留的响应头
+PROXY_PASSTHROUGH_HEADERS = {
+    "content-length": "Content-Length",
+    "content-range": "Content-Range",
+    "accept-ranges": "Accept-Ranges",
+    "content-disposition": "Content-Disposition",
+    "etag": "ETag",
+    "last-modified": "Last-Modified",
+}
+
+# 视频代理磁盘缓存: 目录与容量上限(字节)，容量为0时禁用缓存
+PROXY_CACHE_DIR = os.getenv("PROXY_CACHE_DIR", os.path.join(tempfile.gettempdir(), "seedance-proxy-cache"))
+PROXY_CACHE_MAX_BYTES = int(os.getenv("PROXY_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# 计算缓存键时忽略的签名类查询参数 (同一视频每次返回的签名不同)
+PROXY_CACHE_IGNORED_PARAM_PREFIXES = ("x-tos-", "x-amz-")
+PROXY_CACHE_IGNORED_PARAMS = {"signature", "expires", "awsaccesskeyid", "ossaccesskeyid", "security-token"}
+
+# 图片上传: 单个文件大小上限(字节)，以及从暂存文件读取并转发给上游的块大小(字节)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# 图片预处理: 上传前按EXIF方向旋转、缩放到目标比例所需的尺寸并重新编码 (需要可选依赖 Pillow)
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "true").lower() == "true"
+# 视频输出为1080p级别，图片短边超过该值没有意义
+IMAGE_TARGET_SHORT_EDGE = int(os.getenv("IMAGE_TARGET_SHORT_EDGE", "1080"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "90"))
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(os.cpu_count() or 2)))
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# 上传去重: 图片内容哈希→图片URL 映射的持久化文件、有效期(秒)与最大条目数，有效期为0时禁用
+UPLOAD_CACHE_PATH = os.getenv("UPLOAD_CACHE_PATH", os.path.join(tempfile.gettempdir(), "seedance-upload-cache.json"))
+UPLOAD_CACHE_TTL = float(os.getenv("UPLOAD_CACHE_TTL", "86400"))
+UPLOAD_CACHE_MAX_ENTRIES = int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", "10000"))
+# 上传去重记录的保存延迟(秒): 期间的多次写入合并为一次保存
+UPLOAD_CACHE_SAVE_DELAY = float(os.getenv("UPLOAD_CACHE_SAVE_DELAY", "2"))
+
+# 视频列表快照: 新鲜期(秒)，以及过期后仍可先返回旧快照、同时后台刷新的时长(秒)
+VIDEO_LIST_TTL = float(os.getenv("VIDEO_LIST_TTL", "3"))
+VIDEO_LIST_STALE_TTL = float(os.getenv("VIDEO_LIST_STALE_TTL", "30"))
+
+# 后台任务跟踪: 统一轮询间隔(秒)、单个任务最长跟踪时间(秒)、结束后保留结果的时间(秒)
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "5"))
+TASK_TRACK_TIMEOUT = float(os.getenv("TASK_TRACK_TIMEOUT", "1800"))
+TASK_RESULT_TTL = float(os.getenv("TASK_RESULT_TTL", "600"))
+# 任务与创建它的cookie的对应关系最多保留的条数 (超出后淘汰最久未使用的)
+TASK_AFFINITY_MAX_ENTRIES = int(os.getenv("TASK_AFFINITY_MAX_ENTRIES", "100000"))
+
+# 任务事件推送 (SSE) 心跳间隔(秒)，防止空闲连接被代理/负载均衡断开
+TASK_EVENTS_HEARTBEAT = float(os.getenv("TASK_EVENTS_HEARTBEAT", "15"))
+
+# 任务结束回调 (Webhook): 签名密钥、投递并发数、队列容量、最大重试次数、退避基数/上限(秒)、单次请求超时(秒)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", "5"))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "2"))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "300"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+# 回调地址默认只允许公网地址；需要回调到内网/本机时在此列出允许的主机名或网段，逗号分隔 (如 hooks.internal,10.0.0.0/8)
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
+# 监控指标: 是否开启 /metrics，以及每个指标最多保留的标签组合数 (防止标签基数失控)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))
+
+# 视频状态
+VIDEO_COMPLETED_STATUSES = {"completed", "success", "done", "finished", "succeeded"}
+VIDEO_FAILED_STATUSES = {"failed", "error", "failure"}
+
+
+# ==================== 监控指标 ====================
+
+# 请求/上游调用耗时分桶(秒) 与 视频生成耗时分桶(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TASK_DURATION_BUCKETS = (15, 30, 60, 90, 120, 180, 240, 300, 450, 600, 900, 1200, 1800)
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    """
+    Prometheus 指标基类
+
+    只在事件循环线程中更新，无需加锁；每次更新只是一次字典查找和加法，
+    标签组合超过 METRICS_MAX_SERIES 时归入 "other"
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+
+    def _key(self, values: tuple) -> tuple:
+        if values not in self._series and len(self._series) >= METRICS_MAX_SERIES:
+            return ("other",) * len(self.labels)
+        return values
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *values, amount: float = 1):
+        key = self._key(values)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def _samples(self):
+        for values, total in self._series.items():
+            yield f"{self.name}{format_labels(self.labels, values)} {total}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *values):
+        key = self._key(values)
+        series = self._series.get(key)
+        if series is None:
+            # [各分桶计数 (最后一个为 +Inf), 总和]
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _samples(self):
+        for values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), values + (bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render_samples(name: str, help: str, samples: list, labels: tuple = (), kind: str = "gauge") -> List[str]:
+    """渲染在抓取时才从各组件读取的数值，samples 为 [(标签值元组, 数值)]"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{format_labels(labels, values)} {value}" for values, value in samples)
+    return lines
+
+
+HTTP_REQUESTS = Counter("seedance_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("seedance_http_request_duration_seconds", "HTTP request latency by route (until the response body is sent)", ("method", "route"))
+HTTP_RESPONSE_BYTES = Counter("seedance_http_response_bytes_total", "Response body bytes sent by route", ("route",))
+UPSTREAM_REQUESTS = Counter("seedance_upstream_requests_total", "Upstream requests by operation and outcome", ("operation", "outcome"))
+UPSTREAM_LATENCY = Histogram("seedance_upstream_request_duration_seconds", "Upstream request latency by operation", ("operation",))
+PROXY_UPSTREAM_BYTES = Counter("seedance_proxy_upstream_bytes_total", "Video bytes streamed from upstream through the proxy")
+TASK_DURATION = Histogram(
+    "seedance_task_duration_seconds", "Time from task creation to completion by model and duration",
+    ("model", "duration", "outcome"), TASK_DURATION_BUCKETS
+)
+METRICS = (
+    HTTP_REQUESTS, HTTP_LATENCY, HTTP_RESPONSE_BYTES,
+    UPSTREAM_REQUESTS, UPSTREAM_LATENCY, PROXY_UPSTREAM_BYTES, TASK_DURATION
+)
+
+
+def upstream_operation(url: str) -> str:
+    """上游调用按接口路径分类 (只有固定的几个接口，标签基数有限)"""
+    if url.startswith(BASE_URL):
+        return urlsplit(url).path or "/"
+    return "external"
+
+
+class MetricsMiddleware:
+    """
+    记录每个请求的路由、状态码、耗时与响应字节数
+
+    使用纯 ASGI 中间件，不缓冲响应体，流式响应 (视频代理、SSE) 的耗时按整个响应计算；
+    路由标签取路由模板 (如 /api/video/{video_id}/status)，避免按实际路径产生大量标签
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(scope["method"], route, status)
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], route)
+            if sent:
+                HTTP_RESPONSE_BYTES.inc(route, amount=sent)
+
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 
 # ==================== 鉴权依赖 ====================
 
@@ -84,54 +583,2185 @@ def verify_auth_token(authorization: str = Header(None)) -> str:
             detail="Invalid or Expired Token"
         )
 
-    return token
+    return token
+
+# Cookie池调度器: 按健康状况与负载选择cookie
+class CookieState:
+    """单个cookie的运行状态"""
+
+    def __init__(self, cookie: str):
+        self.cookie = cookie
+        self.inflight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = 0.0
+        self.quarantined_until = 0.0
+        self.quarantine_count = 0
+        self.probing = False
+        self.last_error: Optional[str] = None
+
+    @property
+    def quarantined(self) -> bool:
+        return self.quarantined_until > 0
+
+    def masked(self) -> str:
+        return f"{self.cookie[:10]}...{self.cookie[-10:]}" if len(self.cookie) > 20 else self.cookie
+
+
+class CookiePool:
+    """
+    健康感知的cookie池
+
+    - 记录每个cookie的进行中请求数、最近延迟(指数滑动平均)与成功/失败次数
+    - 被重定向到登录页或连续失败的cookie会被隔离，隔离到期后在后台用一次列表查询重新探测，
+      探测失败则隔离时间加倍 (上限 COOKIE_QUARANTINE_MAX)
+    - 每次选择进行中请求最少、延迟最低的健康cookie；负载相同时轮流使用
+    - 全部cookie都被隔离时仍选择最早到期的一个，而不是直接失败
+    """
+
+    LATENCY_ALPHA = 0.2
+
+    def __init__(self, cookies: List[str]):
+        self.cookies = cookies
+        self._states = {cookie: CookieState(cookie) for cookie in cookies}
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._probes = set()
+        self._recovery_callbacks = []
+
+    def on_recover(self, callback):
+        """注册cookie从隔离中恢复时的回调"""
+        self._recovery_callbacks.append(callback)
+
+    def get_next(self) -> Optional[str]:
+        """选择当前最合适的cookie"""
+        if not self.cookies:
+            return None
+        self._schedule_probes()
+        with self._lock:
+            self._offset = (self._offset + 1) % len(self.cookies)
+            ordered = self.cookies[self._offset:] + self.cookies[:self._offset]
+            healthy = [self._states[cookie] for cookie in ordered if not self._states[cookie].quarantined]
+            if healthy:
+                best = min(healthy, key=lambda state: (state.inflight, int(state.latency / 0.5)))
+            else:
+                best = min(self._states.values(), key=lambda state: state.quarantined_until)
+            return best.cookie
+
+    def get_all(self) -> List[str]:
+        """获取所有cookie列表"""
+        return self.cookies
+
+    def count(self) -> int:
+        """获取cookie数量"""
+        return len(self.cookies)
+
+    def healthy_count(self) -> int:
+        return sum(1 for state in self._states.values() if not state.quarantined)
+
+    def healthy_cookies(self) -> List[str]:
+        """健康的cookie列表，全部被隔离时返回所有cookie (同时为隔离到期的cookie启动探测)"""
+        self._schedule_probes()
+        healthy = [cookie for cookie in self.cookies if not self._states[cookie].quarantined]
+        return healthy or list(self.cookies)
+
+    def inflight(self, cookie: str) -> int:
+        state = self._states.get(cookie)
+        return state.inflight if state else 0
+
+    def begin(self, cookie: Optional[str]):
+        """记录一个发往上游的请求开始"""
+        state = self._states.get(cookie)
+        if state:
+            state.inflight += 1
+
+    def end(self, cookie: Optional[str], elapsed: float, error: Optional[str] = None, session_expired: bool = False):
+        """记录请求结束及其结果"""
+        state = self._states.get(cookie)
+        if not state:
+            return
+        state.inflight = max(0, state.inflight - 1)
+        state.latency = elapsed if not state.latency else (
+            self.LATENCY_ALPHA * elapsed + (1 - self.LATENCY_ALPHA) * state.latency
+        )
+        if session_expired:
+            self._fail(state, "Session 已过期", quarantine=True)
+        elif error:
+            self._fail(state, error, quarantine=state.consecutive_failures + 1 >= COOKIE_MAX_FAILURES)
+        else:
+            self._succeed(state)
+
+    def _succeed(self, state: CookieState):
+        recovered = state.quarantined
+        state.successes += 1
+        state.consecutive_failures = 0
+        state.quarantine_count = 0
+        state.quarantined_until = 0.0
+        if recovered:
+            cookie_log.info("Cookie 已恢复", extra={"cookie": state.masked()})
+            for callback in self._recovery_callbacks:
+                callback()
+
+    def _fail(self, state: CookieState, error: str, quarantine: bool):
+        state.failures += 1
+        state.consecutive_failures += 1
+        state.last_error = error
+        if not quarantine:
+            return
+        backoff = min(COOKIE_QUARANTINE_BASE * (2 ** state.quarantine_count), COOKIE_QUARANTINE_MAX)
+        state.quarantine_count += 1
+        state.quarantined_until = time.monotonic() + backoff
+        cookie_log.warning("隔离 Cookie %.0f 秒: %s", backoff, error, extra={"cookie": state.masked()})
+
+    def _schedule_probes(self):
+        """为隔离到期的cookie启动后台探测"""
+        now = time.monotonic()
+        for state in self._states.values():
+            if state.quarantined and not state.probing and state.quarantined_until <= now:
+                try:
+                    task = asyncio.get_running_loop().create_task(self._probe(state))
+                except RuntimeError:
+                    return
+                state.probing = True
+                self._probes.add(task)
+                task.add_done_callback(self._probes.discard)
+
+    async def _probe(self, state: CookieState):
+        try:
+            await fetch_video_list(state.cookie)
+        except Exception as e:
+            # fetch_video_list 已通过 send_upstream 记录了会话过期；其他错误在这里计入
+            if state.quarantined_until <= time.monotonic():
+                self._fail(state, f"探测失败: {type(e).__name__}", quarantine=True)
+        finally:
+            state.probing = False
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "total": len(self.cookies),
+            "healthy": self.healthy_count(),
+            "cookies": [
+                {
+                    "cookie": state.masked(),
+                    "healthy": not state.quarantined,
+                    "inflight": state.inflight,
+                    "latency_ms": round(state.latency * 1000),
+                    "successes": state.successes,
+                    "failures": state.failures,
+                    "last_error": state.last_error,
+                    "quarantine_remaining": round(max(0.0, state.quarantined_until - now), 1) if state.quarantined else 0,
+                }
+                for state in self._states.values()
+            ],
+        }
+
+
+cookie_pool = CookiePool(SESSION_COOKIES)
+
+
+async def send_upstream(method: str, url: str, cookie: Optional[str], **kwargs) -> httpx.Response:
+    """
+    通过共享连接池向上游发送请求，并把结果反馈给cookie池
+
+    被重定向到登录页时隔离该cookie；网络错误、429 与 5xx 计为失败
+    """
+    operation = upstream_operation(url)
+    cookie_pool.begin(cookie)
+    start = time.monotonic()
+    try:
+        response = await get_http_client().request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        elapsed = time.monotonic() - start
+        cookie_pool.end(cookie, elapsed, error=type(e).__name__)
+        UPSTREAM_REQUESTS.inc(operation, type(e).__name__)
+        UPSTREAM_LATENCY.observe(elapsed, operation)
+        raise
+
+    elapsed = time.monotonic() - start
+    if "/login" in str(response.url):
+        cookie_pool.end(cookie, elapsed, session_expired=True)
+        outcome = "session_expired"
+    elif response.status_code == 429 or response.status_code >= 500:
+        cookie_pool.end(cookie, elapsed, error=f"HTTP {response.status_code}")
+        outcome = str(response.status_code)
+    else:
+        cookie_pool.end(cookie, elapsed)
+        outcome = str(response.status_code)
+    UPSTREAM_REQUESTS.inc(operation, outcome)
+    UPSTREAM_LATENCY.observe(elapsed, operation)
+    return response
+
+
+# 请求头模板
+def get_headers(content_type: str = "application/json", cookie: Optional[str] = None) -> dict:
+    # 如果未指定cookie，由cookie池选择
+    if cookie is None:
+        cookie = cookie_pool.get_next()
+
+    if cookie and cookie_log.isEnabledFor(logging.DEBUG):
+        # 调试信息 (隐藏中间部分)，每次请求都会产生，按采样比例输出
+        masked_cookie = f"{cookie[:10]}...{cookie[-10:]}" if len(cookie) > 20 else cookie
+        cookie_log.debug("使用 Cookie", extra={"cookie": masked_cookie, "sampled": True})
+
+    return {
+        "accept": "*/*",
+        "accept-language": "zh-CN,zh;q=0.9",
+        "cache-control": "no-cache",
+        "content-type": content_type,
+        "cookie": f"connect.sid={cookie}" if cookie else "",
+        "origin": BASE_URL,
+        "pragma": "no-cache",
+        "referer": f"{BASE_URL}/",
+        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36"
+    }
+
+
+# ==================== 创建准入控制 ====================
+
+class TokenBucket:
+    """令牌桶: 以固定速率补充令牌，容量为允许的突发请求数"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= 1
+
+    def wait_time(self) -> float:
+        """距离下一个令牌可用的时间(秒)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class AdmissionRejected(Exception):
+    """排队已满或预计等待时间超过上限"""
+
+    def __init__(self, position: int, eta: float):
+        super().__init__(f"排队中的请求过多 (第 {position} 位，预计 {eta:.0f} 秒后开始)")
+        self.position = position
+        self.eta = eta
+
+
+class CreateAdmission:
+    """
+    创建视频请求的准入控制
+
+    - 每个cookie同时进行中的创建请求不超过 COOKIE_MAX_CONCURRENT_CREATES
+    - 每个cookie的创建次数受令牌桶限制 (COOKIE_CREATE_RATE_PER_MINUTE / COOKIE_CREATE_BURST)
+    - 没有可用额度时请求按先后顺序排队，有额度释放时依次放行；
+      排队已满或预计等待超过 ADMISSION_MAX_WAIT 时立即拒绝，并给出排队位置和预计开始时间
+    """
+
+    LATENCY_ALPHA = 0.2
+    # 有请求排队时重新检查额度的最长间隔(秒)，兜底处理没有触发唤醒的额度变化
+    RECHECK_INTERVAL = 1.0
+
+    def __init__(self, max_concurrent: int, rate_per_minute: float, burst: int, queue_size: int, max_wait: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._inflight = {}
+        self._buckets = {}
+        self._waiters = deque()
+        self._latency = 1.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # cookie恢复后立即放行排队的请求
+        cookie_pool.on_recover(self._dispatch)
+
+    def _bucket(self, cookie: Optional[str]) -> TokenBucket:
+        bucket = self._buckets.get(cookie)
+        if bucket is None:
+            bucket = self._buckets[cookie] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _pick(self) -> tuple:
+        """
+        选择一个有空闲额度的cookie，返回 (cookie, 是否找到)
+
+        优先进行中创建请求最少、整体负载最低的健康cookie
+        """
+        candidates = [
+            cookie for cookie in cookie_pool.healthy_cookies()
+            if self._inflight.get(cookie, 0) < self.max_concurrent and self._bucket(cookie).available()
+        ]
+        if not candidates:
+            return None, False
+        cookie = min(candidates, key=lambda c: (self._inflight.get(c, 0), cookie_pool.inflight(c)))
+        return cookie, True
+
+    def _admit(self, cookie: Optional[str]):
+        self._inflight[cookie] = self._inflight.get(cookie, 0) + 1
+        self._bucket(cookie).take()
+        self.admitted += 1
+
+    def estimate_wait(self, position: int) -> float:
+        """估算排在第 position 位的请求需要等待的时间(秒)，所有cookie都在冷却时无法估算，返回无穷大"""
+        cookies = cookie_pool.healthy_cookies()
+        throughput = len(cookies) * self.max_concurrent / max(self._latency, 0.05)
+        if self.rate > 0:
+            throughput = min(throughput, len(cookies) * self.rate)
+        if throughput <= 0:
+            return math.inf
+        token_wait = min((self._bucket(cookie).wait_time() for cookie in cookies), default=0.0)
+        return token_wait + position / throughput
+
+    async def acquire(self) -> Optional[str]:
+        """获取一个创建额度，返回应使用的cookie；无法在等待上限内获得额度时抛出 AdmissionRejected"""
+        if not self._waiters:
+            cookie, found = self._pick()
+            if found:
+                self._admit(cookie)
+                return cookie
+
+        position = len(self._waiters) + 1
+        eta = self.estimate_wait(position)
+        if position > self.queue_size or eta > self.max_wait:
+            self.rejected += 1
+            # 无法估算时按等待上限提示客户端重试
+            raise AdmissionRejected(position, min(eta, self.max_wait))
+
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._schedule()
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # 已经分配到额度但调用方放弃了，归还额度
+                self.release(waiter.result())
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                position = len(self._waiters) + 1
+                raise AdmissionRejected(position, min(self.estimate_wait(position), self.max_wait))
+            raise
+
+    def release(self, cookie: Optional[str], elapsed: Optional[float] = None):
+        """创建请求结束，归还额度并放行排队的请求"""
+        self._inflight[cookie] = max(0, self._inflight.get(cookie, 0) - 1)
+        if elapsed is not None:
+            self._latency = self.LATENCY_ALPHA * elapsed + (1 - self.LATENCY_ALPHA) * self._latency
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            if self._waiters[0].done():
+                self._waiters.popleft()
+                continue
+            cookie, found = self._pick()
+            if not found:
+                break
+            self._admit(cookie)
+            self._waiters.popleft().set_result(cookie)
+        self._schedule()
+
+    def _schedule(self):
+        """
+        有请求排队时安排下一次放行尝试
+
+        额度只受令牌限制时在下一个令牌补充后重试；其余情况由 release 与cookie恢复回调唤醒，
+        并每隔 RECHECK_INTERVAL 兜底检查一次 (同时触发隔离到期cookie的探测)
+        """
+        if not self._waiters or self._timer is not None:
+            return
+        delay = self.RECHECK_INTERVAL
+        if self.rate > 0:
+            cookies = [c for c in cookie_pool.healthy_cookies() if self._inflight.get(c, 0) < self.max_concurrent]
+            if cookies:
+                delay = min(delay, min(self._bucket(cookie).wait_time() for cookie in cookies))
+        self._timer = asyncio.get_running_loop().call_later(max(delay, 0.01), self._dispatch)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent_per_cookie": self.max_concurrent,
+            "rate_per_minute": self.rate * 60,
+            "inflight": sum(self._inflight.values()),
+            "queue_length": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "avg_create_latency": round(self._latency, 3),
+        }
+
+
+create_admission = CreateAdmission(
+    COOKIE_MAX_CONCURRENT_CREATES,
+    COOKIE_CREATE_RATE_PER_MINUTE,
+    COOKIE_CREATE_BURST,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_MAX_WAIT
+)
+
+
+async def post_create(payload: dict) -> tuple:
+    """
+    经准入控制后向上游提交创建视频请求，返回 (使用的cookie, 上游响应)
+
+    排不上队时抛出 429 (带 Retry-After、排队位置与预计开始时间)；
+    被重定向到登录页时任务并未创建，换一个账号重试一次
+    """
+    for attempt in range(2):
+        try:
+            cookie = await create_admission.acquire()
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=429,
+                detail={"message": str(e), "queue_position": e.position, "eta_seconds": round(e.eta, 1)},
+                headers={"Retry-After": str(max(1, math.ceil(e.eta)))}
+            )
+
+        start = time.monotonic()
+        try:
+            response = await send_upstream(
+                "POST",
+                f"{BASE_URL}/api/video/create",
+                cookie,
+                json=payload,
+                headers=get_headers(cookie=cookie),
+                timeout=120.0
+            )
+        finally:
+            create_admission.release(cookie, time.monotonic() - start)
+
+        if "/login" not in str(response.url) or cookie_pool.healthy_count() == 0:
+            break
+    return cookie, response
+
+
+# ==================== 创建幂等 ====================
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotentEntry:
+    """一个 Idempotency-Key 对应的创建结果 (进行中时 future 尚未完成)"""
+
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future, ttl: float):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = time.monotonic() + ttl
+
+
+class IdempotencyStore:
+    """
+    创建请求幂等与合并
+
+    - 带 Idempotency-Key 的请求: 同一调用方的相同 Key 在保留期内只创建一次，
+      重复请求等待并返回首次请求的结果；Key 相同但参数不同时返回 422
+    - 开启合并时，参数 (含回调地址) 完全相同且仍在进行中的请求共享同一次上游创建
+    - 只保留成功的结果；失败 (含 429、上游错误) 后释放 Key，调用方可以用同一个 Key 重试
+    - 首次请求被取消时，等待同一结果的其他请求收到 503 (带 Retry-After)，可以直接重试
+    - 按 LRU 淘汰，最多保留 max_entries 条
+    """
+
+    def __init__(self, ttl: float, max_entries: int, coalesce: bool):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.coalesce = coalesce
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+        self._entries: "OrderedDict[str, IdempotentEntry]" = OrderedDict()
+        self._inflight = {}  # 参数指纹 -> 进行中的 future
+
+    @staticmethod
+    def fingerprint(payload: dict) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def scoped_key(idempotency_key: Optional[str], token: Optional[str]) -> Optional[str]:
+        """Key 按调用方 Token 隔离，不同调用方使用相同 Key 互不影响"""
+        if not idempotency_key:
+            return None
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key 长度不能超过 {IDEMPOTENCY_KEY_MAX_LENGTH}")
+        scope = hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+        return f"{scope}:{idempotency_key}"
+
+    def _lookup(self, key: str) -> Optional[IdempotentEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic() and entry.future.done():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remember(self, key: str, fingerprint: str, future: asyncio.Future):
+        self._entries[key] = IdempotentEntry(fingerprint, future, self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def run(self, key: Optional[str], fingerprint: str, create) -> tuple:
+        """
+        执行创建 (create 为返回 VideoCreateResponse 的协程函数)，返回 (结果, 是否为重放的结果)
+        """
+        if key:
+            entry = self._lookup(key)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    self.conflicts += 1
+                    raise HTTPException(status_code=422, detail="Idempotency-Key 已用于参数不同的请求")
+                self.replayed += 1
+                return await asyncio.shield(entry.future), True
+
+        if self.coalesce and fingerprint in self._inflight:
+            future = self._inflight[fingerprint]
+            if key:
+                self._remember(key, fingerprint, future)
+            self.coalesced += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        if key:
+            self._remember(key, fingerprint, future)
+        if self.coalesce:
+            self._inflight[fingerprint] = future
+
+        try:
+            result = await create()
+        except BaseException as e:
+            self._forget(key, future)
+            # 首次请求被取消 (如客户端断开) 时不取消共享的 future，
+            # 重放与合并的等待者改为收到可重试的 503，而不是跟着被取消
+            error = e if isinstance(e, Exception) else HTTPException(
+                status_code=503, detail="共享的创建请求已中断，请重试", headers={"Retry-After": "1"}
+            )
+            future.set_exception(error)
+            future.exception()  # 没有其他等待者时避免 "exception was never retrieved" 警告
+            raise
+        finally:
+            if self._inflight.get(fingerprint) is future:
+                del self._inflight[fingerprint]
+
+        future.set_result(result)
+        if not result.success:
+            self._forget(key, future)
+        return result, False
+
+    def _forget(self, key: Optional[str], future: asyncio.Future):
+        """释放失败请求的 Key (只释放仍指向本次请求的 Key)"""
+        entry = self._entries.get(key) if key else None
+        if entry is not None and entry.future is future:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "coalesce": self.coalesce,
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "conflicts": self.conflicts,
+        }
+
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, CREATE_COALESCE)
+
+
+# ==================== 视频列表快照 ====================
+
+class UpstreamError(Exception):
+    """上游接口返回错误 (Session 过期或非200状态码)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, session_expired: bool = False):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.session_expired = session_expired
+
+
+async def fetch_video_list(cookie: Optional[str]) -> list:
+    """从上游获取指定 cookie 账号下的完整视频列表"""
+    headers = get_headers(cookie=cookie)
+    del headers["content-type"]  # GET请求不需要content-type
+
+    response = await send_upstream(
+        "GET",
+        f"{BASE_URL}/api/videos",
+        cookie,
+        headers=headers,
+        timeout=30.0
+    )
+
+    # 检查是否被重定向到了登录页
+    if "/login" in str(response.url):
+        raise UpstreamError("Session 已过期或无效", session_expired=True)
+
+    if response.status_code != 200:
+        raise UpstreamError(str(response.status_code), status_code=response.status_code)
+
+    result = response.json()
+    # 兼容多种返回格式: {ok, items} 或 {success, data} 或直接数组
+    if isinstance(result, list):
+        return result
+    elif result.get("ok"):
+        return result.get("items", [])
+    else:
+        return result.get("data", [])
+
+
+def core_task_id(task_id: str) -> str:
+    """提取核心任务ID (去掉 ::model 后缀)"""
+    return task_id.split("::")[0] if "::" in task_id else task_id
+
+
+class VideoIndex:
+    """
+    视频列表索引
+
+    以 id、taskId、task_id 及核心任务ID 为键，随每次列表快照增量更新，
+    状态查询为常数时间；只有索引未命中时才退回到部分匹配扫描
+    """
+
+    def __init__(self):
+        self.videos: list = []
+        self._by_key = {}
+
+    @staticmethod
+    def _keys(video: dict) -> set:
+        keys = set()
+        vid_id = video.get("id")
+        if vid_id is not None and vid_id != "":
+            keys.add(str(vid_id))
+        for field in ("taskId", "task_id"):
+            value = video.get(field)
+            if value:
+                keys.add(str(value))
+                keys.add(core_task_id(str(value)))
+        return keys
+
+    def update(self, videos: list):
+        """用新的列表快照更新索引: 覆盖变化的条目，删除已不存在的键"""
+        new_index = {}
+        for video in videos:
+            if not isinstance(video, dict):
+                continue
+            for key in self._keys(video):
+                # 同一个键对应多个视频时保留列表中靠前(较新)的那个
+                new_index.setdefault(key, video)
+        for key in self._by_key.keys() - new_index.keys():
+            del self._by_key[key]
+        self._by_key.update(new_index)
+        self.videos = videos
+
+    def find(self, task_id: str) -> Optional[dict]:
+        """根据任务ID或视频ID查找视频"""
+        task_id = str(task_id)
+        video = self._by_key.get(task_id) or self._by_key.get(core_task_id(task_id))
+        if video is not None:
+            return video
+
+        # 索引未命中: 部分匹配 (task_id 可能包含额外信息)
+        core_id = core_task_id(task_id)
+        for video in self.videos:
+            if not isinstance(video, dict):
+                continue
+            vid_task_id = str(video.get("taskId") or video.get("task_id") or "")
+            if vid_task_id and core_id and (core_id in vid_task_id or vid_task_id in core_id):
+                return video
+        return None
+
+
+class VideoListCache:
+    """
+    按 cookie 缓存视频列表快照
+
+    - 新鲜期内直接返回快照，不访问上游
+    - 并发的刷新请求合并为同一个上游请求 (single-flight)
+    - 过期但仍在容忍期内时先返回旧快照，同时在后台刷新 (stale-while-revalidate)
+
+    这样无论有多少客户端在轮询，每个 cookie 在每个 TTL 内最多只请求一次上游
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self._snapshots = {}  # cookie -> fetched_at
+        self._indexes = {}  # cookie -> VideoIndex
+        self._inflight = {}  # cookie -> asyncio.Task
+
+    async def get(self, cookie: Optional[str], max_age: Optional[float] = None) -> list:
+        """
+        获取视频列表
+
+        Args:
+            cookie: 账号 cookie
+            max_age: 可接受的最大快照年龄(秒)，指定时不返回过期快照
+        """
+        index = await self.get_index(cookie, max_age)
+        return index.videos
+
+    async def get_index(self, cookie: Optional[str], max_age: Optional[float] = None) -> VideoIndex:
+        """获取视频列表快照的索引 (参数同 get)"""
+        fetched_at = self._snapshots.get(cookie)
+        if fetched_at is not None:
+            age = time.monotonic() - fetched_at
+            if age <= (self.ttl if max_age is None else max_age):
+                self.hits += 1
+                return self._indexes[cookie]
+            if max_age is None and age <= self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh(cookie)
+                return self._indexes[cookie]
+
+        # shield: 单个调用方取消时不影响其他共享同一请求的调用方
+        return await asyncio.shield(self._refresh(cookie))
+
+    async def find_video(self, cookie: Optional[str], task_id: str, max_age: Optional[float] = None) -> Optional[dict]:
+        """在视频列表快照中查找任务对应的视频"""
+        index = await self.get_index(cookie, max_age)
+        return index.find(task_id)
+
+    def _refresh(self, cookie: Optional[str]) -> asyncio.Task:
+        task = self._inflight.get(cookie)
+        if task is not None:
+            self.coalesced += 1
+            return task
+
+        self.fetches += 1
+        task = asyncio.ensure_future(self._fetch(cookie))
+        self._inflight[cookie] = task
+        task.add_done_callback(lambda t: self._on_refresh_done(cookie, t))
+        return task
+
+    async def _fetch(self, cookie: Optional[str]) -> VideoIndex:
+        items = await fetch_video_list(cookie)
+        index = self._indexes.setdefault(cookie, VideoIndex())
+        index.update(items)
+        self._snapshots[cookie] = time.monotonic()
+        return index
+
+    def _on_refresh_done(self, cookie: Optional[str], task: asyncio.Task):
+        self._inflight.pop(cookie, None)
+        # 后台刷新无人等待时也要取走异常，避免 "exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            http_log.warning("视频列表刷新失败: %s", task.exception())
+
+    def stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "snapshots": len(self._snapshots),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "fetches": self.fetches,
+            "coalesced": self.coalesced,
+        }
+
+
+video_list_cache = VideoListCache(VIDEO_LIST_TTL, VIDEO_LIST_STALE_TTL)
+
+
+# ==================== 任务跟踪 ====================
+
+def extract_task_id(result: dict) -> Optional[str]:
+    """从上游创建视频的响应中提取任务ID (兼容多种返回格式)"""
+    if not isinstance(result, dict):
+        return None
+    task = result.get("task") or {}
+    task_id = task.get("task_id") or result.get("taskId") or result.get("task_id") or result.get("id")
+    return str(task_id) if task_id else None
+
+
+def get_video_url(video: dict) -> Optional[str]:
+    """兼容多种视频URL字段名"""
+    return video.get("videoUrl") or video.get("url") or video.get("video_url")
+
+
+class TrackedTask:
+    """被跟踪的视频生成任务"""
+
+    def __init__(self, task_id: str, cookie: Optional[str], model: Optional[str] = None, duration: Optional[int] = None):
+        self.task_id = task_id
+        self.cookie = cookie
+        self.model = model
+        self.duration = duration
+        self.callback_url: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.status: Optional[str] = None
+        self.video: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.listeners = set()  # 订阅状态变化的 asyncio.Queue
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def succeeded(self) -> bool:
+        return (self.status or "").lower() in VIDEO_COMPLETED_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "done": self.done,
+            "video_url": get_video_url(self.video) if self.video else None,
+            "error": self.error,
+            "elapsed": round((self.finished_at or time.monotonic()) - self.created_at, 1),
+        }
+
+    def notify(self):
+        """向所有订阅者推送当前状态"""
+        event = self.to_dict()
+        event["video"] = self.video
+        for listener in self.listeners:
+            listener.put_nowait(event)
+
+
+class TaskAffinity:
+    """
+    任务ID → 创建该任务的cookie
+
+    每个账号只能在自己的视频列表中看到自己创建的任务，因此同一任务的状态查询、
+    列表查找与轮询都必须使用创建它时的cookie。未知任务 (如服务重启前创建的)
+    会在所有账号的列表快照中查找一次，找到后记住归属
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.resolved = 0
+        self._owners: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+    def record(self, task_id: str, cookie: Optional[str]):
+        key = core_task_id(str(task_id))
+        self._owners[key] = cookie
+        self._owners.move_to_end(key)
+        while len(self._owners) > self.max_entries:
+            self._owners.popitem(last=False)
+
+    def get(self, task_id: str) -> Optional[str]:
+        key = core_task_id(str(task_id))
+        cookie = self._owners.get(key)
+        if cookie is not None:
+            self._owners.move_to_end(key)
+        return cookie
+
+    async def resolve(self, task_id: str) -> Optional[str]:
+        """返回任务所属的cookie，未记录时在各账号的列表快照中查找，均未找到时返回None"""
+        cookie = self.get(task_id)
+        if cookie is not None or cookie_pool.count() <= 1:
+            return cookie if cookie is not None else cookie_pool.get_next()
+
+        cookies = cookie_pool.get_all()
+        results = await asyncio.gather(
+            *(video_list_cache.find_video(cookie, task_id) for cookie in cookies),
+            return_exceptions=True
+        )
+        for cookie, video in zip(cookies, results):
+            if isinstance(video, dict):
+                self.resolved += 1
+                self.record(task_id, cookie)
+                return cookie
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._owners),
+            "max_entries": self.max_entries,
+            "resolved": self.resolved,
+        }
+
+
+task_affinity = TaskAffinity(TASK_AFFINITY_MAX_ENTRIES)
+
+
+class TaskTracker:
+    """
+    后台任务跟踪器
+
+    记录所有经由本服务创建的任务，由一个后台协程按固定间隔统一轮询:
+    每个 cookie 每轮只取一次视频列表快照，用索引解析该 cookie 下所有待完成任务，
+    任务结束时通过 Future 唤醒所有等待者。轮询开销只随时间增长，与等待者数量无关
+    """
+
+    def __init__(self, poll_interval: float, track_timeout: float, result_ttl: float):
+        self.poll_interval = poll_interval
+        self.track_timeout = track_timeout
+        self.result_ttl = result_ttl
+        self.polls = 0
+        self._tasks = {}  # task_id -> TrackedTask
+        self._runner: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def get(self, task_id: str) -> Optional[TrackedTask]:
+        return self._tasks.get(str(task_id))
+
+    def track(
+        self,
+        task_id: str,
+        cookie: Optional[str],
+        model: Optional[str] = None,
+        duration: Optional[int] = None,
+        callback_url: Optional[str] = None
+    ) -> TrackedTask:
+        """开始跟踪任务 (重复调用返回同一个跟踪对象)"""
+        task_id = str(task_id)
+        task = self._tasks.get(task_id)
+        if task is None:
+            task = TrackedTask(task_id, cookie, model, duration)
+            self._tasks[task_id] = task
+            task_affinity.record(task_id, cookie)
+        if callback_url:
+            task.callback_url = callback_url
+        return task
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """订阅任务状态变化，返回接收事件的队列"""
+        queue = asyncio.Queue()
+        self._tasks[str(task_id)].listeners.add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        task = self._tasks.get(str(task_id))
+        if task is not None:
+            task.listeners.discard(queue)
+
+    async def wait(self, task_id: str, timeout: float) -> TrackedTask:
+        """等待任务结束，超时后返回仍未结束的跟踪对象"""
+        task = self._tasks[str(task_id)]
+        try:
+            # shield: 等待者超时或断开不影响任务本身
+            await asyncio.wait_for(asyncio.shield(task.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return task
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll_once()
+            except Exception as e:
+                tracker_log.exception("轮询出错: %s", e)
+
+    async def poll_once(self):
+        """轮询一次所有待完成任务"""
+        now = time.monotonic()
+        pending_by_cookie = {}
+        for task in list(self._tasks.values()):
+            if task.done:
+                if now - task.finished_at > self.result_ttl:
+                    del self._tasks[task.task_id]
+                continue
+            if now - task.created_at > self.track_timeout:
+                self._finish(task, error=f"跟踪超时({int(self.track_timeout)}秒)")
+                continue
+            pending_by_cookie.setdefault(task.cookie, []).append(task)
+
+        if not pending_by_cookie:
+            return
+
+        self.polls += 1
+        # 各账号的轮询互不影响: 单个账号出错不会中断其它账号本轮的状态更新
+        results = await asyncio.gather(*(
+            self._poll_cookie(cookie, tasks) for cookie, tasks in pending_by_cookie.items()
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                tracker_log.error("轮询出错: %r", result)
+
+    async def _poll_cookie(self, cookie: Optional[str], tasks: List[TrackedTask]):
+        try:
+            index = await video_list_cache.get_index(cookie, max_age=self.poll_interval)
+        except UpstreamError as e:
+            if e.session_expired:
+                for task in tasks:
+                    self._finish(task, error="轮询失败: Session 已过期或无效")
+            return
+        except httpx.HTTPError as e:
+            # 网络错误或超时: 与上游临时故障一样，等待下一轮重试
+            tracker_log.warning("轮询失败: %r", e)
+            return
+
+        for task in tasks:
+            video = index.find(task.task_id)
+            if video:
+                self._update(task, video)
+
+    def _update(self, task: TrackedTask, video: dict):
+        changed = video.get("status") != task.status
+        task.video = video
+        task.status = video.get("status")
+        status = (task.status or "").lower()
+        if status in VIDEO_COMPLETED_STATUSES or status in VIDEO_FAILED_STATUSES:
+            self._finish(task)
+        elif changed:
+            task.notify()
+
+    def _finish(self, task: TrackedTask, error: Optional[str] = None):
+        if task.done:
+            return
+        task.error = error
+        task.finished_at = time.monotonic()
+        outcome = "error" if error else ("completed" if task.succeeded else "failed")
+        TASK_DURATION.observe(task.finished_at - task.created_at, task.model or "unknown", task.duration or "unknown", outcome)
+        task.future.set_result(task)
+        task.notify()
+        if task.callback_url:
+            webhook_dispatcher.enqueue(task)
+
+    def stats(self) -> dict:
+        pending = sum(1 for task in self._tasks.values() if not task.done)
+        return {
+            "poll_interval": self.poll_interval,
+            "tracked": len(self._tasks),
+            "pending": pending,
+            "polls": self.polls,
+        }
+
+
+task_tracker = TaskTracker(TASK_POLL_INTERVAL, TASK_TRACK_TIMEOUT, TASK_RESULT_TTL)
+
+
+# ==================== 回调通知 ====================
+
+def _parse_allowed_hosts() -> tuple:
+    hostnames, networks = set(), []
+    for entry in WEBHOOK_ALLOWED_HOSTS:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            hostnames.add(entry)
+    return hostnames, networks
+
+
+WEBHOOK_ALLOWED_HOSTNAMES, WEBHOOK_ALLOWED_NETWORKS = _parse_allowed_hosts()
+
+
+def is_public_address(address) -> bool:
+    """是否为公网地址 (排除本机、内网、链路本地、保留与组播地址)"""
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+async def resolve_callback_target(callback_url: str) -> tuple:
+    """
+    检查回调地址是否允许投递，返回 (拒绝原因, 投递时连接的IP)，允许时拒绝原因为None
+
+    防止通过回调让服务端访问内网地址 (SSRF): 只允许 http/https，
+    主机名解析出的所有地址都必须是公网地址或在 WEBHOOK_ALLOWED_HOSTS 中。
+    投递时直接连接这里校验过的IP，避免再次解析时被 DNS 重绑定到内网地址；
+    主机名本身在白名单中时不固定IP
+    """
+    try:
+        parts = urlsplit(callback_url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        return "malformed URL", None
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "URL must start with http:// or https://", None
+
+    host = parts.hostname.lower()
+    if host in WEBHOOK_ALLOWED_HOSTNAMES:
+        return None, None
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return f"cannot resolve host {host}", None
+
+    addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    for address in addresses:
+        if any(address in network for network in WEBHOOK_ALLOWED_NETWORKS):
+            continue
+        if not is_public_address(address):
+            return f"host {host} resolves to non-public address {address}", None
+    return None, str(addresses[0])
+
+
+async def check_callback_target(callback_url: str) -> Optional[str]:
+    """检查回调地址是否允许投递，允许时返回None，否则返回原因"""
+    reason, _ = await resolve_callback_target(callback_url)
+    return reason
+
+
+async def validate_callback_url(callback_url: Optional[str]):
+    """校验回调URL格式与目标地址"""
+    if not callback_url:
+        return
+    reason = await check_callback_target(callback_url)
+    if reason:
+        raise HTTPException(status_code=400, detail=f"Invalid callback_url. {reason}")
+
+
+def sign_webhook(body: bytes, timestamp: str) -> str:
+    """计算回调签名: HMAC-SHA256(WEBHOOK_SECRET, "<timestamp>.<body>")"""
+    message = timestamp.encode("utf-8") + b"." + body
+    return hmac.new(WEBHOOK_SECRET.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+class WebhookDispatcher:
+    """
+    任务结束回调投递器
+
+    任务结束时把通知放入有界队列，由固定数量的后台协程投递；
+    失败后按指数退避重试，超过最大重试次数或队列已满时丢弃并记录日志
+    """
+
+    def __init__(self, workers: int, queue_size: int, max_retries: int, backoff_base: float, backoff_max: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._runners: List[asyncio.Task] = []
+        self._retry_handles = set()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def start(self):
+        if self._queue is None:
+            # 独立的客户端且不复用连接: 投递按IP连接，复用连接会让不同主机名共用同一个已校验过证书的TLS连接
+            self._client = httpx.AsyncClient(
+                timeout=WEBHOOK_TIMEOUT,
+                follow_redirects=False,
+                limits=httpx.Limits(max_keepalive_connections=0)
+            )
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._runners = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+        self._queue = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def build_payload(task: TrackedTask) -> dict:
+        return {
+            "event": "task.completed" if task.succeeded and not task.error else "task.failed",
+            "delivery_id": uuid.uuid4().hex,
+            "task_id": task.task_id,
+            "status": task.status,
+            "video_url": get_video_url(task.video) if task.video else None,
+            "error": task.error,
+            "model": task.model,
+            "duration": task.duration,
+            "video": task.video,
+        }
+
+    def enqueue(self, task: TrackedTask):
+        """登记一次回调投递"""
+        self._put({"url": task.callback_url, "payload": self.build_payload(task), "attempt": 0})
+
+    def _put(self, delivery: dict):
+        if self._queue is None:
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            webhook_log.warning("队列已满，丢弃回调", extra={"task_id": delivery["payload"]["task_id"]})
+
+    async def _run(self):
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                webhook_log.exception("投递出错: %s", e)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, delivery: dict):
+        payload = delivery["payload"]
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        timestamp = str(int(time.time()))
+        headers = {
+            "content-type": "application/json",
+            "x-seedance-event": payload["event"],
+            "x-seedance-delivery": payload["delivery_id"],
+            "x-seedance-timestamp": timestamp,
+        }
+        if WEBHOOK_SECRET:
+            headers["x-seedance-signature"] = f"sha256={sign_webhook(body, timestamp)}"
+
+        # 投递前再次检查目标地址 (域名解析结果可能已变化，任务队列恢复的回调也未经请求时校验)
+        rejected, address = await resolve_callback_target(delivery["url"])
+        if rejected:
+            self.failed += 1
+            webhook_log.warning("回调地址被拒绝: %s", rejected, extra={"task_id": payload["task_id"]})
+            return
+
+        # 连接校验过的IP，Host 头与 TLS SNI/证书校验仍使用原主机名
+        url = httpx.URL(delivery["url"])
+        extensions = {}
+        if address:
+            headers["host"] = url.netloc.decode("ascii")
+            extensions["sni_hostname"] = url.host
+            url = url.copy_with(host=address)
+
+        try:
+            # 不跟随重定向: 否则公网地址可以把请求转到内网
+            response = await self._client.post(url, content=body, headers=headers, extensions=extensions)
+            if 200 <= response.status_code < 300:
+                self.delivered += 1
+                return
+            reason = f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            reason = str(e) or e.__class__.__name__
+
+        delivery["attempt"] += 1
+        if delivery["attempt"] > self.max_retries:
+            self.failed += 1
+            webhook_log.warning("回调失败已放弃: %s", reason, extra={"task_id": payload["task_id"]})
+            return
+
+        # 指数退避后重新入队，等待期间不占用投递协程
+        delay = min(self.backoff_base * (2 ** (delivery["attempt"] - 1)), self.backoff_max)
+        webhook_log.info(
+            "回调失败，%.0f秒后第%d次重试: %s", delay, delivery["attempt"], reason, extra={"task_id": payload["task_id"]}
+        )
+        handle = asyncio.get_running_loop().call_later(delay, self._retry, delivery)
+        self._retry_handles.add(handle)
+        delivery["handle"] = handle
+
+    def _retry(self, delivery: dict):
+        self._retry_handles.discard(delivery.pop("handle", None))
+        self._put(delivery)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "retrying": len(self._retry_handles),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "signed": bool(WEBHOOK_SECRET),
+        }
+
+
+webhook_dispatcher = WebhookDispatcher(
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_MAX_RETRIES, WEBHOOK_BACKOFF_BASE, WEBHOOK_BACKOFF_MAX
+)
+
+
+# ==================== 持久化任务队列 ====================
+
+JOB_ACTIVE_STATUSES = ("queued", "running", "submitted")
+
+
+def job_payload_hash(payload: dict) -> str:
+    """相同生成参数的任务哈希相同，用于去重"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """
+    基于 SQLite 的持久化任务队列
+
+    - 入队后立即返回任务ID，由后台工作协程按优先级 (高优先) 和入队顺序经准入控制提交给上游
+    - 提交失败按指数退避重试，准入排队已满 (429) 时按预计等待时间推迟且不计入重试次数
+    - 提交成功后交给任务跟踪器轮询，视频结束时更新任务状态
+    - 参数与回调地址都相同且尚未结束的任务去重，返回已有任务 (回调地址不同时各自入队，保证每个回调都会收到通知)
+    - 所有状态写入磁盘，重启后继续处理: 排队中与提交中的任务重新排队，已提交的任务恢复跟踪
+      (提交中被中断的任务可能已在上游创建，重新提交属于"至少一次"语义)
+    - 数据库操作在单独的线程中串行执行，不阻塞事件循环
+    """
+
+    def __init__(self, path: str, workers: int, max_retries: int, backoff_base: float, backoff_max: float, retention: float):
+        self.path = path
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retention = retention
+        self.submitted = 0
+        self.retried = 0
+        self.deduplicated = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-db")
+        self._db: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runners: List[asyncio.Task] = []
+
+    # ---------- 数据库操作 (在 job-db 线程中执行) ----------
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                payload_hash TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_run_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                callback_url TEXT,
+                task_id TEXT,
+                cookie TEXT,
+                video TEXT,
+                error TEXT
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, priority, next_run_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_hash ON jobs (payload_hash, status)")
+        # 上次运行时正在提交的任务重新排队
+        db.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),))
+        db.commit()
+        self._db = db
+        return [dict(row) for row in db.execute("SELECT * FROM jobs WHERE status = 'submitted'")]
+
+    def _insert(self, payload: dict, priority: int, callback_url: Optional[str], dedup: bool) -> tuple:
+        payload_hash = job_payload_hash(payload)
+        if dedup:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE payload_hash = ? AND callback_url IS ? AND status IN (?, ?, ?)"
+                " ORDER BY created_at LIMIT 1",
+                (payload_hash, callback_url, *JOB_ACTIVE_STATUSES)
+            ).fetchone()
+            if row:
+                return dict(row), True
+
+        now = time.time()
+        job_id = f"job-{uuid.uuid4().hex}"
+        self._db.execute(
+            "INSERT INTO jobs (id, payload, payload_hash, priority, status, next_run_at, created_at, updated_at, callback_url)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, json.dumps(payload, ensure_ascii=False), payload_hash, priority, now, now, now, callback_url)
+        )
+        self._db.commit()
+        return self._get(job_id), False
+
+    def _get(self, job_id: str) -> Optional[dict]:
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _position(self, job: dict) -> int:
+        """排队中的任务前面还有多少个任务"""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND created_at < ?))",
+            (job["priority"], job["priority"], job["created_at"])
+        ).fetchone()[0]
+
+    def _claim(self) -> tuple:
+        """取出一个到期的最高优先级任务并标记为提交中，返回 (任务, 下一个任务到期还需等待的秒数)"""
+        now = time.time()
+        row = self._db.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND next_run_at <= ? ORDER BY priority DESC, created_at LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row:
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (now, row["id"])
+            )
+            self._db.commit()
+            return dict(row), 0.0
+        upcoming = self._db.execute("SELECT MIN(next_run_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        return None, (upcoming - now) if upcoming else None
+
+    def _set(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        self._db.commit()
+
+    def _cancel(self, job_id: str) -> bool:
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        )
+        self._db.commit()
+        return cursor.rowcount > 0
+
+    def _purge(self):
+        self._db.execute(
+            "DELETE FROM jobs WHERE status NOT IN (?, ?, ?) AND updated_at < ?",
+            (*JOB_ACTIVE_STATUSES, time.time() - self.retention)
+        )
+        self._db.commit()
+
+    def _counts(self) -> dict:
+        return {row[0]: row[1] for row in self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    async def _call(self, func, *args, **kwargs):
+        # 在当前上下文的副本中执行，线程中的日志仍带有 request_id
+        loop = asyncio.get_running_loop()
+        context = copy_context()
+        return await loop.run_in_executor(self._executor, lambda: context.run(func, *args, **kwargs))
+
+    # ---------- 生命周期 ----------
+
+    async def start(self):
+        if self._runners:
+            return
+        self._wakeup = asyncio.Event()
+        submitted = await self._call(self._open)
+        for job in submitted:
+            self._watch(job["id"], job["task_id"], job["cookie"], json.loads(job["payload"]), job["callback_url"])
+        self._runners = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runners.append(asyncio.create_task(self._janitor()))
+        job_log.info("已启动 %d 个工作协程，恢复跟踪 %d 个已提交任务", self.workers, len(submitted))
+
+    async def stop(self):
+        for runner in self._runners:
+            runner.cancel()
+        for runner in self._runners:
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+        self._runners = []
+        if self._db is not None:
+            await self._call(self._db.close)
+            self._db = None
+
+    # ---------- 对外接口 ----------
+
+    async def enqueue(self, payload: dict, priority: int = 0, callback_url: Optional[str] = None, dedup: bool = True) -> tuple:
+        """任务入队，返回 (任务, 是否为去重命中的已有任务)"""
+        job, duplicated = await self._call(self._insert, payload, priority, callback_url, dedup)
+        if duplicated:
+            self.deduplicated += 1
+        else:
+            self._wakeup.set()
+        return await self.describe(job), duplicated
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await self._call(self._get, job_id)
+        return await self.describe(job) if job else None
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消尚未提交的任务"""
+        return await self._call(self._cancel, job_id)
+
+    async def describe(self, job: dict) -> dict:
+        """转换为接口返回的格式"""
+        video = json.loads(job["video"]) if job.get("video") else None
+        result = {
+            "job_id": job["id"],
+            "status": job["status"],
+            "priority": job["priority"],
+            "attempts": job["attempts"],
+            "payload": json.loads(job["payload"]),
+            "task_id": job["task_id"],
+            "video_url": get_video_url(video) if video else None,
+            "video": video,
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+        if job["status"] == "queued":
+            result["queue_position"] = await self._call(self._position, job) + 1
+        return result
+
+    # ---------- 工作协程 ----------
+
+    async def _worker(self):
+        while True:
+            try:
+                job, wait = await self._call(self._claim)
+            except Exception as e:
+                job_log.exception("读取队列出错: %s", e)
+                job, wait = None, 1.0
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(wait, 5.0) if wait is not None else 5.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # 唤醒其他空闲的工作协程处理剩余任务
+            self._wakeup.set()
+            # 提交过程中的日志以队列任务ID作为关联ID
+            token = request_id_var.set(job["id"])
+            try:
+                await self._submit(job)
+            finally:
+                request_id_var.reset(token)
+
+    async def _submit(self, job: dict):
+        payload = json.loads(job["payload"])
+        attempts = job["attempts"] + 1
+        try:
+            cookie, response = await post_create(payload)
+            error = None
+            if "/login" in str(response.url):
+                error = "Session 已过期或无效"
+            elif response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+            else:
+                result = response.json()
+                task_id = extract_task_id(result)
+                if not task_id:
+                    await self._call(self._set, job["id"], status="failed", error="创建成功但无法获取任务ID", video=json.dumps(result))
+                    return
+                await self._call(self._set, job["id"], status="submitted", task_id=str(task_id), cookie=cookie, error=None)
+                self.submitted += 1
+                self._watch(job["id"], str(task_id), cookie, payload, job["callback_url"])
+                return
+        except HTTPException as e:
+            if e.status_code == 429:
+                # 准入排队已满: 按预计等待时间推迟，不计入重试次数
+                delay = float((e.headers or {}).get("Retry-After", self.backoff_base))
+                await self._call(self._set, job["id"], status="queued", attempts=job["attempts"], next_run_at=time.time() + delay)
+                return
+            error = str(e.detail)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if attempts > self.max_retries:
+            await self._call(self._set, job["id"], status="failed", error=error)
+            job_log.warning("重试 %d 次后仍失败: %s", self.max_retries, error)
+            return
+        self.retried += 1
+        delay = min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+        await self._call(self._set, job["id"], status="queued", error=error, next_run_at=time.time() + delay)
+
+    def _watch(self, job_id: str, task_id: str, cookie: Optional[str], payload: dict, callback_url: Optional[str]):
+        """交给任务跟踪器轮询，视频结束时更新任务状态"""
+        task = task_tracker.track(task_id, cookie, payload.get("model"), payload.get("duration"), callback_url)
+
+        def finished(_):
+            status = "completed" if task.succeeded and not task.error else "failed"
+            error = task.error or (None if status == "completed" else "视频生成失败")
+            asyncio.ensure_future(self._call(
+                self._set, job_id, status=status, error=error, video=json.dumps(task.video) if task.video else None
+            ))
+
+        task.future.add_done_callback(finished)
+
+    async def _janitor(self):
+        """定期清理超过保留时长的已结束任务"""
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                await self._call(self._purge)
+            except Exception as e:
+                job_log.exception("清理出错: %s", e)
+
+    async def stats(self) -> dict:
+        counts = await self._call(self._counts) if self._db is not None else {}
+        return {
+            "workers": self.workers,
+            "jobs": counts,
+            "submitted": self.submitted,
+            "retried": self.retried,
+            "deduplicated": self.deduplicated,
+        }
+
+
+job_queue = JobQueue(JOB_DB_PATH, JOB_WORKERS, JOB_MAX_RETRIES, JOB_BACKOFF_BASE, JOB_BACKOFF_MAX, JOB_RETENTION)
+
+
+# ==================== 视频缓存 ====================
+
+def proxy_cache_key(url: str) -> str:
+    """
+    计算视频URL的缓存键
+
+    生成的视频内容不可变，但每次获取到的预签名URL签名都不同，
+    因此去掉签名类查询参数后再取哈希
+    """
+    parts = urlsplit(url)
+    params = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(PROXY_CACHE_IGNORED_PARAM_PREFIXES)
+        and k.lower() not in PROXY_CACHE_IGNORED_PARAMS
+    ]
+    normalized = urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(sorted(params)), ""))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ProxyCache:
+    """
+    代理视频的磁盘LRU缓存
+
+    - 每个对象保存为 <key>.bin 数据文件 + <key>.json 元数据文件
+    - 先写入临时文件，完整接收后再原子重命名，避免读到半截文件
+    - 总大小超过容量上限时按最近使用时间淘汰；使用时间记录在元数据文件的修改时间上，
+      数据文件保持不变，FileResponse 据此生成的校验头不会随命中而变化
+    - 命中的条目在响应发送完之前被淘汰时，只移出索引，文件等最后一个读取者释放后再删除
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._pending = set()  # 进行中的收尾任务 (保留引用，避免被回收)
+        self._readers = {}  # 键 -> 正在发送该文件的响应数
+        self._doomed = set()  # 已淘汰但仍有读取者的键
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self):
+        """启动时扫描缓存目录，按元数据文件的修改时间重建LRU顺序并清理残留的临时文件"""
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".tmp-"):
+                os.remove(path)
+                continue
+            if not name.endswith(".bin"):
+                continue
+            key = name[:-4]
+            if not os.path.exists(self._meta_path(key)):
+                os.remove(path)
+                continue
+            found.append((os.stat(self._meta_path(key)).st_mtime, key, os.path.getsize(path)))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._delete_files(self._evict())
+
+    # 索引只在事件循环中修改，文件读写都放到线程中执行，避免阻塞其他请求
+
+    def _read_meta(self, key: str) -> dict:
+        with open(self._meta_path(key), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        os.utime(self._meta_path(key))
+        return meta
+
+    async def get(self, key: str) -> Optional[tuple]:
+        """
+        查询缓存，命中时返回 (数据文件路径, 元数据)
+
+        命中后文件在调用 release(key) 之前不会被删除，调用方发送完响应后必须释放
+        """
+        if not self.enabled:
+            return None
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        # 先登记读取者，读取元数据期间条目被淘汰也不会删除文件
+        self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            meta = await asyncio.to_thread(self._read_meta, key)
+        except (OSError, ValueError):
+            self._remove(key)
+            self._doomed.add(key)
+            self.release(key)
+            self.misses += 1
+            return None
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return self._data_path(key), meta
+
+    def release(self, key: str):
+        """命中的响应发送完毕，已被淘汰且没有其他读取者时在后台删除文件"""
+        count = self._readers.get(key, 0) - 1
+        if count > 0:
+            self._readers[key] = count
+            return
+        self._readers.pop(key, None)
+        if key in self._doomed:
+            self._doomed.discard(key)
+            self._run_later(asyncio.to_thread(self._delete_files, [key]))
+
+    def _run_later(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def create_temp_file(self) -> tuple:
+        """创建与缓存目录同分区的临时文件，返回 (文件对象, 路径)"""
+        path = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        return await asyncio.to_thread(open, path, "wb"), path
+
+    def _store(self, key: str, temp_path: str, meta: dict) -> Optional[int]:
+        size = os.path.getsize(temp_path)
+        if size > self.max_bytes:
+            os.remove(temp_path)
+            return None
+
+        meta_temp_path = f"{temp_path}.json"
+        with open(meta_temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self._data_path(key))
+        os.replace(meta_temp_path, self._meta_path(key))
+        return size
+
+    def finish_later(self, key: str, temp_file, temp_path: str, complete: bool, meta: dict):
+        """在后台任务中关闭临时文件，完整时放入缓存，否则删除"""
+
+        async def finish():
+            await asyncio.to_thread(temp_file.close)
+            if complete:
+                await self.commit(key, temp_path, meta)
+            else:
+                await asyncio.to_thread(os.remove, temp_path)
+
+        self._run_later(finish())
+
+    async def commit(self, key: str, temp_path: str, meta: dict):
+        """将写完的临时文件原子地放入缓存"""
+        size = await asyncio.to_thread(self._store, key, temp_path, meta)
+        if size is None:
+            return
+
+        # 新文件已替换旧文件，之前待删除的标记不再适用
+        self._doomed.discard(key)
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._total_bytes += size
+        evicted = self._evict()
+        if evicted:
+            await asyncio.to_thread(self._delete_files, evicted)
+
+    def _remove(self, key: str):
+        self._total_bytes -= self._entries.pop(key, 0)
+
+    def _delete_files(self, keys: List[str]):
+        for key in keys:
+            for path in (self._data_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self) -> List[str]:
+        """按LRU顺序移出索引直至不超过容量，返回可以立即删除文件的键 (仍有读取者的延后删除)"""
+        evicted = []
+        while self._total_bytes > self.max_bytes and self._entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            if self._readers.get(oldest_key):
+                self._doomed.add(oldest_key)
+            else:
+                evicted.append(oldest_key)
+        return evicted
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+proxy_cache = ProxyCache(PROXY_CACHE_DIR, PROXY_CACHE_MAX_BYTES)
+
+
+class CachedFileResponse(FileResponse):
+    """发送缓存文件的 FileResponse，无论正常结束、出错还是客户端断开，结束后都调用 on_close"""
+
+    def __init__(self, *args, on_close, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+# ==================== 上传去重 ====================
+
+class UploadCache:
+    """
+    已上传图片的内容寻址缓存
+
+    - 以图片内容的 sha256 为键，记录上游返回的图片URL和上传时间
+    - 有效期内相同内容的图片直接复用URL，不再重复上传
+    - 超过最大条目数时淘汰最久未使用的记录
+    - 写入后延迟 save_delay 秒，在线程中把这段时间内的所有变更一次性原子地保存到磁盘，重启后继续生效
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int, save_delay: float):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for digest, entry in sorted(entries.items(), key=lambda item: item[1].get("used_at", 0)):
+            if now - entry.get("created_at", 0) < self.ttl:
+                self._entries[digest] = entry
+        self._evict()
+
+    def _save(self, entries: dict):
+        temp_path = f"{self.path}.tmp-{uuid.uuid4().hex}"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            upload_log.warning("上传去重记录保存失败: %s", e)
+
+    def _schedule_save(self):
+        self._dirty = True
+        if self._save_task is None:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self):
+        try:
+            while self._dirty:
+                await asyncio.sleep(self.save_delay)
+                await self._flush()
+        finally:
+            self._save_task = None
+
+    async def _flush(self):
+        # 在事件循环中复制索引 (之后只会修改各记录已有的字段，不影响线程中的遍历)，序列化与写盘在线程中进行
+        self._dirty = False
+        self.saves += 1
+        await asyncio.to_thread(self._save, dict(self._entries))
+
+    async def close(self):
+        """关闭时取消延迟保存并立即写入尚未保存的变更"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            await asyncio.gather(self._save_task, return_exceptions=True)
+        if self._dirty:
+            await self._flush()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, digest: str) -> Optional[str]:
+        """查询内容哈希对应的图片URL，未命中或已过期时返回None"""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(digest)
+        if entry is None or time.time() - entry["created_at"] >= self.ttl:
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+        entry["used_at"] = time.time()
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return entry["url"]
+
+    def put(self, digest: str, url: str):
+        if not self.enabled:
+            return
+        now = time.time()
+        self._entries[digest] = {"url": url, "created_at": now, "used_at": now}
+        self._entries.move_to_end(digest)
+        self._evict()
+        self._schedule_save()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "saves": self.saves,
+        }
+
+
+upload_cache = UploadCache(UPLOAD_CACHE_PATH, UPLOAD_CACHE_TTL, UPLOAD_CACHE_MAX_ENTRIES, UPLOAD_CACHE_SAVE_DELAY)
+
+
+async def hash_upload(file: UploadFile) -> tuple:
+    """
+    分块计算上传文件的 sha256 与大小，返回 (digest, size)
+
+    文件超过 UPLOAD_MAX_BYTES 时立即返回 413，不再继续读取
+    """
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"图片大小超过上限 ({UPLOAD_MAX_BYTES} 字节)")
+
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"图片大小超过上限 ({UPLOAD_MAX_BYTES} 字节)")
+        digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+async def post_upload(file: UploadFile, size: int) -> httpx.Response:
+    """
+    以 multipart 形式将图片流式上传到上游
+
+    请求体由异步生成器逐块产生，每次只从暂存文件读取 UPLOAD_CHUNK_SIZE 字节，
+    单个上传占用的内存与文件大小无关
+    """
+    boundary = uuid.uuid4().hex
+    filename = (file.filename or "image.png").replace('"', "%22").replace("\r", "").replace("\n", "")
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {file.content_type or 'image/png'}\r\n\r\n"
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    async def body():
+        yield head
+        await file.seek(0)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+        yield tail
+
+    cookie = cookie_pool.get_next()
+    headers = get_headers(cookie=cookie)
+    headers["content-type"] = f"multipart/form-data; boundary={boundary}"
+    headers["content-length"] = str(len(head) + size + len(tail))
+
+    return await send_upstream(
+        "POST",
+        f"{BASE_URL}/api/upload",
+        cookie,
+        content=body(),
+        headers=headers,
+        timeout=60.0
+    )
+
+
+# ==================== 图片预处理 ====================
+
+# 图片解码/缩放/编码是CPU密集操作，放到独立线程池中执行，避免阻塞事件循环
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS, thread_name_prefix="image-preprocess")
+
+IMAGE_OUTPUT_TYPES = {
+    "JPEG": (".jpg", "image/jpeg"),
+    "WEBP": (".webp", "image/webp"),
+}
+
+
+def image_preprocess_enabled() -> bool:
+    return IMAGE_PREPROCESS and PIL_AVAILABLE and IMAGE_OUTPUT_FORMAT in IMAGE_OUTPUT_TYPES
+
+
+def image_target_box(radio: Optional[str]) -> Optional[tuple]:
+    """根据视频比例计算图片需要覆盖的最大尺寸 (宽, 高)，比例无效时返回None"""
+    try:
+        width, height = (int(part) for part in (radio or "").split(":"))
+    except ValueError:
+        return None
+    if width <= 0 or height <= 0:
+        return None
+    short = IMAGE_TARGET_SHORT_EDGE
+    if width >= height:
+        return round(short * width / height), short
+    return short, round(short * height / width)
+
+
+def image_scale(size: tuple, box: Optional[tuple]) -> float:
+    """
+    计算缩放比例 (不放大)
+
+    指定比例时保证缩放后的图片仍能完整覆盖目标尺寸 (上游按比例裁剪)；
+    未指定比例时按16:9的长边限制图片最长边
+    """
+    width, height = size
+    if box:
+        scale = max(box[0] / width, box[1] / height)
+    else:
+        scale = round(IMAGE_TARGET_SHORT_EDGE * 16 / 9) / max(width, height)
+    return min(scale, 1.0)
+
+
+def image_has_alpha(image: Image.Image) -> bool:
+    """图片是否带透明信息 (透明通道或调色板/灰度图的透明色)"""
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def flatten_alpha(image: Image.Image) -> Image.Image:
+    """将带透明信息的图片合成到白色背景上，返回 RGB 图片"""
+    image = image.convert("RGBA")
+    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    return Image.alpha_composite(background, image).convert("RGB")
+
 
-# Cookie轮询选择器 (线程安全的Round-Robin)
-class CookieSelector:
-    def __init__(self, cookies: List[str]):
-        self.cookies = cookies
-        self._cycle = itertools.cycle(cookies) if cookies else None
-        self._lock = threading.Lock()
+def preprocess_image(source, original_size: int, radio: Optional[str]) -> Optional[tuple]:
+    """
+    按EXIF方向旋转、缩放并重新编码图片 (在线程池中执行)
 
-    def get_next(self) -> Optional[str]:
-        """获取下一个cookie (Round-Robin负载均衡)"""
-        if not self._cycle:
-            return None
-        with self._lock:
-            return next(self._cycle)
+    Returns:
+        (图片数据, 扩展名, MIME类型)；无需处理或处理后反而更大时返回None
+    """
+    box = image_target_box(radio)
+    source.seek(0)
+    with Image.open(source) as image:
+        original_dimensions = image.size
+        orientation = image.getexif().get(0x0112, 1)
+
+        # JPEG 可在解码时直接按比例缩小，大幅减少大尺寸照片的解码耗时
+        if image.format == "JPEG":
+            oriented = image.size[::-1] if orientation in (5, 6, 7, 8) else image.size
+            scale = image_scale(oriented, box)
+            if scale < 1:
+                image.draft("RGB", (math.ceil(image.size[0] * scale), math.ceil(image.size[1] * scale)))
+
+        processed = ImageOps.exif_transpose(image)
+        scale = image_scale(processed.size, box)
+        if scale < 1:
+            target = (max(1, round(processed.size[0] * scale)), max(1, round(processed.size[1] * scale)))
+            processed = processed.resize(target, Image.LANCZOS)
+
+        if IMAGE_OUTPUT_FORMAT == "JPEG" and processed.mode not in ("RGB", "L"):
+            # JPEG 不支持透明，直接转换时透明区域会变成黑色或杂色
+            processed = flatten_alpha(processed) if image_has_alpha(processed) else processed.convert("RGB")
+        elif IMAGE_OUTPUT_FORMAT == "WEBP" and processed.mode not in ("RGB", "RGBA"):
+            processed = processed.convert("RGBA" if image_has_alpha(processed) else "RGB")
+
+        output = io.BytesIO()
+        processed.save(output, IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY, optimize=True)
+
+    changed = orientation != 1 or processed.size != original_dimensions
+    if not changed and output.tell() >= original_size:
+        return None
 
-    def get_all(self) -> List[str]:
-        """获取所有cookie列表"""
-        return self.cookies
+    upload_log.info("图片已预处理", extra={
+        "original_size": f"{original_dimensions[0]}x{original_dimensions[1]}",
+        "processed_size": f"{processed.size[0]}x{processed.size[1]}",
+        "original_bytes": original_size,
+        "processed_bytes": output.tell(),
+    })
+    suffix, content_type = IMAGE_OUTPUT_TYPES[IMAGE_OUTPUT_FORMAT]
+    return output.getvalue(), suffix, content_type
 
-    def count(self) -> int:
-        """获取cookie数量"""
-        return len(self.cookies)
 
-cookie_selector = CookieSelector(SESSION_COOKIES)
+async def preprocess_upload(file: UploadFile, size: int, radio: Optional[str]) -> tuple:
+    """
+    上传前预处理图片，返回 (待上传的文件, 大小)
 
-# 请求头模板
-def get_headers(content_type: str = "application/json", cookie: Optional[str] = None) -> dict:
-    # 如果未指定cookie，使用轮询选择器获取下一个
-    if cookie is None:
-        cookie = cookie_selector.get_next()
+    未启用预处理、无需处理或图片无法解析时原样返回，由上游决定是否接受
+    """
+    if not image_preprocess_enabled():
+        return file, size
 
-    if cookie:
-        # 打印调试信息 (隐藏中间部分)
-        masked_cookie = f"{cookie[:10]}...{cookie[-10:]}" if len(cookie) > 20 else cookie
-        print(f"[Debug] 使用 Cookie: {masked_cookie}")
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(image_executor, copy_context().run, preprocess_image, file.file, size, radio)
+    except Exception as e:
+        upload_log.warning("图片预处理失败，上传原图: %s", e)
+        return file, size
+    if result is None:
+        return file, size
+
+    data, suffix, content_type = result
+    filename = os.path.splitext(file.filename or "image")[0] + suffix
+    processed = UploadFile(
+        file=io.BytesIO(data),
+        size=len(data),
+        filename=filename,
+        headers=Headers({"content-type": content_type})
+    )
+    return processed, len(data)
 
-    return {
-        "accept": "*/*",
-        "accept-language": "zh-CN,zh;q=0.9",
-        "cache-control": "no-cache",
-        "content-type": content_type,
-        "cookie": f"connect.sid={cookie}" if cookie else "",
-        "origin": BASE_URL,
-        "pragma": "no-cache",
-        "referer": f"{BASE_URL}/",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36"
-    }
+
+def upload_cache_key(digest: str, radio: Optional[str]) -> str:
+    """上传去重的缓存键: 预处理结果与视频比例有关，指定比例时需要区分"""
+    if image_preprocess_enabled() and image_target_box(radio):
+        return f"{digest}:{radio}"
+    return digest
 
 
 # ==================== 请求模型 ====================
@@ -143,6 +2773,13 @@ class VideoCreateRequest(BaseModel):
     duration: int = Field(default=5, ge=1, le=10, description="视频时长(秒)")
     radio: str = Field(default="16:9", description="视频比例，如 16:9, 9:16, 1:1")
     image: Optional[str] = Field(default=None, description="图片URL(图生视频时必填)")
+    callback_url: Optional[str] = Field(default=None, description="任务结束后回调通知的URL(可选)")
+
+
+class JobCreateRequest(VideoCreateRequest):
+    """任务入队请求模型"""
+    priority: int = Field(default=0, description="优先级，数值越大越先提交")
+    dedup: bool = Field(default=True, description="参数与回调地址都相同且尚未结束的任务是否直接返回已有任务")
 
 
 class VideoCreateResponse(BaseModel):
@@ -167,6 +2804,11 @@ class VideoListResponse(BaseModel):
     message: Optional[str] = None
 
 
+class VideoBatchStatusRequest(BaseModel):
+    """批量查询视频状态请求模型"""
+    task_ids: List[str] = Field(..., min_length=1, max_length=200, description="任务ID列表")
+
+
 class VideoStatusResponse(BaseModel):
     """视频状态响应模型"""
     success: bool
@@ -185,23 +2827,101 @@ async def root():
     return {
         "service": "豆包 Seedance 视频生成 API",
         "version": "1.0.0",
-        "cookie_count": cookie_selector.count(),
-        "load_balance": "round-robin",
+        "cookie_count": cookie_pool.count(),
+        "cookie_pool": cookie_pool.stats(),
+        "load_balance": "least-loaded",
         "auth_enabled": auth_enabled,
+        "proxy_cache": proxy_cache.stats(),
+        "http_pool": http_pool_stats(),
+        "video_list_cache": video_list_cache.stats(),
+        "task_tracker": task_tracker.stats(),
+        "task_affinity": task_affinity.stats(),
+        "create_admission": create_admission.stats(),
+        "webhook": webhook_dispatcher.stats(),
+        "upload_cache": upload_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "job_queue": await job_queue.stats(),
         "endpoints": {
             "upload": "POST /api/upload - 上传图片",
+            "upload_lookup": "GET /api/upload/{sha256} - 按内容哈希查询已上传的图片",
             "create_video": "POST /api/video/create - 创建视频",
+            "enqueue_job": "POST /api/jobs - 任务入队 (持久化队列)",
+            "job_status": "GET /api/jobs/{job_id} - 查询队列任务状态",
             "list_videos": "GET /api/videos - 获取视频列表",
+            "videos_status": "POST /api/videos/status - 批量查询视频状态",
             "video_count": "GET /api/stats/video-count - 获取视频统计",
             "video_status": "GET /api/video/{video_id}/status - 查询视频状态",
-            "proxy": "GET /proxy/{url} - 视频代理下载"
+            "video_events": "GET /api/video/{task_id}/events - 订阅任务状态推送 (SSE)",
+            "metrics": "GET /metrics - Prometheus 监控指标",
+            "proxy": "GET|HEAD /proxy/{url} - 视频代理下载 (支持Range)"
         }
     }
 
 
+@app.get("/metrics", tags=["健康检查"], include_in_schema=False)
+async def metrics():
+    """Prometheus 指标 (无需鉴权，可通过 METRICS_ENABLED=false 关闭)"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    # 以下为抓取时读取的各组件状态
+    cookies = cookie_pool.stats()["cookies"]
+    lines += render_samples("seedance_cookie_healthy", "Whether each session cookie is currently usable (1) or quarantined (0)",
+                          [((i,), int(c["healthy"])) for i, c in enumerate(cookies)], ("cookie",))
+    lines += render_samples("seedance_cookie_inflight", "In-flight upstream requests per session cookie",
+                          [((i,), c["inflight"]) for i, c in enumerate(cookies)], ("cookie",))
+    lines += render_samples("seedance_cookie_latency_seconds", "Smoothed upstream latency per session cookie",
+                          [((i,), c["latency_ms"] / 1000) for i, c in enumerate(cookies)], ("cookie",))
+
+    admission = create_admission.stats()
+    webhook = webhook_dispatcher.stats()
+    tracker = task_tracker.stats()
+    jobs = await job_queue.stats()
+    lines += render_samples("seedance_queue_depth", "Items waiting in each internal queue", [
+        (("admission",), admission["queue_length"]),
+        (("webhook",), webhook["queued"] + webhook["retrying"]),
+        (("job",), jobs["jobs"].get("queued", 0)),
+        (("task_tracker",), tracker["pending"]),
+    ], ("queue",))
+    lines += render_samples("seedance_create_inflight", "Create requests currently submitted upstream",
+                          [((), admission["inflight"])])
+    lines += render_samples("seedance_jobs", "Persistent job queue entries by status",
+                          [((status,), count) for status, count in jobs["jobs"].items()], ("status",))
+
+    video_list = video_list_cache.stats()
+    proxy = proxy_cache.stats()
+    upload = upload_cache.stats()
+    idempotency = idempotency_store.stats()
+    lines += render_samples("seedance_cache_hits_total", "Cache hits by cache", [
+        (("proxy",), proxy["hits"]),
+        (("upload",), upload["hits"]),
+        (("video_list",), video_list["hits"] + video_list["stale_hits"] + video_list["coalesced"]),
+        (("idempotency",), idempotency["replayed"] + idempotency["coalesced"]),
+    ], ("cache",), "counter")
+    lines += render_samples("seedance_cache_misses_total", "Cache misses by cache", [
+        (("proxy",), proxy["misses"]),
+        (("upload",), upload["misses"]),
+        (("video_list",), video_list["fetches"]),
+    ], ("cache",), "counter")
+    lines += render_samples("seedance_proxy_cache_bytes", "Bytes stored in the proxy disk cache", [((), proxy["bytes"])])
+
+    pool = http_pool_stats()
+    lines += render_samples("seedance_http_pool_connections", "Upstream connection pool connections by state", [
+        (("active",), pool["active"]),
+        (("idle",), pool["idle"]),
+        (("queued",), pool["queued_requests"]),
+    ], ("state",))
+
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ==================== 视频代理接口 ====================
 
-@app.get("/proxy/{target_url:path}", tags=["代理"])
+@app.api_route("/proxy/{target_url:path}", methods=["GET", "HEAD"], tags=["代理"])
 async def proxy_video(target_url: str, request: Request):
     """
     视频代理下载接口
@@ -209,6 +2929,9 @@ async def proxy_video(target_url: str, request: Request):
     解决国内网络无法直接访问外网视频URL的问题
     将外网视频通过服务器代理下载
 
+    支持 Range 请求 (返回 206 Partial Content) 和 HEAD 请求，
+    浏览器 <video> 拖动进度条和断点续传只会传输所需的字节
+
     使用方式:
     - 原始URL: https://ark-content-generation-ap-southeast-1.tos-ap-southeast-1.volces.com/xxx.mp4?...
     - 代理URL: https://your-server.com/proxy/https://ark-content-generation-ap-southeast-1.tos-ap-southeast-1.volces.com/xxx.mp4?...
@@ -236,138 +2959,253 @@ async def proxy_video(target_url: str, request: Request):
     if not full_url.startswith("http://") and not full_url.startswith("https://"):
         raise HTTPException(status_code=400, detail="Invalid URL format. URL must start with http:// or https://")
 
-    print(f"[Proxy] 代理请求: {full_url[:100]}...")
-
-    try:
-        async with httpx.AsyncClient(timeout=300.0, follow_redirects=True) as client:
-            # 发起请求获取视频
-            response = await client.get(
-                full_url,
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-                    "Accept": "*/*",
-                    "Accept-Encoding": "identity",  # 不使用压缩，方便流式传输
-                }
-            )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to fetch resource: {response.status_code}"
-                )
+    proxy_log.info("代理请求", extra={"url": full_url[:100], "sampled": True})
+
+    # 优先从磁盘缓存读取 (FileResponse 自行处理 Range/HEAD，并在服务器支持时使用 sendfile)
+    cache_key = proxy_cache_key(full_url)
+    cached = await proxy_cache.get(cache_key)
+    if cached:
+        cache_path, meta = cached
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Expose-Headers": "Content-Length, Content-Range, Accept-Ranges",
+            "Cache-Control": "public, max-age=3600",
+            "X-Proxy-Cache": "HIT",
+        }
+        if meta.get("content_disposition"):
+            headers["Content-Disposition"] = meta["content_disposition"]
+        # 沿用上游的校验头，客户端用首次下载得到的 ETag 发起 If-Range 续传时仍能命中区间
+        if meta.get("etag"):
+            headers["ETag"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["Last-Modified"] = meta["last_modified"]
+        proxy_log.info("缓存命中", extra={"cache_key": cache_key[:16], "sampled": True})
+        return CachedFileResponse(
+            cache_path,
+            media_type=meta.get("content_type"),
+            headers=headers,
+            on_close=lambda: proxy_cache.release(cache_key)
+        )
 
-            # 获取Content-Type
-            content_type = response.headers.get("content-type", "application/octet-stream")
+    # 转发 Range / If-Range，由上游完成字节区间的裁剪
+    upstream_headers = dict(PROXY_HEADERS)
+    for name in PROXY_FORWARD_HEADERS:
+        value = request.headers.get(name)
+        if value:
+            upstream_headers[name] = value
 
-            # 获取文件名（如果有的话）
-            content_disposition = response.headers.get("content-disposition", "")
+    client = get_http_client()
+    try:
+        # 以流式方式发起请求，只读取响应头，响应体按块转发
+        # HEAD 也使用 GET 请求上游: 预签名URL通常只对GET方法有效
+        upstream_request = client.build_request("GET", full_url, headers=upstream_headers, timeout=300.0)
+        start = time.monotonic()
+        response = await client.send(upstream_request, stream=True)
+        UPSTREAM_REQUESTS.inc("proxy", str(response.status_code))
+        UPSTREAM_LATENCY.observe(time.monotonic() - start, "proxy")
+    except httpx.TimeoutException:
+        UPSTREAM_REQUESTS.inc("proxy", "TimeoutException")
+        proxy_log.warning("代理超时", extra={"url": full_url[:100]})
+        raise HTTPException(status_code=504, detail="Proxy request timeout")
+    except httpx.RequestError as e:
+        UPSTREAM_REQUESTS.inc("proxy", type(e).__name__)
+        proxy_log.warning("代理失败: %s", e)
+        raise HTTPException(status_code=502, detail=f"Proxy request failed: {str(e)}")
 
-            # 构建响应头
-            headers = {
-                "Content-Type": content_type,
-                "Access-Control-Allow-Origin": "*",
-                "Cache-Control": "public, max-age=3600",
-            }
+    async def close_upstream():
+        """响应结束(或客户端断开)后将连接归还连接池"""
+        await response.aclose()
 
-            # 如果有Content-Length，添加到响应头
-            if "content-length" in response.headers:
-                headers["Content-Length"] = response.headers["content-length"]
+    # 请求的区间超出文件范围，原样返回416及Content-Range
+    if response.status_code == 416:
+        await close_upstream()
+        headers = {"Access-Control-Allow-Origin": "*"}
+        if "content-range" in response.headers:
+            headers["Content-Range"] = response.headers["content-range"]
+        return Response(status_code=416, headers=headers)
 
-            # 如果有Content-Disposition，保留
-            if content_disposition:
-                headers["Content-Disposition"] = content_disposition
+    if response.status_code not in (200, 206):
+        await close_upstream()
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Failed to fetch resource: {response.status_code}"
+        )
 
-            print(f"[Proxy] 代理成功: {content_type}, {response.headers.get('content-length', 'unknown')} bytes")
+    # 获取Content-Type
+    content_type = response.headers.get("content-type", "application/octet-stream")
 
-            # 返回流式响应
-            return StreamingResponse(
-                iter([response.content]),
-                media_type=content_type,
-                headers=headers
-            )
+    # 构建响应头
+    headers = {
+        "Content-Type": content_type,
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": "Content-Length, Content-Range, Accept-Ranges",
+        "Cache-Control": "public, max-age=3600",
+    }
 
-    except httpx.TimeoutException:
-        print(f"[Proxy] 代理超时: {full_url[:100]}...")
-        raise HTTPException(status_code=504, detail="Proxy request timeout")
-    except httpx.RequestError as e:
-        print(f"[Proxy] 代理失败: {str(e)}")
-        raise HTTPException(status_code=502, detail=f"Proxy request failed: {str(e)}")
+    # 保留上游的长度、区间、校验等响应头 (上游使用identity编码，长度与转发字节一致)
+    for name, header_name in PROXY_PASSTHROUGH_HEADERS.items():
+        if name in response.headers:
+            headers[header_name] = response.headers[name]
+
+    proxy_log.info("代理成功", extra={
+        "status": response.status_code,
+        "content_type": content_type,
+        "content_length": response.headers.get("content-length"),
+        "sampled": True,
+    })
+
+    # HEAD 请求只返回响应头
+    if request.method == "HEAD":
+        await close_upstream()
+        return Response(status_code=response.status_code, headers=headers)
+
+    # 只缓存完整且长度已知的响应，区间请求直接透传
+    expected_length = int(response.headers.get("content-length", "-1"))
+    should_cache = (
+        proxy_cache.enabled
+        and response.status_code == 200
+        and 0 < expected_length <= proxy_cache.max_bytes
+    )
+    headers["X-Proxy-Cache"] = "MISS"
+
+    async def stream_body():
+        """逐块转发上游数据，内存占用与文件大小无关；同时写入缓存临时文件"""
+        cache_file, cache_temp_path = await proxy_cache.create_temp_file() if should_cache else (None, None)
+        written = 0
+        try:
+            async for chunk in response.aiter_bytes(PROXY_CHUNK_SIZE):
+                PROXY_UPSTREAM_BYTES.inc(amount=len(chunk))
+                if cache_file:
+                    # 缓存文件在线程中写入，不阻塞其他请求
+                    await asyncio.to_thread(cache_file.write, chunk)
+                    written += len(chunk)
+                yield chunk
+        except httpx.HTTPError as e:
+            # 响应头已发出，无法再返回错误状态码，只能中断连接
+            proxy_log.warning("转发中断: %s", e)
+            raise
+        finally:
+            if cache_file:
+                # 客户端收完数据后可能立即断开并取消本协程，收尾工作交给独立的后台任务
+                proxy_cache.finish_later(cache_key, cache_file, cache_temp_path, written == expected_length, {
+                    "url": full_url.split("?")[0],
+                    "content_type": content_type,
+                    "content_disposition": response.headers.get("content-disposition", ""),
+                    "etag": response.headers.get("etag", ""),
+                    "last_modified": response.headers.get("last-modified", ""),
+                })
+
+    # 返回流式响应 (200 完整内容 / 206 部分内容)
+    return StreamingResponse(
+        stream_body(),
+        status_code=response.status_code,
+        media_type=content_type,
+        headers=headers,
+        background=BackgroundTask(close_upstream)
+    )
 
 
 @app.post("/api/upload", response_model=UploadResponse, tags=["上传"])
 async def upload_image(
     file: UploadFile = File(...),
+    radio: Optional[str] = None,
     token: str = Depends(verify_auth_token)
 ):
     """
     上传图片
 
-    用于图生视频模式，上传图片后获取图片URL
+    用于图生视频模式，上传图片后获取图片URL；
+    相同内容的图片在缓存有效期内直接返回之前的URL，不再重复上传
+
+    参数:
+    - radio: 视频比例(可选)，图片会缩放到该比例所需的最大尺寸
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
 
-    try:
-        # 读取文件内容
-        file_content = await file.read()
+    # 分块计算内容哈希并检查大小上限，不把整个文件读入内存
+    digest, size = await hash_upload(file)
+    cache_key = upload_cache_key(digest, radio)
 
-        # 构建multipart请求
-        async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
-            files = {
-                "file": (file.filename, file_content, file.content_type or "image/png")
-            }
+    try:
+        cached_url = upload_cache.get(cache_key)
+        if cached_url:
+            return UploadResponse(
+                success=True,
+                message="上传成功 (复用已上传的图片)",
+                url=cached_url,
+                data={"sha256": digest, "cached": True}
+            )
 
-            headers = get_headers()
-            # 删除content-type让httpx自动设置multipart边界
-            del headers["content-type"]
+        file, size = await preprocess_upload(file, size, radio)
+        response = await post_upload(file, size)
 
-            response = await client.post(
-                f"{BASE_URL}/api/upload",
-                files=files,
-                headers=headers
+        # 检查是否被重定向到了登录页
+        if "/login" in str(response.url):
+            return UploadResponse(
+                success=False,
+                message="上传失败: Session 已过期或无效，请更新 SESSION_COOKIE",
+                data={"error": "Redirected to login page", "url": str(response.url)}
             )
 
-            # 检查是否被重定向到了登录页
-            if "/login" in str(response.url):
+        if response.status_code == 200:
+            result = response.json()
+            # 兼容 {ok: true, url: "..."} 格式
+            is_success = result.get("ok") or result.get("success")
+            image_url = result.get("url")
+
+            if is_success and image_url:
+                upload_cache.put(cache_key, image_url)
                 return UploadResponse(
-                    success=False,
-                    message="上传失败: Session 已过期或无效，请更新 SESSION_COOKIE",
-                    data={"error": "Redirected to login page", "url": str(response.url)}
+                    success=True,
+                    message="上传成功",
+                    url=image_url,
+                    data=result
                 )
-
-            if response.status_code == 200:
-                result = response.json()
-                # 兼容 {ok: true, url: "..."} 格式
-                is_success = result.get("ok") or result.get("success")
-                image_url = result.get("url")
-
-                if is_success and image_url:
-                    return UploadResponse(
-                        success=True,
-                        message="上传成功",
-                        url=image_url,
-                        data=result
-                    )
-                else:
-                    return UploadResponse(
-                        success=False,
-                        message=result.get("message") or "上传失败",
-                        data=result
-                    )
             else:
                 return UploadResponse(
                     success=False,
-                    message=f"上传失败: {response.status_code}",
-                    data={"error": response.text}
+                    message=result.get("message") or "上传失败",
+                    data=result
                 )
+        else:
+            return UploadResponse(
+                success=False,
+                message=f"上传失败: {response.status_code}",
+                data={"error": response.text}
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传出错: {str(e)}")
 
 
+@app.get("/api/upload/{sha256}", response_model=UploadResponse, tags=["上传"])
+async def lookup_upload(
+    sha256: str,
+    radio: Optional[str] = None,
+    token: str = Depends(verify_auth_token)
+):
+    """
+    按内容哈希查询已上传的图片
+
+    客户端可先计算图片的 sha256 查询，命中时直接使用返回的URL，无需再上传图片
+    """
+    image_url = upload_cache.get(upload_cache_key(sha256.lower(), radio))
+    if not image_url:
+        raise HTTPException(status_code=404, detail="未找到该图片的上传记录")
+    return UploadResponse(
+        success=True,
+        message="已找到上传记录",
+        url=image_url,
+        data={"sha256": sha256.lower(), "cached": True}
+    )
+
+
 @app.post("/api/video/create", response_model=VideoCreateResponse, tags=["视频生成"])
 async def create_video(
     request: VideoCreateRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
     token: str = Depends(verify_auth_token)
 ):
     """
@@ -383,54 +3221,72 @@ async def create_video(
     - duration: 视频时长(秒)，默认5秒
     - radio: 视频比例，如 16:9, 9:16, 1:1
     - image: 图片URL(图生视频时必填)
+    - callback_url: 任务结束后回调通知的URL(可选)
+
+    请求头 Idempotency-Key: 同一 Key 在 IDEMPOTENCY_TTL 内重复提交时返回首次创建的结果，
+    不会重复创建任务 (重放的响应带 Idempotent-Replayed: true)
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
+    await validate_callback_url(request.callback_url)
+
+    # 构建请求体
+    payload = {
+        "model": request.model,
+        "prompt": request.prompt,
+        "duration": request.duration,
+        "radio": request.radio
+    }
 
-    try:
-        # 构建请求体
-        payload = {
-            "model": request.model,
-            "prompt": request.prompt,
-            "duration": request.duration,
-            "radio": request.radio
-        }
+    # 如果有图片URL，添加到请求体(图生视频模式)
+    if request.image:
+        payload["image"] = request.image
 
-        # 如果有图片URL，添加到请求体(图生视频模式)
-        if request.image:
-            payload["image"] = request.image
+    # 回调地址也计入参数指纹: 回调不同的请求不会被合并或重放，各自的回调都能送达
+    key = IdempotencyStore.scoped_key(idempotency_key, token)
+    fingerprint = IdempotencyStore.fingerprint({**payload, "callback_url": request.callback_url})
+    result, replayed = await idempotency_store.run(
+        key, fingerprint, lambda: submit_create(request, payload)
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
 
-        async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as client:
-            headers = get_headers()
-            response = await client.post(
-                f"{BASE_URL}/api/video/create",
-                json=payload,
-                headers=headers
-            )
 
-            # 检查是否被重定向到了登录页
-            if "/login" in str(response.url):
-                return VideoCreateResponse(
-                    success=False,
-                    message="创建失败: Session 已过期或无效，请更新 SESSION_COOKIE",
-                    data={"error": "Redirected to login page", "url": str(response.url)}
-                )
+async def submit_create(request: VideoCreateRequest, payload: dict) -> VideoCreateResponse:
+    """提交创建视频请求并登记任务跟踪"""
+    try:
+        cookie, response = await post_create(payload)
+
+        # 检查是否被重定向到了登录页
+        if "/login" in str(response.url):
+            return VideoCreateResponse(
+                success=False,
+                message="创建失败: Session 已过期或无效，请更新 SESSION_COOKIE",
+                data={"error": "Redirected to login page", "url": str(response.url)}
+            )
 
-            if response.status_code == 200:
-                result = response.json()
-                mode = "图生视频" if request.image else "文生视频"
-                return VideoCreateResponse(
-                    success=True,
-                    message=f"视频创建任务已提交 ({mode})",
-                    data=result
-                )
-            else:
-                return VideoCreateResponse(
-                    success=False,
-                    message=f"创建失败: {response.status_code}",
-                    data={"error": response.text}
-                )
+        if response.status_code == 200:
+            result = response.json()
+            # 登记到后台任务跟踪器，由服务端统一轮询状态
+            task_id = extract_task_id(result)
+            if task_id:
+                task_tracker.track(task_id, cookie, request.model, request.duration, request.callback_url)
+            mode = "图生视频" if request.image else "文生视频"
+            return VideoCreateResponse(
+                success=True,
+                message=f"视频创建任务已提交 ({mode})",
+                data=result
+            )
+        else:
+            return VideoCreateResponse(
+                success=False,
+                message=f"创建失败: {response.status_code}",
+                data={"error": response.text}
+            )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建视频出错: {str(e)}")
 
@@ -440,50 +3296,64 @@ async def list_videos(token: str = Depends(verify_auth_token)):
     """
     获取视频列表
 
-    返回当前账号下的所有视频记录
+    返回当前账号下的所有视频记录 (短时间内的重复请求共享同一份上游快照)
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
 
     try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = get_headers()
-            del headers["content-type"]  # GET请求不需要content-type
+        items = await video_list_cache.get(cookie_pool.get_next())
+        return VideoListResponse(
+            success=True,
+            data=items
+        )
 
-            response = await client.get(
-                f"{BASE_URL}/api/videos",
-                headers=headers
+    except UpstreamError as e:
+        if e.session_expired:
+            return VideoListResponse(
+                success=False,
+                message="获取失败: Session 已过期或无效，请更新 SESSION_COOKIE"
             )
+        return VideoListResponse(
+            success=False,
+            message=f"获取失败: {e.message}"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取视频列表出错: {str(e)}")
 
-            # 检查是否被重定向到了登录页
-            if "/login" in str(response.url):
-                return VideoListResponse(
-                    success=False,
-                    message="获取失败: Session 已过期或无效，请更新 SESSION_COOKIE"
-                )
 
-            if response.status_code == 200:
-                result = response.json()
-                # 兼容多种返回格式: {ok, items} 或 {success, data} 或直接数组
-                if isinstance(result, list):
-                    items = result
-                elif result.get("ok"):
-                    items = result.get("items", [])
-                else:
-                    items = result.get("data", [])
-
-                return VideoListResponse(
-                    success=True,
-                    data=items
-                )
-            else:
-                return VideoListResponse(
-                    success=False,
-                    message=f"获取失败: {response.status_code}"
-                )
+@app.post("/api/videos/status", response_model=VideoListResponse, tags=["视频管理"])
+async def get_videos_status(
+    request: VideoBatchStatusRequest,
+    token: str = Depends(verify_auth_token)
+):
+    """
+    批量查询视频状态
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取视频列表出错: {str(e)}")
+    每个任务在创建它的账号的视频列表快照中查找，返回找到的视频记录 (未找到的任务不出现在结果中)。
+    同一账号的多个任务共享同一份快照，某个账号查询失败不影响其他账号的任务
+    """
+    if cookie_pool.count() == 0:
+        raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
+
+    async def lookup(task_id: str) -> Optional[dict]:
+        cookie = await task_affinity.resolve(task_id)
+        return await video_list_cache.find_video(cookie, task_id) if cookie is not None else None
+
+    task_ids = list(dict.fromkeys(request.task_ids))
+    results = await asyncio.gather(*(lookup(task_id) for task_id in task_ids), return_exceptions=True)
+    videos = [video for video in results if isinstance(video, dict)]
+    errors = [e for e in results if isinstance(e, BaseException)]
+    if errors and len(errors) == len(results):
+        e = errors[0]
+        if isinstance(e, UpstreamError):
+            if e.session_expired:
+                return VideoListResponse(success=False, message="查询失败: Session 已过期或无效")
+            return VideoListResponse(success=False, message=f"查询失败: {e.message}")
+        raise HTTPException(status_code=500, detail=f"查询状态出错: {str(e)}")
+
+    # 同一视频可能被多个任务ID (如带/不带 ::model 后缀) 命中，只返回一次
+    return VideoListResponse(success=True, data=list({id(video): video for video in videos}.values()))
 
 
 @app.get("/api/stats/video-count", tags=["统计"])
@@ -493,27 +3363,30 @@ async def get_video_count(token: str = Depends(verify_auth_token)):
 
     返回视频总数等统计信息
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
 
     try:
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = get_headers()
-            del headers["content-type"]
-
-            response = await client.get(
-                f"{BASE_URL}/api/stats/video-count",
-                headers=headers
-            )
+        cookie = cookie_pool.get_next()
+        headers = get_headers(cookie=cookie)
+        del headers["content-type"]
+
+        response = await send_upstream(
+            "GET",
+            f"{BASE_URL}/api/stats/video-count",
+            cookie,
+            headers=headers,
+            timeout=30.0
+        )
 
-            # 检查是否被重定向到了登录页
-            if "/login" in str(response.url):
-                return {"success": False, "message": "获取失败: Session 已过期或无效"}
+        # 检查是否被重定向到了登录页
+        if "/login" in str(response.url):
+            return {"success": False, "message": "获取失败: Session 已过期或无效"}
 
-            if response.status_code == 200:
-                return {"success": True, "data": response.json()}
-            else:
-                return {"success": False, "message": f"获取失败: {response.status_code}"}
+        if response.status_code == 200:
+            return {"success": True, "data": response.json()}
+        else:
+            return {"success": False, "message": f"获取失败: {response.status_code}"}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取统计出错: {str(e)}")
@@ -527,59 +3400,103 @@ async def get_video_status(
     """
     查询视频生成状态
 
-    根据视频ID查询生成进度和结果
+    根据视频ID查询生成进度和结果 (使用创建该任务的账号查询)
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
 
     try:
-        # 通过获取视频列表来查找特定视频的状态
-        async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-            headers = get_headers()
-            del headers["content-type"]
-
-            response = await client.get(
-                f"{BASE_URL}/api/videos",
-                headers=headers
+        # 通过任务所属账号的视频列表快照索引来查找特定视频的状态
+        cookie = await task_affinity.resolve(video_id)
+        video = await video_list_cache.find_video(cookie, video_id) if cookie is not None else None
+        if video:
+            return VideoStatusResponse(
+                success=True,
+                status=video.get("status"),
+                video_url=video.get("videoUrl"),
+                data=video
             )
+        return VideoStatusResponse(
+            success=False,
+            message="视频未找到"
+        )
 
-            # 检查是否被重定向到了登录页
-            if "/login" in str(response.url):
-                return VideoStatusResponse(
-                    success=False,
-                    message="查询失败: Session 已过期或无效"
-                )
-
-            if response.status_code == 200:
-                videos = response.json()
-                if isinstance(videos, list):
-                    for video in videos:
-                        if str(video.get("id")) == video_id or video.get("taskId") == video_id:
-                            return VideoStatusResponse(
-                                success=True,
-                                status=video.get("status"),
-                                video_url=video.get("videoUrl"),
-                                data=video
-                            )
-                    return VideoStatusResponse(
-                        success=False,
-                        message="视频未找到"
-                    )
-                else:
-                    return VideoStatusResponse(
-                        success=True,
-                        data=videos
-                    )
-            else:
-                return VideoStatusResponse(
-                    success=False,
-                    message=f"查询失败: {response.status_code}"
-                )
-
+    except UpstreamError as e:
+        if e.session_expired:
+            return VideoStatusResponse(
+                success=False,
+                message="查询失败: Session 已过期或无效"
+            )
+        return VideoStatusResponse(
+            success=False,
+            message=f"查询失败: {e.message}"
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查询状态出错: {str(e)}")
 
 
+@app.get("/api/video/{task_id}/events", tags=["视频管理"])
+async def video_events(
+    task_id: str,
+    token: str = Depends(verify_auth_token)
+):
+    """
+    订阅任务状态推送 (Server-Sent Events)
+
+    连接建立后立即推送一次当前状态，之后服务端每得知一次状态变化就推送一次，
+    任务结束(完成/失败)后推送最终状态并关闭连接
+
+    事件格式:
+    - event: status
+    - data: {"task_id", "status", "done", "video_url", "error", "elapsed", "video"}
+    """
+    if cookie_pool.count() == 0:
+        raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
+
+    # 非本服务创建的任务需先在账号的视频列表中确认存在，才加入后台跟踪，
+    # 避免拼错或伪造的任务ID被持续轮询直到跟踪超时
+    task = task_tracker.get(task_id)
+    if task is None:
+        try:
+            cookie = await task_affinity.resolve(task_id)
+            video = await video_list_cache.find_video(cookie, task_id) if cookie is not None else None
+        except UpstreamError as e:
+            raise HTTPException(status_code=502, detail=f"查询任务失败: {e.message}")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"查询任务失败: {e}")
+        if video is None:
+            raise HTTPException(status_code=404, detail="任务未找到")
+        task = task_tracker.track(task_id, cookie)
+    queue = task_tracker.subscribe(task_id)
+
+    def format_event(event: dict) -> str:
+        return f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    async def event_stream():
+        try:
+            event = task.to_dict()
+            event["video"] = task.video
+            yield format_event(event)
+            while not event["done"]:
+                try:
+                    event = await asyncio.wait_for(queue.get(), TASK_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            task_tracker.unsubscribe(task_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 禁止 Nginx 缓冲，保证事件实时送达
+        }
+    )
+
+
 @app.post("/api/video/create-with-image", response_model=VideoCreateResponse, tags=["视频生成"])
 async def create_video_with_image(
     prompt: str,
@@ -587,6 +3504,9 @@ async def create_video_with_image(
     model: str = "seedance-1-5-pro-251215",
     duration: int = 5,
     radio: str = "16:9",
+    callback_url: Optional[str] = None,
+    response: Response = None,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
     token: str = Depends(verify_auth_token)
 ):
     """
@@ -600,27 +3520,49 @@ async def create_video_with_image(
     - model: 模型名称
     - duration: 视频时长(秒)
     - radio: 视频比例
+    - callback_url: 任务结束后回调通知的URL(可选)
+
+    支持 Idempotency-Key 请求头，含义同 /api/video/create (图片按内容哈希参与参数比较)
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
+    await validate_callback_url(callback_url)
+    digest, size = await hash_upload(file)
+
+    key = IdempotencyStore.scoped_key(idempotency_key, token)
+    fingerprint = IdempotencyStore.fingerprint({
+        "model": model, "prompt": prompt, "duration": duration, "radio": radio, "image_sha256": digest,
+        "callback_url": callback_url
+    })
+    result, replayed = await idempotency_store.run(
+        key, fingerprint,
+        lambda: submit_create_with_image(prompt, file, digest, size, model, duration, radio, callback_url)
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+async def submit_create_with_image(
+    prompt: str,
+    file: UploadFile,
+    digest: str,
+    size: int,
+    model: str,
+    duration: int,
+    radio: str,
+    callback_url: Optional[str]
+) -> VideoCreateResponse:
+    """上传图片 (相同内容复用已上传的URL) 并提交图生视频请求"""
+    cache_key = upload_cache_key(digest, radio)
 
     try:
-        # 第一步: 上传图片
-        file_content = await file.read()
-
-        async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
-            files = {
-                "file": (file.filename, file_content, file.content_type or "image/png")
-            }
-
-            headers = get_headers()
-            del headers["content-type"]
+        # 第一步: 上传图片 (相同内容的图片复用之前的URL)
+        image_url = upload_cache.get(cache_key)
 
-            upload_response = await client.post(
-                f"{BASE_URL}/api/upload",
-                files=files,
-                headers=headers
-            )
+        if not image_url:
+            file, size = await preprocess_upload(file, size, radio)
+            upload_response = await post_upload(file, size)
 
             # 检查是否被重定向到了登录页
             if "/login" in str(upload_response.url):
@@ -645,47 +3587,48 @@ async def create_video_with_image(
                     message="上传成功但未获取到图片URL",
                     data=upload_result
                 )
+            upload_cache.put(cache_key, image_url)
 
-            # 第二步: 创建视频
-            payload = {
-                "model": model,
-                "prompt": prompt,
-                "duration": duration,
-                "radio": radio,
-                "image": image_url
-            }
+        # 第二步: 创建视频
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "duration": duration,
+            "radio": radio,
+            "image": image_url
+        }
 
-            headers = get_headers()
-            create_response = await client.post(
-                f"{BASE_URL}/api/video/create",
-                json=payload,
-                headers=headers
-            )
+        cookie, create_response = await post_create(payload)
 
-            # 检查是否被重定向到了登录页
-            if "/login" in str(create_response.url):
-                return VideoCreateResponse(
-                    success=False,
-                    message="视频创建失败: Session 已过期或无效"
-                )
+        # 检查是否被重定向到了登录页
+        if "/login" in str(create_response.url):
+            return VideoCreateResponse(
+                success=False,
+                message="视频创建失败: Session 已过期或无效"
+            )
 
-            if create_response.status_code == 200:
-                result = create_response.json()
-                return VideoCreateResponse(
-                    success=True,
-                    message="图生视频任务已提交",
-                    data={
-                        "image_url": image_url,
-                        "video_task": result
-                    }
-                )
-            else:
-                return VideoCreateResponse(
-                    success=False,
-                    message=f"视频创建失败: {create_response.status_code}",
-                    data={"error": create_response.text}
-                )
+        if create_response.status_code == 200:
+            result = create_response.json()
+            task_id = extract_task_id(result)
+            if task_id:
+                task_tracker.track(task_id, cookie, model, duration, callback_url)
+            return VideoCreateResponse(
+                success=True,
+                message="图生视频任务已提交",
+                data={
+                    "image_url": image_url,
+                    "video_task": result
+                }
+            )
+        else:
+            return VideoCreateResponse(
+                success=False,
+                message=f"视频创建失败: {create_response.status_code}",
+                data={"error": create_response.text}
+            )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"图生视频出错: {str(e)}")
 
@@ -702,15 +3645,16 @@ async def create_video_and_wait(
     """
     创建视频并等待完成
 
-    创建视频后自动轮询状态，直到视频生成完成或超时
+    创建视频后由后台任务跟踪器统一轮询状态，直到视频生成完成或超时
 
     参数:
     - request: 视频创建请求
     - max_wait_seconds: 最大等待时间(秒)，默认300秒
-    - poll_interval: 轮询间隔(秒)，默认5秒
+    - poll_interval: 已弃用，轮询间隔由服务端 TASK_POLL_INTERVAL 统一控制
     """
-    if cookie_selector.count() == 0:
+    if cookie_pool.count() == 0:
         raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
+    await validate_callback_url(request.callback_url)
 
     try:
         # 创建视频
@@ -723,93 +3667,133 @@ async def create_video_and_wait(
         if request.image:
             payload["image"] = request.image
 
-        async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as client:
-            headers = get_headers()
-            response = await client.post(
-                f"{BASE_URL}/api/video/create",
-                json=payload,
-                headers=headers
-            )
-
-            # 检查是否被重定向到了登录页
-            if "/login" in str(response.url):
-                return {
-                    "success": False,
-                    "message": "创建失败: Session 已过期或无效"
-                }
-
-            if response.status_code != 200:
-                return {
-                    "success": False,
-                    "message": f"创建失败: {response.status_code}",
-                    "error": response.text
-                }
+        cookie, response = await post_create(payload)
 
-            create_result = response.json()
-            task_id = create_result.get("taskId") or create_result.get("id")
+        # 检查是否被重定向到了登录页
+        if "/login" in str(response.url):
+            return {
+                "success": False,
+                "message": "创建失败: Session 已过期或无效"
+            }
 
-            if not task_id:
-                return {
-                    "success": True,
-                    "message": "任务已创建但无法获取任务ID，请手动查询",
-                    "data": create_result
-                }
+        if response.status_code != 200:
+            return {
+                "success": False,
+                "message": f"创建失败: {response.status_code}",
+                "error": response.text
+            }
 
-            # 轮询等待
-            elapsed = 0
-            headers = get_headers()
-            del headers["content-type"]
+        create_result = response.json()
+        task_id = extract_task_id(create_result)
 
-            while elapsed < max_wait_seconds:
-                await asyncio.sleep(poll_interval)
-                elapsed += poll_interval
+        if not task_id:
+            return {
+                "success": True,
+                "message": "任务已创建但无法获取任务ID，请手动查询",
+                "data": create_result
+            }
 
-                # 重新获取 headers (因为 cookie 可能在轮询中变化，虽然目前是单次 client)
-                current_headers = get_headers()
-                del current_headers["content-type"]
+        # 等待后台任务跟踪器给出结果 (所有等待者共享同一轮询)
+        task_tracker.track(task_id, cookie, request.model, request.duration, request.callback_url)
+        task = await task_tracker.wait(task_id, max_wait_seconds)
 
-                videos_response = await client.get(
-                    f"{BASE_URL}/api/videos",
-                    headers=current_headers
-                )
+        if task.error:
+            return {
+                "success": False,
+                "message": task.error,
+                "task_id": task_id
+            }
 
-                if "/login" in str(videos_response.url):
-                    return {
-                        "success": False,
-                        "message": "轮询失败: Session 已过期或无效",
-                        "task_id": task_id
-                    }
-
-                if videos_response.status_code == 200:
-                    videos = videos_response.json()
-                    if isinstance(videos, list):
-                        for video in videos:
-                            if str(video.get("id")) == str(task_id) or video.get("taskId") == task_id:
-                                status = video.get("status")
-                                if status == "completed" or status == "success":
-                                    return {
-                                        "success": True,
-                                        "message": "视频生成完成",
-                                        "video_url": video.get("videoUrl"),
-                                        "data": video
-                                    }
-                                elif status == "failed" or status == "error":
-                                    return {
-                                        "success": False,
-                                        "message": "视频生成失败",
-                                        "data": video
-                                    }
+        if task.done and task.succeeded:
+            return {
+                "success": True,
+                "message": "视频生成完成",
+                "video_url": get_video_url(task.video),
+                "data": task.video
+            }
 
+        if task.done:
             return {
                 "success": False,
-                "message": f"等待超时({max_wait_seconds}秒)，请稍后手动查询",
-                "task_id": task_id
+                "message": "视频生成失败",
+                "data": task.video
             }
 
+        return {
+            "success": False,
+            "message": f"等待超时({max_wait_seconds}秒)，请稍后手动查询",
+            "task_id": task_id
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建视频出错: {str(e)}")
 
 
+
+# ==================== 持久化任务队列接口 ====================
+
+@app.post("/api/jobs", tags=["任务队列"])
+async def enqueue_job(
+    request: JobCreateRequest,
+    token: str = Depends(verify_auth_token)
+):
+    """
+    任务入队
+
+    任务写入持久化队列后立即返回任务ID，由后台工作协程按优先级提交给上游，
+    失败自动重试，服务重启后继续处理。参数相同且尚未结束的任务默认直接返回已有任务。
+    """
+    if cookie_pool.count() == 0:
+        raise HTTPException(status_code=401, detail="未配置SESSION_COOKIE")
+    await validate_callback_url(request.callback_url)
+
+    payload = {
+        "model": request.model,
+        "prompt": request.prompt,
+        "duration": request.duration,
+        "radio": request.radio
+    }
+    if request.image:
+        payload["image"] = request.image
+
+    job, duplicated = await job_queue.enqueue(payload, request.priority, request.callback_url, request.dedup)
+    return {
+        "success": True,
+        "message": "已有相同参数的任务" if duplicated else "任务已入队",
+        "duplicated": duplicated,
+        "data": job
+    }
+
+
+@app.get("/api/jobs/{job_id}", tags=["任务队列"])
+async def get_job(
+    job_id: str,
+    token: str = Depends(verify_auth_token)
+):
+    """查询队列任务状态 (queued/running/submitted/completed/failed/cancelled)"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, "status": job["status"], "video_url": job["video_url"], "data": job}
+
+
+@app.delete("/api/jobs/{job_id}", tags=["任务队列"])
+async def cancel_job(
+    job_id: str,
+    token: str = Depends(verify_auth_token)
+):
+    """取消尚未提交给上游的任务"""
+    if not await job_queue.cancel(job_id):
+        job = await job_queue.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        raise HTTPException(status_code=409, detail=f"任务状态为 {job['status']}，无法取消")
+    return {"success": True, "message": "任务已取消"}
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # log_config=None: 保留上面配置的日志队列，不让 uvicorn 覆盖
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)